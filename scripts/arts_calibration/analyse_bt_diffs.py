@@ -1,7 +1,6 @@
 # %%
 import pandas as pd
 import matplotlib.pyplot as plt
-import xarray as xr
 from src import readwrite_functions as rwfuncs
 
 # %% define frequencies
@@ -43,7 +42,7 @@ calib_oters = [
 
 next_flight_183 = ["202408"]
 
-# %% Read csv BTs
+# %% Read BTs
 dates = [
     "20240811",
     "20240813",
@@ -70,29 +69,17 @@ dates = [
     "20240928",
 ]
 
-TB_arts_list = []
-TB_hamp_list = []
-for date in dates:
-    TB_arts_list.append(
-        pd.read_csv(f"Data/arts_calibration/HALO-{date}a/TBs_arts.csv", index_col=0)
-    )
-    TB_hamp_list.append(
-        pd.read_csv(f"Data/arts_calibration/HALO-{date}a/TBs_hamp.csv", index_col=0)
-    )
-
-# load dropsonde data
-configfile = "config_ipns.yaml"
-cfg = rwfuncs.extract_config_params(configfile)
-ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
+ds_bts = rwfuncs.read_arts_bts("Data/arts_calibration/TBs.zarr")
+ds_bts = ds_bts.isel(
+    sonde_id=ds_bts["flight"].isin([f"HALO-{date}a" for date in dates]).values
+)
 
 # %% restructure data
-TB_arts = pd.concat(TB_arts_list, axis=1)
-TB_hamp = pd.concat(TB_hamp_list, axis=1)
-launch_time = ds_dropsonde.sel(sonde_id=TB_arts.columns).launch_time.values
-TB_arts.columns = launch_time
-TB_hamp.columns = launch_time
-TB_arts = TB_arts.T
-TB_hamp = TB_hamp.T
+ds_bts = ds_bts.swap_dims(sonde_id="launch_time").assign_coords(
+    frequency=ds_bts["frequency"].values.astype(float).round(2)
+)
+TB_arts = ds_bts["TB_arts"].to_pandas()
+TB_hamp = ds_bts["TB_hamp"].to_pandas()
 
 # %% calculate statistics for each flight
 diffs = TB_arts - TB_hamp
@@ -1,22 +1,27 @@
 # %%
+import multiprocessing
 import os
-import xarray as xr
+import sys
 from src import load_data_functions as loadfuncs
 from src.arts_functions import (
-    run_arts,
+    ArtsResultCache,
+    check_arts_batch,
+    run_arts_parallel,
     setup_workspace,
-    extrapolate_dropsonde,
-    get_profiles,
+    setup_abs_lookup,
+    get_abs_lookup_filename,
+    is_valid_workspace_cache,
+    extrapolate_dropsondes,
     average_double_bands,
     get_surface_temperature,
     get_surface_windspeed,
 )
-from src.plot_functions import plot_arts_flux
+from src.plot_functions import save_arts_flux_plot
 from src.ipfs_helpers import read_nc
 from orcestra.postprocess.level0 import bahamas
 from src import readwrite_functions as rwfuncs
-import yaml
 import pandas as pd
+import xarray as xr
 import numpy as np
 import typhon
 import pyarts
@@ -39,58 +44,75 @@ freq_183 = [center_freq_183 - w for w in width_183] + [
 all_freqs = freq_k + freq_v + freq_90 + freq_119 + freq_183
 all_freqs = np.sort(all_freqs)
 
-# %% setup workspace
-print("Download ARTS data")
-pyarts.cat.download.retrieve(verbose=True)
-ws = setup_workspace()
+# %% download ARTS data unless the prepared absorption setup is cached,
+# workspaces are set up in the worker processes
+workspace_cache = dict(
+    cache_dir="Data/arts_calibration/workspace", frequencies=all_freqs * 1e9
+)
+if not is_valid_workspace_cache(**workspace_cache):
+    print("Download ARTS data")
+    pyarts.cat.download.retrieve(verbose=True)
+
+# %% read config template
+config_template = rwfuncs.read_config_yaml("config_ipns.yaml")
+path_abs_lookup = "Data/arts_calibration/abs_lookup"
+path_arts_cache = "Data/arts_calibration/arts_cache"
+path_bts = "Data/arts_calibration/TBs.zarr"
+n_plot_workers = 2
 
 
-# %% define function
-def calc_arts_bts(date):
+# %% define functions
+def load_bahamas(flightname):
     """
-    Calculates brightness temperatures for the radiometer frequencies with
-    ARTS based on the dropsonde profiles for the flight on date.
+    Loads the bahamas data of a flight from ipfs.
 
     PARAMETERS
     ----------
-    date: date on which flight took place (str)
+    flightname: name of flight (str)
 
     RETURN:
     ------
-    None. Data is saved in arts_comparison folder.
+    ds_bahamas: bahamas data of flight (xr.Dataset)
     """
-
-    print("Read Config")
-    # change the date in config.yaml to date
-    configfile = "config_ipns.yaml"
-    with open(configfile, "r") as file:
-        config_yml = yaml.safe_load(file)
-    config_yml["date"] = date
-    with open(configfile, "w") as file:
-        yaml.dump(config_yml, file)
-    # read config
-    cfg = rwfuncs.extract_config_params(configfile)
-
-    # load bahamas data from ipfs
-    print("Load Bahamas Data")
-    ds_bahamas = (
+    return (
         read_nc(
-            f"ipns://latest.orcestra-campaign.org/raw/HALO/bahamas/{cfg['flightname']}/QL_*.nc"
+            f"ipns://latest.orcestra-campaign.org/raw/HALO/bahamas/{flightname}/QL_*.nc"
         )
         .pipe(bahamas)
         .interpolate_na("time")
     )
 
+
+def prepare_arts_profiles(cfg):
+    """
+    Loads the data of a flight and extrapolates the profiles of the cloud free
+    dropsondes to flight altitude.
+
+    PARAMETERS
+    ----------
+    cfg: configuration of flight (FlightConfig)
+
+    RETURN:
+    ------
+    ds_bahamas: bahamas data of flight (xr.Dataset)
+    freqs_hamp: frequencies of HAMP radiometers (np.ndarray)
+    cloud_free_idxs: sonde_ids of cloud free dropsondes (np.ndarray)
+    sondes: sonde_id, HAMP TBs, drop_time and run_arts keyword arguments
+        of each cloud free dropsonde that could be extrapolated (list[dict])
+    """
+
+    # load bahamas data from ipfs
+    print("Load Bahamas Data")
+    ds_bahamas = load_bahamas(cfg["flightname"])
+
     # read dropsonde data
     print("Load Dropsonde Data")
-    ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
-    ds_dropsonde = ds_dropsonde.where(
-        (ds_dropsonde["interp_time"] > pd.to_datetime(cfg["date"]))
-        & (
-            ds_dropsonde["interp_time"]
-            < pd.to_datetime(cfg["date"]) + pd.DateOffset(hour=23)
-        )
-    ).dropna(dim="sonde_id", how="all")
+    ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(
+        cfg["path_dropsondes"],
+        cfg["date"],
+        time_name="launch_time",
+        path_partitioned=cfg["path_dropsondes_partitioned"],
+    )
 
     # read HAMP post-processed data
     print("Load HAMP Data")
@@ -115,26 +137,18 @@ def calc_arts_bts(date):
         .values
     )
 
-    # initialize result arrays
-    freqs_hamp = hampdata.radiometers.frequency.values
-    TBs_arts = pd.DataFrame(index=freqs_hamp, columns=cloud_free_idxs)
-    TBs_hamp = TBs_arts.copy()
-    dropsondes_extrap = []
-
-    # setup folders
-    print("Setup Folders")
-    if not os.path.exists(f"Data/arts_calibration/{cfg['flightname']}"):
-        os.makedirs(f"Data/arts_calibration/{cfg['flightname']}")
-    if not os.path.exists(f"Data/arts_calibration/{cfg['flightname']}/plots"):
-        os.makedirs(f"Data/arts_calibration/{cfg['flightname']}/plots")
-
-    # loop over cloud free sondes
-    print(f"Running {cloud_free_idxs.size} dropsondes for {cfg['flightname']}")
-    for sonde_id in tqdm(cloud_free_idxs):
-        # get profiles
-        ds_dropsonde_loc, hampdata_loc, height, drop_time = get_profiles(
-            sonde_id, ds_dropsonde, hampdata
-        )
+    # extrapolate profiles of cloud free sondes at once
+    print(f"Preparing {cloud_free_idxs.size} dropsondes for {cfg['flightname']}")
+    ds_dropsonde = ds_dropsonde.sel(sonde_id=cloud_free_idxs)
+    radiometers = hampdata.radiometers.sel(
+        time=ds_dropsonde["launch_time"], method="nearest"
+    )
+    heights = radiometers["plane_altitude"].values
+    ds_extrap = extrapolate_dropsondes(ds_dropsonde, heights, ds_bahamas)
+
+    sondes = []
+    for i, sonde_id in enumerate(tqdm(cloud_free_idxs)):
+        ds_dropsonde_loc = ds_dropsonde.sel(sonde_id=sonde_id)
 
         # check if dropsonde is broken (contains only nan values)
         if ds_dropsonde_loc["ta"].isnull().mean().values == 1:
@@ -145,63 +159,296 @@ def calc_arts_bts(date):
         surface_temp = get_surface_temperature(ds_dropsonde_loc)
         surface_ws = get_surface_windspeed(ds_dropsonde_loc)
 
-        try:
-            # extrapolate dropsonde profiles
-            ds_dropsonde_extrap = extrapolate_dropsonde(
-                ds_dropsonde_loc, height, ds_bahamas
-            )
-            dropsondes_extrap.append(ds_dropsonde_extrap)
-
-            # run arts
-            run_arts(
-                pressure_profile=ds_dropsonde_extrap["p"].values,
-                temperature_profile=ds_dropsonde_extrap["ta"].values,
-                h2o_profile=typhon.physics.specific_humidity2vmr(
-                    ds_dropsonde_extrap["q"].values
-                ),
-                surface_ws=surface_ws,
-                surface_temp=surface_temp,
-                ws=ws,
-                frequencies=all_freqs * 1e9,
-                zenith_angle=180,
-                height=height,
+        # get extrapolated dropsonde profiles
+        ds_dropsonde_extrap = ds_extrap.sel(sonde_id=sonde_id).dropna("alt")
+        if ds_dropsonde_extrap.sizes["alt"] == 0:
+            print(f"Extrapolation failed for dropsonde {sonde_id}, skipping")
+            continue
+
+        profile = dict(
+            pressure_profile=ds_dropsonde_extrap["p"].values,
+            temperature_profile=ds_dropsonde_extrap["ta"].values,
+            h2o_profile=typhon.physics.specific_humidity2vmr(
+                ds_dropsonde_extrap["q"].values
+            ),
+            surface_ws=surface_ws,
+            surface_temp=surface_temp,
+            frequencies=all_freqs * 1e9,
+            zenith_angle=180,
+            height=float(heights[i]),
+        )
+        sondes.append(
+            dict(
+                sonde_id=sonde_id,
+                TB_hamp=radiometers["TBs"].sel(sonde_id=sonde_id).values,
+                drop_time=ds_dropsonde_loc["launch_time"].values,
+                profile=profile,
             )
-        except (ValueError, KeyError, RuntimeError) as e:
+        )
+
+    freqs_hamp = hampdata.radiometers.frequency.values
+    return ds_bahamas, freqs_hamp, cloud_free_idxs, sondes
+
+
+def prepare_abs_lookup(profiles, use_abs_lookup=False):
+    """
+    Sets up the absorption lookup table once, workers read it from disk.
+
+    PARAMETERS
+    ----------
+    profiles: run_arts keyword arguments of each dropsonde (list[dict])
+    use_abs_lookup: interpolate absorption from a lookup table which is
+        calculated once and cached in Data/arts_calibration/abs_lookup (bool)
+
+    RETURN:
+    ------
+    abs_lookup: setup_abs_lookup keyword arguments or None (dict)
+    profiles: run_arts keyword arguments of each dropsonde (list[dict])
+    """
+    if not use_abs_lookup:
+        return None, profiles
+
+    abs_lookup = dict(
+        frequencies=all_freqs * 1e9,
+        filename=get_abs_lookup_filename(path_abs_lookup, all_freqs * 1e9),
+    )
+    if not os.path.exists(abs_lookup["filename"]):
+        setup_abs_lookup(setup_workspace(**workspace_cache), **abs_lookup)
+    profiles = [dict(profile, use_abs_lookup=True) for profile in profiles]
+    return abs_lookup, profiles
+
+
+def save_arts_results(flightname, freqs_hamp, sondes, results):
+    """
+    Averages the double bands of the ARTS results and writes them together
+    with the HAMP TBs to the campaign store of brightness temperatures,
+    replacing earlier results of the flight.
+
+    PARAMETERS
+    ----------
+    flightname: name of flight (str)
+    freqs_hamp: frequencies of HAMP radiometers (np.ndarray)
+    sondes: sondes as returned by prepare_arts_profiles (list[dict])
+    results: result of run_arts (or None) and error message (or None) for
+        each sonde (list[tuple])
+
+    RETURN:
+    ------
+    ds_bts: ARTS and HAMP TBs of flight (xr.Dataset)
+    """
+
+    # initialize result arrays
+    TBs_arts = pd.DataFrame(
+        index=freqs_hamp, columns=[sonde["sonde_id"] for sonde in sondes], dtype=float
+    )
+    TBs_hamp = TBs_arts.copy()
+
+    simulated = []
+    for sonde, (result, error) in zip(sondes, results):
+        if error is not None:
             print(
-                f"ARTS or extrapolation failed for dropsonde {sonde_id} with error: {e}, skipping"
+                f"ARTS failed for dropsonde {sonde['sonde_id']} with error: {error}, skipping"
             )
-            pass
+            continue
+        simulated.append((sonde, result))
+
+    if len(simulated) > 0:
+        sonde_ids = [sonde["sonde_id"] for sonde, _ in simulated]
 
         # get according hamp data
-        TBs_hamp[sonde_id] = hampdata_loc.radiometers.TBs.values
+        TBs_hamp[sonde_ids] = np.stack([sonde["TB_hamp"] for sonde, _ in simulated]).T
 
-        # average double bands
-        TB_arts = pd.DataFrame(
-            data=np.array(ws.y.value), index=np.float32(np.array(ws.f_grid.value) / 1e9)
-        )
-        TBs_arts[sonde_id] = average_double_bands(
-            TB_arts,
+        # average double bands of all sondes at once
+        f_grid = simulated[0][1][0]
+        TBs_arts[sonde_ids] = average_double_bands(
+            np.stack([y for _, (_, y, _) in simulated]),
             freqs_hamp,
+            f_grid=f_grid / 1e9,
+        ).T
+
+    # save results, only cloud free sondes are simulated
+    ds_bts = xr.Dataset(
+        {
+            "TB_arts": (("sonde_id", "frequency"), TBs_arts.T.values),
+            "TB_hamp": (("sonde_id", "frequency"), TBs_hamp.T.values),
+        },
+        coords={
+            "sonde_id": TBs_arts.columns.values,
+            "frequency": freqs_hamp,
+            "launch_time": (
+                "sonde_id",
+                np.array([sonde["drop_time"] for sonde in sondes], "datetime64[ns]"),
+            ),
+            "flight": ("sonde_id", np.full(len(sondes), flightname)),
+            "radar_cloud_flag": ("sonde_id", np.zeros(len(sondes), dtype="int8")),
+        },
+    )
+    rwfuncs.write_arts_bts(ds_bts, path_bts)
+    return ds_bts
+
+
+def submit_arts_plot(
+    pool, flightname, sonde_id, TB_hamp, TB_arts, freqs_hamp, drop_time, ds_bahamas
+):
+    """
+    Hands the plot comparing ARTS to HAMP TBs of one dropsonde to a process
+    pool. Only the bahamas data at the drop time is passed on.
+
+    RETURN:
+    ------
+    AsyncResult of save_arts_flux_plot
+    """
+    os.makedirs(f"Data/arts_calibration/{flightname}/plots", exist_ok=True)
+    return pool.apply_async(
+        save_arts_flux_plot,
+        (
+            f"Data/arts_calibration/{flightname}/plots/{sonde_id}.png",
+            pd.Series(TB_hamp, index=freqs_hamp),
+            pd.Series(TB_arts, index=freqs_hamp),
+            sonde_id,
+            drop_time,
+            ds_bahamas[["TS"]].sel(time=[drop_time], method="nearest").load(),
+        ),
+    )
+
+
+def plot_arts_results(ds_bts, ds_bahamas, n_workers=n_plot_workers):
+    """
+    Renders the plots comparing ARTS to HAMP TBs of stored results of one
+    flight in parallel.
+
+    PARAMETERS
+    ----------
+    ds_bts: ARTS and HAMP TBs of flight as written by save_arts_results
+        (xr.Dataset)
+    ds_bahamas: bahamas data of flight (xr.Dataset)
+    n_workers: number of parallel plotting processes (int)
+
+    RETURN:
+    ------
+    None. Plots are saved in Data/arts_calibration/{flightname}/plots.
+    """
+    simulated = ds_bts["TB_arts"].notnull().any("frequency").values
+    ds_bts = ds_bts.isel(sonde_id=simulated).load()
+    with multiprocessing.Pool(n_workers) as pool:
+        plots = []
+        for sonde_id in ds_bts["sonde_id"].values:
+            ds_sonde = ds_bts.sel(sonde_id=sonde_id)
+            plots.append(
+                submit_arts_plot(
+                    pool,
+                    str(ds_sonde["flight"].values),
+                    str(sonde_id),
+                    ds_sonde["TB_hamp"].values,
+                    ds_sonde["TB_arts"].values,
+                    ds_bts["frequency"].values,
+                    ds_sonde["launch_time"].values,
+                    ds_bahamas,
+                )
+            )
+        for plot in tqdm(plots):
+            plot.get()
+
+
+def calc_arts_bts(
+    date,
+    flightletter="a",
+    n_workers=None,
+    use_abs_lookup=False,
+    use_cache=True,
+    plot=True,
+    batch_size=None,
+):
+    """
+    Calculates brightness temperatures for the radiometer frequencies with
+    ARTS based on the dropsonde profiles for the flight on date.
+
+    PARAMETERS
+    ----------
+    date: date on which flight took place (str)
+    flightletter: letter of flight on date (str)
+    n_workers: number of parallel ARTS processes, defaults to number of CPUs (int)
+    use_abs_lookup: interpolate absorption from a lookup table which is
+        calculated once and cached in Data/arts_calibration/abs_lookup (bool)
+    use_cache: reuse ARTS results of identical inputs from earlier runs, cached
+        in Data/arts_calibration/arts_cache (bool)
+    plot: plot ARTS against HAMP TBs of each sonde in separate processes while
+        ARTS is running, skip for bulk runs (bool)
+    batch_size: number of dropsondes per ARTS call (ybatchCalc), None runs
+        each dropsonde separately. Batched results of the first batch are
+        checked against separate runs first (int)
+
+    RETURN:
+    ------
+    None. Data is saved in Data/arts_calibration.
+    """
+
+    print("Read Config")
+    cfg = rwfuncs.FlightConfig(config_template, date, flightletter=flightletter)
+
+    ds_bahamas, freqs_hamp, cloud_free_idxs, sondes = prepare_arts_profiles(cfg)
+    abs_lookup, profiles = prepare_abs_lookup(
+        [sonde["profile"] for sonde in sondes], use_abs_lookup
+    )
+
+    if batch_size is not None:
+        check_arts_batch(
+            profiles,
+            batch_size,
+            n_workers=n_workers,
+            abs_lookup=abs_lookup,
+            workspace_cache=workspace_cache,
+        )
+
+    # queue plots of finished sondes while arts is running
+    plot_pool = multiprocessing.Pool(n_plot_workers) if plot else None
+    plots = []
+
+    def queue_plot(i, result, error):
+        if plot_pool is None or error is not None:
+            return
+        f_grid, y, _ = result
+        plots.append(
+            submit_arts_plot(
+                plot_pool,
+                cfg["flightname"],
+                sondes[i]["sonde_id"],
+                sondes[i]["TB_hamp"],
+                average_double_bands(y, freqs_hamp, f_grid=f_grid / 1e9),
+                freqs_hamp,
+                sondes[i]["drop_time"],
+                ds_bahamas,
+            )
         )
 
-        # Plot to compare arts to hamp radiometers
-        fig, ax = plot_arts_flux(
-            TBs_hamp[sonde_id],
-            TBs_arts[sonde_id],
-            dropsonde_id=sonde_id,
-            time=drop_time,
-            ds_bahamas=ds_bahamas,
+    # run arts for all sondes in parallel
+    print(f"Running {len(profiles)} dropsondes for {cfg['flightname']}")
+    cache = ArtsResultCache(path_arts_cache) if use_cache else None
+    try:
+        results = run_arts_parallel(
+            profiles,
+            n_workers=n_workers,
+            abs_lookup=abs_lookup,
+            cache=cache,
+            workspace_cache=workspace_cache,
+            on_result=queue_plot,
+            batch_size=batch_size,
         )
-        fig.savefig(f"Data/arts_calibration/{cfg['flightname']}/plots/{sonde_id}.png")
-        fig.clf()
+        save_arts_results(cfg["flightname"], freqs_hamp, sondes, results)
 
-    # save results
-    TBs_arts.to_csv(f"Data/arts_calibration/{cfg['flightname']}/TBs_arts.csv")
-    TBs_hamp.to_csv(f"Data/arts_calibration/{cfg['flightname']}/TBs_hamp.csv")
+        print(f"Waiting for {len(plots)} plots")
+        for plot_result in plots:
+            plot_result.get()
+    finally:
+        if plot_pool is not None:
+            plot_pool.close()
+            plot_pool.join()
 
 
 # %% call function
-# date = str(sys.argv[1])
-calc_arts_bts("20240827")
+# python arts_bt_calculation.py <date> [batch_size]
+if __name__ == "__main__":  # guard for worker processes of run_arts_parallel
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    calc_arts_bts(str(sys.argv[1]), batch_size=batch_size)
 
 # %%
@@ -0,0 +1,435 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import json
+import pickle
+import subprocess
+import numpy as np
+from tqdm import tqdm
+from src import readwrite_functions as rwfuncs
+from src.arts_functions import (
+    ArtsResultCache,
+    check_arts_batch,
+    is_valid_workspace_cache,
+    iter_arts_parallel,
+    setup_workspace,
+)
+from arts_bt_calculation import (
+    config_template,
+    path_arts_cache,
+    plot_arts_results,
+    prepare_arts_profiles,
+    prepare_abs_lookup,
+    save_arts_results,
+    workspace_cache,
+)
+
+# %% flights of campaign and scheduler settings
+dates = [
+    "20240811",
+    "20240813",
+    "20240816",
+    "20240818",
+    "20240821",
+    "20240822",
+    "20240825",
+    "20240827",
+    "20240829",
+    "20240831",
+    "20240903",
+    "20240906",
+    "20240907",
+    "20240909",
+    "20240912",
+    "20240914",
+    "20240916",
+    "20240919",
+    "20240921",
+    "20240923",
+    "20240924",
+    "20240926",
+    "20240928",
+]
+max_attempts = 3
+path_progress = "Data/arts_calibration/campaign_progress.json"
+path_job_script = os.path.join(os.path.dirname(__file__), "call_arts_campaign.sh")
+
+
+# %% define functions
+def get_task_dir(flightname):
+    """Directory with the checkpointed tasks of a flight."""
+    return f"Data/arts_calibration/{flightname}/tasks"
+
+
+def get_flightname(date):
+    return rwfuncs.FlightConfig(config_template, date)["flightname"]
+
+
+def prepare_flight(date):
+    """
+    Loads the data of a flight and stores the ARTS inputs of its cloud free
+    dropsondes, unless this has been done in an earlier run. The prepared
+    absorption setup of the workspaces is cached here as well, so that the
+    jobs running ARTS only read it.
+
+    PARAMETERS
+    ----------
+    date: date on which flight took place (str)
+
+    RETURN:
+    ------
+    flightname: name of flight (str)
+    """
+    if not is_valid_workspace_cache(**workspace_cache):
+        setup_workspace(**workspace_cache)
+
+    cfg = rwfuncs.FlightConfig(config_template, date)
+    task_dir = get_task_dir(cfg["flightname"])
+    filename = f"{task_dir}/prepared.pkl"
+    if os.path.exists(filename):
+        return cfg["flightname"]
+
+    ds_bahamas, freqs_hamp, cloud_free_idxs, sondes = prepare_arts_profiles(cfg)
+    prepared = dict(
+        ds_bahamas=ds_bahamas[["TS"]].load(),
+        freqs_hamp=freqs_hamp,
+        cloud_free_idxs=cloud_free_idxs,
+        sondes=sondes,
+    )
+    os.makedirs(task_dir, exist_ok=True)
+    with open(f"{filename}.{os.getpid()}.tmp", "wb") as f:
+        pickle.dump(prepared, f)
+    os.replace(f"{filename}.{os.getpid()}.tmp", filename)
+    return cfg["flightname"]
+
+
+def load_prepared_flight(flightname):
+    filename = f"{get_task_dir(flightname)}/prepared.pkl"
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
+
+def get_task_status(flightname, sonde_id):
+    """
+    Status of the task of one dropsonde from its checkpoint files.
+
+    RETURN:
+    ------
+    status: "done", "failed" (no attempts left) or "pending" (str)
+    attempts: number of failed attempts (int)
+    """
+    task_dir = get_task_dir(flightname)
+    if os.path.exists(f"{task_dir}/{sonde_id}.npz"):
+        return "done", 0
+    if not os.path.exists(f"{task_dir}/{sonde_id}.failed.json"):
+        return "pending", 0
+    with open(f"{task_dir}/{sonde_id}.failed.json") as f:
+        attempts = json.load(f)["attempts"]
+    return ("failed" if attempts >= max_attempts else "pending"), attempts
+
+
+def get_tasks(dates):
+    """
+    All tasks (flightname, sonde) of the prepared flights in a fixed order,
+    so that every job of a job array assigns them identically.
+    """
+    tasks = []
+    for date in dates:
+        flightname = get_flightname(date)
+        prepared = load_prepared_flight(flightname)
+        if prepared is None:
+            continue
+        tasks += [(flightname, sonde) for sonde in prepared["sondes"]]
+    return tasks
+
+
+def write_task_result(flightname, sonde_id, result, error):
+    """Checkpoint the result or the failed attempt of one task."""
+    task_dir = get_task_dir(flightname)
+    if error is None:
+        f_grid, y, optical_depth = result
+        tmpname = f"{task_dir}/{sonde_id}.{os.getpid()}.tmp.npz"
+        np.savez(tmpname, f_grid=f_grid, y=y, optical_depth=optical_depth)
+        os.replace(tmpname, f"{task_dir}/{sonde_id}.npz")
+        if os.path.exists(f"{task_dir}/{sonde_id}.failed.json"):
+            os.remove(f"{task_dir}/{sonde_id}.failed.json")
+        return
+
+    _, attempts = get_task_status(flightname, sonde_id)
+    with open(f"{task_dir}/{sonde_id}.failed.json", "w") as f:
+        json.dump(dict(attempts=attempts + 1, error=error), f)
+
+
+def read_task_result(flightname, sonde_id):
+    """Result of run_arts (or None) and error message (or None) of one task."""
+    task_dir = get_task_dir(flightname)
+    if os.path.exists(f"{task_dir}/{sonde_id}.npz"):
+        with np.load(f"{task_dir}/{sonde_id}.npz") as data:
+            return (data["f_grid"], data["y"], data["optical_depth"]), None
+    if os.path.exists(f"{task_dir}/{sonde_id}.failed.json"):
+        with open(f"{task_dir}/{sonde_id}.failed.json") as f:
+            return None, json.load(f)["error"]
+    return None, "not run"
+
+
+def run_tasks(
+    tasks, n_workers=None, use_abs_lookup=False, use_cache=True, batch_size=None
+):
+    """
+    Runs ARTS for the pending tasks in one process pool and retries failed
+    tasks until they succeed or have no attempts left.
+
+    PARAMETERS
+    ----------
+    tasks: tasks (flightname, sonde) to run (list[tuple])
+    n_workers: number of parallel ARTS processes, defaults to number of CPUs (int)
+    use_abs_lookup: interpolate absorption from a lookup table (bool)
+    use_cache: reuse ARTS results of identical inputs from earlier runs (bool)
+    batch_size: number of dropsondes per ARTS call (ybatchCalc), None runs
+        each dropsonde separately. Batched results of the first batch are
+        checked against separate runs before all tasks are run (int)
+
+    RETURN:
+    ------
+    None. Results are checkpointed in the task directories of the flights.
+    """
+    cache = ArtsResultCache(path_arts_cache) if use_cache else None
+    batch_checked = batch_size is None
+    for _ in range(max_attempts):
+        pending = [
+            (flightname, sonde)
+            for flightname, sonde in tasks
+            if get_task_status(flightname, sonde["sonde_id"])[0] == "pending"
+        ]
+        if len(pending) == 0:
+            return
+
+        abs_lookup, profiles = prepare_abs_lookup(
+            [sonde["profile"] for _, sonde in pending], use_abs_lookup
+        )
+        if not batch_checked:
+            check_arts_batch(
+                profiles,
+                batch_size,
+                n_workers=n_workers,
+                abs_lookup=abs_lookup,
+                workspace_cache=workspace_cache,
+            )
+            batch_checked = True
+        print(f"Running {len(pending)} of {len(tasks)} tasks")
+        results = iter_arts_parallel(
+            profiles,
+            n_workers=n_workers,
+            abs_lookup=abs_lookup,
+            cache=cache,
+            workspace_cache=workspace_cache,
+            batch_size=batch_size,
+        )
+        for (flightname, sonde), (result, error) in tqdm(
+            zip(pending, results), total=len(pending)
+        ):
+            write_task_result(flightname, sonde["sonde_id"], result, error)
+
+
+def collect_flight(flightname, plot=True, recollect=False):
+    """
+    Saves the brightness temperatures and plots of a flight once all its tasks
+    are finished and marks the flight as collected. Plotting is skipped if plot
+    is False. Flights collected before are skipped unless recollect is True.
+
+    RETURN:
+    ------
+    status: number of tasks of flight per status (dict)
+    """
+    filename = f"{get_task_dir(flightname)}/collected.json"
+    if os.path.exists(filename) and not recollect:
+        with open(filename) as f:
+            return json.load(f)
+
+    prepared = load_prepared_flight(flightname)
+    if prepared is None:
+        return dict(prepared=False)
+
+    statuses = [
+        get_task_status(flightname, sonde["sonde_id"])[0]
+        for sonde in prepared["sondes"]
+    ]
+    status = dict(
+        prepared=True,
+        tasks=len(statuses),
+        done=statuses.count("done"),
+        failed=statuses.count("failed"),
+        pending=statuses.count("pending"),
+        collected=False,
+    )
+    if status["pending"] > 0:
+        return status
+
+    results = [
+        read_task_result(flightname, sonde["sonde_id"]) for sonde in prepared["sondes"]
+    ]
+    ds_bts = save_arts_results(
+        flightname, prepared["freqs_hamp"], prepared["sondes"], results
+    )
+    if plot:
+        plot_arts_results(ds_bts, prepared["ds_bahamas"])
+    status["collected"] = True
+    with open(f"{filename}.{os.getpid()}.tmp", "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(f"{filename}.{os.getpid()}.tmp", filename)
+    return status
+
+
+def collect_campaign(dates, plot=True, recollect=False):
+    """
+    Collects all finished flights which have not been collected before (all
+    if recollect is True) and writes the progress of the campaign.
+    """
+    progress = {}
+    for date in dates:
+        flightname = get_flightname(date)
+        progress[flightname] = collect_flight(flightname, plot, recollect)
+        print(f"{flightname}: {progress[flightname]}")
+
+    with open(f"{path_progress}.tmp", "w") as f:
+        json.dump(progress, f, indent=2)
+    os.replace(f"{path_progress}.tmp", path_progress)
+    return progress
+
+
+def run_campaign_local(
+    dates,
+    n_workers=None,
+    use_abs_lookup=False,
+    use_cache=True,
+    plot=True,
+    batch_size=None,
+):
+    """
+    Runs ARTS for all dropsondes of all flights on the local machine. All
+    flights share one process pool. Reruns resume from the checkpoints.
+    With batch_size, batch_size dropsondes are run per ARTS call, see run_tasks.
+    """
+    for date in dates:
+        try:
+            prepare_flight(date)
+        except Exception as e:
+            print(f"Preparing flight on {date} failed with error: {e}, skipping")
+
+    run_tasks(get_tasks(dates), n_workers, use_abs_lookup, use_cache, batch_size)
+    return collect_campaign(dates, plot)
+
+
+def run_task_chunk(
+    dates,
+    n_chunks,
+    index,
+    n_workers=None,
+    use_abs_lookup=False,
+    use_cache=True,
+    batch_size=None,
+):
+    """
+    Runs every n_chunks-th task starting at index, one job of a job array.
+    See run_tasks for the options.
+    """
+    run_tasks(
+        get_tasks(dates)[index::n_chunks],
+        n_workers,
+        use_abs_lookup,
+        use_cache,
+        batch_size,
+    )
+
+
+def format_options(use_abs_lookup=False, use_cache=True, batch_size=None):
+    """Command line arguments of the run options, see parse_options."""
+    options = [f"use_abs_lookup={int(use_abs_lookup)}", f"use_cache={int(use_cache)}"]
+    if batch_size is not None:
+        options.append(f"batch_size={batch_size}")
+    return options
+
+
+def parse_options(args):
+    """
+    Run options from command line arguments key=value, e.g. batch_size=16.
+
+    RETURN:
+    ------
+    options: keyword arguments use_abs_lookup, use_cache and batch_size of
+        run_tasks (dict)
+    """
+    args = dict(arg.split("=", 1) for arg in args)
+    unknown = set(args) - {"use_abs_lookup", "use_cache", "batch_size"}
+    if unknown:
+        raise ValueError(f"Unknown options {sorted(unknown)}")
+    return dict(
+        use_abs_lookup=bool(int(args.get("use_abs_lookup", 0))),
+        use_cache=bool(int(args.get("use_cache", 1))),
+        batch_size=int(args["batch_size"]) if "batch_size" in args else None,
+    )
+
+
+def submit_campaign_slurm(
+    dates, n_chunks=8, use_abs_lookup=False, use_cache=True, batch_size=None
+):
+    """
+    Submits the campaign as SLURM jobs: a job array preparing the flights,
+    a job array running the ARTS tasks once all flights are prepared and a
+    job collecting the results once all tasks are finished. Resubmitting
+    resumes from the checkpoints. The run options (see run_tasks) are passed
+    on to every job running ARTS tasks.
+    """
+
+    def sbatch(*args):
+        output = subprocess.run(
+            ["sbatch", "--parsable", *args], capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip().split(";")[0]
+
+    job_prepare = sbatch(f"--array=0-{len(dates) - 1}", path_job_script, "prepare")
+    job_run = sbatch(
+        f"--dependency=afterany:{job_prepare}",
+        f"--array=0-{n_chunks - 1}",
+        path_job_script,
+        "run",
+        str(n_chunks),
+        *format_options(use_abs_lookup, use_cache, batch_size),
+    )
+    job_collect = sbatch(f"--dependency=afterany:{job_run}", path_job_script, "collect")
+    print(f"Submitted jobs {job_prepare} (prepare), {job_run} (run), {job_collect}")
+
+
+# %% call function
+# python arts_campaign.py local [n_workers] [options] | submit [n_chunks] [options]
+# job array steps: prepare <index> | run <n_chunks> [options] <index>
+# | collect [recollect]
+# options: use_abs_lookup=0|1 use_cache=0|1 batch_size=<n>, see run_tasks
+if __name__ == "__main__":  # guard for worker processes of iter_arts_parallel
+    command = sys.argv[1]
+    if command == "local":
+        args = [arg for arg in sys.argv[2:] if "=" not in arg]
+        n_workers = int(args[0]) if args else None
+        options = parse_options([arg for arg in sys.argv[2:] if "=" in arg])
+        run_campaign_local(dates, n_workers=n_workers, **options)
+    elif command == "submit":
+        args = [arg for arg in sys.argv[2:] if "=" not in arg]
+        n_chunks = int(args[0]) if args else 8
+        options = parse_options([arg for arg in sys.argv[2:] if "=" in arg])
+        submit_campaign_slurm(dates, n_chunks, **options)
+    elif command == "prepare":
+        prepare_flight(dates[int(sys.argv[2])])
+    elif command == "run":
+        options = parse_options(sys.argv[3:-1])
+        run_task_chunk(dates, int(sys.argv[2]), int(sys.argv[-1]), **options)
+    elif command == "collect":
+        collect_campaign(dates, recollect="recollect" in sys.argv[2:])
+    else:
+        raise ValueError(f"Unknown command {command}")
+
+# %%
@@ -0,0 +1,38 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import shutil
+import time
+import pyarts
+from src.arts_functions import setup_workspace
+from arts_bt_calculation import all_freqs  # HAMP frequency grid of the ARTS runs
+
+# %% measure startup with and without prepared absorption setup
+cache_dir = "Data/arts_calibration/workspace_benchmark"
+if os.path.exists(cache_dir):
+    shutil.rmtree(cache_dir)
+
+
+def time_setup(**kwargs):
+    starttime = time.perf_counter()
+    setup_workspace(**kwargs)
+    return time.perf_counter() - starttime
+
+
+starttime = time.perf_counter()
+pyarts.cat.download.retrieve(verbose=True)
+t_retrieve = time.perf_counter() - starttime
+t_catalog = time_setup()
+t_write = time_setup(cache_dir=cache_dir, frequencies=all_freqs * 1e9)
+t_cache = time_setup(cache_dir=cache_dir, frequencies=all_freqs * 1e9)
+
+print(f"pyarts.cat.download.retrieve = {t_retrieve:.2f}s")
+print(f"setup_workspace from catalog = {t_catalog:.2f}s")
+print(f"setup_workspace from catalog incl. writing cache = {t_write:.2f}s")
+print(f"setup_workspace from cache = {t_cache:.2f}s")
+print(f"startup before = {t_retrieve + t_catalog:.2f}s, after = {t_cache:.2f}s")
+
+# %%
@@ -0,0 +1,17 @@
+#!/bin/bash
+#SBATCH --job-name=arts_campaign # Specify job name
+#SBATCH --output=arts_campaign.o%j # name for standard output log file
+#SBATCH --error=arts_campaign.e%j # name for standard error output log
+#SBATCH --partition=compute
+#SBATCH --account=bm1183
+#SBATCH --nodes=1
+#SBATCH --time=02:00:00
+#SBATCH --mem=0
+
+# Set pythonpath
+export PYTHONPATH="${PYTHONPATH}:/home/m/m301049/hamp_processing/"
+
+# execute campaign step, job arrays append their index to the arguments, so
+# run options (use_abs_lookup=0|1 use_cache=0|1 batch_size=<n>) are passed on
+# in front of it, e.g. call_arts_campaign.sh run <n_chunks> batch_size=16
+/home/m/m301049/.conda/envs/main/bin/python /home/m/m301049/hamp_processing/scripts/arts_calibration/arts_campaign.py "$@" $SLURM_ARRAY_TASK_ID
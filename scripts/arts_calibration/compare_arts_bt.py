@@ -33,14 +33,12 @@ path_saveplts = cfg["path_saveplots"]
 flightname = cfg["flightname"]
 
 # %% read dropsonde data
-ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
-ds_dropsonde = ds_dropsonde.where(
-    (ds_dropsonde["interp_time"] > pd.to_datetime(cfg["date"]))
-    & (
-        ds_dropsonde["interp_time"]
-        < pd.to_datetime(cfg["date"]) + pd.DateOffset(hour=23)
-    )
-).dropna(dim="sonde_id", how="all")
+ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(
+    cfg["path_dropsondes"],
+    cfg["date"],
+    time_name="launch_time",
+    path_partitioned=cfg["path_dropsondes_partitioned"],
+)
 
 # %% create HAMP post-processed data
 hampdata = loadfuncs.load_hamp_data(
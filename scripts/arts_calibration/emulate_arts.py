@@ -0,0 +1,140 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import time
+import numpy as np
+import pandas as pd
+from src import readwrite_functions as rwfuncs
+from src.arts_emulator import ArtsEmulator, train_emulator
+from src.arts_functions import ArtsResultCache, run_arts_parallel
+from arts_bt_calculation import (
+    center_freq_119,
+    center_freq_183,
+    config_template,
+    freq_90,
+    freq_k,
+    freq_v,
+    path_arts_cache,
+    prepare_arts_profiles,
+    width_119,
+    width_183,
+    workspace_cache,
+)
+
+# %% HAMP channels and emulator file
+freqs_hamp = np.float32(
+    freq_k
+    + freq_v
+    + freq_90
+    + [center_freq_119 + w for w in width_119]
+    + [center_freq_183 + w for w in width_183]
+)
+path_emulator = "Data/arts_calibration/arts_emulator.npz"
+
+
+def print_stats(stats):
+    print(
+        pd.DataFrame(
+            {name: stats[name] for name in ["bias", "rmse", "max_abs_error"]},
+            index=pd.Index(np.round(stats["frequency"], 2), name="frequency"),
+        ).round(3)
+    )
+
+
+def load_flight_profiles(date):
+    """Returns name of flight on date and ARTS inputs of its cloud free sondes."""
+    cfg = rwfuncs.FlightConfig(config_template, date)
+    _, _, _, sondes = prepare_arts_profiles(cfg)
+    return cfg["flightname"], [sonde["profile"] for sonde in sondes]
+
+
+# %% define commands
+def train(holdout_dates=()):
+    """
+    Trains the emulator on all cached ARTS runs except those of the sondes of
+    the flights on holdout_dates, which are kept for evaluate, and saves it.
+    """
+    cache = ArtsResultCache(path_arts_cache)
+    holdout_flights, exclude = [], set()
+    for date in holdout_dates:
+        flightname, profiles = load_flight_profiles(date)
+        holdout_flights.append(flightname)
+        exclude.update(cache.profile_key(profile) for profile in profiles)
+
+    emulator = train_emulator(cache, freqs_hamp=freqs_hamp, exclude=exclude)
+    emulator.stats["holdout_flights"] = np.array(holdout_flights, dtype=str)
+    emulator.save(path_emulator)
+    if emulator.stats["n_test"] > 0:
+        print(
+            f"Trained on {emulator.stats['n_train']} ARTS runs, "
+            f"held-out errors of {emulator.stats['n_test']} ARTS runs [K]:"
+        )
+        print_stats(emulator.stats)
+    else:
+        print(
+            f"Trained on {emulator.stats['n_train']} ARTS runs, "
+            "too few ARTS runs to hold out any for testing"
+        )
+    print(f"Flights held out for evaluation: {holdout_flights}")
+
+
+def evaluate(date):
+    """
+    Evaluates the saved emulator against ARTS for the sondes of a flight which
+    was held out of training (see train). ARTS is run without the result cache
+    to compare the run times.
+    """
+    emulator = ArtsEmulator.load(path_emulator)
+    flightname, profiles = load_flight_profiles(date)
+    if flightname not in emulator.stats.get("holdout_flights", []):
+        raise ValueError(
+            f"{flightname} was not held out of training of the emulator, "
+            f"train it with python emulate_arts.py train {date}"
+        )
+
+    start = time.perf_counter()
+    emulator.predict(profiles)
+    time_emulator = time.perf_counter() - start
+    ood = emulator.is_out_of_distribution(profiles)
+
+    start = time.perf_counter()
+    results = run_arts_parallel(
+        profiles,
+        cache=None,
+        workspace_cache=workspace_cache,
+    )
+    time_arts = time.perf_counter() - start
+
+    simulated = [i for i, (_, error) in enumerate(results) if error is None]
+    print(
+        f"{len(simulated)} sondes of {flightname}, "
+        f"{ood.sum()} out of distribution of emulator"
+    )
+    print("Errors of emulator [K]:")
+    print_stats(
+        emulator.evaluate(
+            [profiles[i] for i in simulated],
+            [results[i][0] for i in simulated],
+            freqs_hamp=freqs_hamp,
+        )
+    )
+    print(
+        f"Emulator: {time_emulator / len(profiles) * 1e6:.0f}us per profile, "
+        f"ARTS: {time_arts / len(profiles):.2f}s per profile"
+    )
+
+
+# %% call command
+# python emulate_arts.py train [holdout_date ...] | evaluate <holdout_date>
+if __name__ == "__main__":  # guard for worker processes of run_arts_parallel
+    if sys.argv[1] == "train":
+        train(sys.argv[2:])
+    elif sys.argv[1] == "evaluate":
+        evaluate(sys.argv[2])
+    else:
+        raise ValueError(f"Unknown command {sys.argv[1]}")
+
+# %%
@@ -1,34 +1,10 @@
 # %%
-import os
+import sys
+from arts_campaign import dates, run_campaign_local, submit_campaign_slurm
 
-path = os.getcwd()
-
-dates = [
-    "20240811",
-    "20240813",
-    "20240816",
-    "20240818",
-    "20240821",
-    "20240822",
-    "20240825",
-    "20240827",
-    "20240829",
-    "20240831",
-    "20240903",
-    "20240906",
-    "20240907",
-    "20240909",
-    "20240912",
-    "20240914",
-    "20240916",
-    "20240919",
-    "20240921",
-    "20240923",
-    "20240924",
-    "20240926",
-    "20240928",
-]
-
-for date in dates:
-    print("-----node line -----")
-    os.system(f"sbatch {path}/scripts/arts_calibration/call_bt_calculation.sh {date}")
+# %% run ARTS for all flights as SLURM jobs, or locally with argument "local"
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "local":
+        run_campaign_local(dates)
+    else:
+        submit_campaign_slurm(dates)
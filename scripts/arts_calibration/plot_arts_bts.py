@@ -0,0 +1,25 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import numpy as np
+from src import readwrite_functions as rwfuncs
+from arts_bt_calculation import load_bahamas, path_bts, plot_arts_results
+
+# %% render plots of stored ARTS results, all flights if no dates are given
+if __name__ == "__main__":  # guard for plotting processes
+    ds_bts = rwfuncs.read_arts_bts(path_bts)
+    flightnames = np.unique(ds_bts["flight"].values)
+    if len(sys.argv) > 1:
+        flightnames = [f for f in flightnames if f[5:13] in sys.argv[1:]]
+
+    for flightname in flightnames:
+        print(f"Plotting {flightname}")
+        plot_arts_results(
+            ds_bts.isel(sonde_id=(ds_bts["flight"] == flightname).values),
+            load_bahamas(flightname),
+        )
+
+# %%
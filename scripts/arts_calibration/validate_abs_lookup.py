@@ -0,0 +1,29 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src import readwrite_functions as rwfuncs
+from src.arts_functions import compare_abs_lookup, get_abs_lookup_filename
+from arts_bt_calculation import (
+    prepare_arts_profiles,
+    config_template,
+    path_abs_lookup,
+    all_freqs,
+)
+
+# %% prepare profiles of one flight
+date = sys.argv[1] if len(sys.argv) > 1 else "20240827"
+cfg = rwfuncs.FlightConfig(config_template, date)
+_, _, _, sondes = prepare_arts_profiles(cfg)
+
+# %% compare absorption lookup table to line-by-line calculation
+abs_lookup = dict(
+    frequencies=all_freqs * 1e9,
+    filename=get_abs_lookup_filename(path_abs_lookup, all_freqs * 1e9),
+)
+ds_validation = compare_abs_lookup([sonde["profile"] for sonde in sondes], abs_lookup)
+ds_validation.to_netcdf(f"{path_abs_lookup}/validation_{cfg['flightname']}.nc")
+
+# %%
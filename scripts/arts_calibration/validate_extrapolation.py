@@ -0,0 +1,72 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import time
+import numpy as np
+from orcestra.postprocess.level0 import bahamas
+from src import load_data_functions as loadfuncs
+from src import readwrite_functions as rwfuncs
+from src.arts_functions import extrapolate_dropsonde, extrapolate_dropsondes
+from src.ipfs_helpers import read_nc
+from arts_bt_calculation import config_template
+
+# %% load data of one flight
+date = sys.argv[1] if len(sys.argv) > 1 else "20240827"
+cfg = rwfuncs.FlightConfig(config_template, date)
+ds_bahamas = (
+    read_nc(
+        f"ipns://latest.orcestra-campaign.org/raw/HALO/bahamas/{cfg['flightname']}/QL_*.nc"
+    )
+    .pipe(bahamas)
+    .interpolate_na("time")
+    .load()
+)
+ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(
+    cfg["path_dropsondes"],
+    cfg["date"],
+    time_name="launch_time",
+    path_partitioned=cfg["path_dropsondes_partitioned"],
+).load()
+hampdata = loadfuncs.load_hamp_data(
+    cfg["path_radar"], cfg["path_radiometers"], cfg["path_iwv"]
+)
+heights = (
+    hampdata.radiometers["plane_altitude"]
+    .sel(time=ds_dropsonde["launch_time"], method="nearest")
+    .values
+)
+
+# %% extrapolate sonde by sonde and all sondes at once
+start = time.perf_counter()
+ds_extrap = extrapolate_dropsondes(ds_dropsonde, heights, ds_bahamas)
+time_batch = time.perf_counter() - start
+
+start = time.perf_counter()
+max_diff = {"p": 0.0, "ta": 0.0, "q": 0.0}
+n_compared = 0
+for i, sonde_id in enumerate(ds_dropsonde["sonde_id"].values):
+    try:
+        ds_single = extrapolate_dropsonde(
+            ds_dropsonde.sel(sonde_id=sonde_id), heights[i], ds_bahamas
+        )
+    except (ValueError, KeyError, RuntimeError, IndexError):
+        continue
+    ds_batch = ds_extrap.sel(sonde_id=sonde_id).dropna("alt")
+    assert np.array_equal(ds_batch["alt"].values, ds_single["alt"].values), sonde_id
+    for var in max_diff:
+        diff = np.abs(ds_batch[var].values - ds_single[var].values).max()
+        max_diff[var] = max(max_diff[var], float(diff))
+    n_compared += 1
+time_single = time.perf_counter() - start
+
+# %% report
+print(f"Compared {n_compared} of {ds_dropsonde.sizes['sonde_id']} dropsondes")
+print(f"Maximum absolute difference: {max_diff}")
+print(f"Sonde by sonde: {time_single:.2f}s, all at once: {time_batch:.2f}s")
+assert max_diff["p"] < 1  # [Pa], closed-form fit instead of curve_fit
+assert max_diff["ta"] < 1e-6 and max_diff["q"] < 1e-9
+
+# %%
@@ -0,0 +1,122 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src import earthcare_functions as ecfuncs
+
+# %% flights with processed radar data
+dates = [
+    "20240811",
+    "20240813",
+    "20240816",
+    "20240818",
+    "20240821",
+    "20240822",
+    "20240825",
+    "20240827",
+    "20240829",
+    "20240831",
+]
+flightletters = ["a"] * len(dates)
+
+
+def timeit(func, *args, **kwargs):
+    starttime = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - starttime
+
+
+# %% compare full and coarse-to-fine underpass search
+t_full, t_coarse = 0, 0
+for date, flightletter in zip(dates, flightletters):
+    ds_radar = xr.open_dataset(
+        f"Data/Hamp_Processed/radar/HALO-{date}{flightletter}_radar.zarr", engine="zarr"
+    )[["lat", "lon"]].load()
+    ec_track = ecfuncs.get_earthcare_track(date)
+
+    (time_full, dist_full), dt_full = timeit(
+        ecfuncs.find_ec_under_time,
+        ec_track,
+        ds_radar,
+        coarse_step=1,
+        return_distance=True,
+    )
+    (time_coarse, dist_coarse), dt_coarse = timeit(
+        ecfuncs.find_ec_under_time, ec_track, ds_radar, return_distance=True
+    )
+    t_full, t_coarse = t_full + dt_full, t_coarse + dt_coarse
+
+    if time_full is None or time_coarse is None:
+        difference = "same" if time_full is time_coarse else "differ"
+    else:
+        difference = f"{abs(pd.Timestamp(time_full) - pd.Timestamp(time_coarse))}"
+    print(
+        f"{date}: {ds_radar.time.size} times, underpass {time_coarse} "
+        f"({dist_coarse / 1e3:.1f}km), full search {dt_full:.3f}s, "
+        f"coarse-to-fine {dt_coarse:.3f}s, difference {difference}, "
+        f"distance difference {np.abs(dist_full - dist_coarse):.1f}m"
+    )
+
+print(f"total: full search {t_full:.2f}s, coarse-to-fine {t_coarse:.2f}s")
+print(f"speedup {t_full / t_coarse:.1f}x")
+
+
+# %% regression check: synthetic tracks with several passes during a flight
+def synthetic_underpass(rng, period=5400):
+    """HALO race track and continuous EarthCARE track (one pass every
+    'period' seconds, ~7.4km/s) passing HALO 3-19km apart at a random time"""
+    starttime = pd.Timestamp("2024-08-11T08:00")
+    time_halo = pd.date_range(starttime, periods=8 * 3600, freq="1s")
+    seconds = np.arange(time_halo.size)
+    lat = 10 + np.sin(seconds / 1500 + rng.uniform(0, 6))
+    lon = -25 + 1.5 * np.cos(seconds / 2300 + rng.uniform(0, 6))
+    ds_halo = xr.Dataset(
+        coords={"time": time_halo, "lat": ("time", lat), "lon": ("time", lon)}
+    )
+
+    k = rng.integers(1, seconds.size - 1)
+    offset = rng.uniform(3, 19) * 1e3 / 111e3 / np.cos(np.deg2rad(lat[k]))
+    time_track = pd.date_range(
+        starttime - pd.Timedelta("10min"),
+        time_halo[-1] + pd.Timedelta("10min"),
+        freq="1s",
+    )
+    dt = (time_track - time_halo[k]) / pd.Timedelta("1s") + rng.uniform(-0.5, 0.5)
+    phase = (dt + period / 2) % period - period / 2
+    n_pass = np.round((dt - phase) / period)
+    ec_track = xr.Dataset(
+        {
+            "lat": (
+                "time",
+                np.rad2deg(
+                    np.arcsin(np.sin(np.deg2rad(lat[k]) - 2 * np.pi * phase / period))
+                ),
+            ),
+            "lon": ("time", lon[k] + rng.choice([-1, 1]) * offset - n_pass * 22.5),
+        },
+        coords={"time": time_track},
+    )
+    return ec_track, ds_halo
+
+
+rng = np.random.default_rng(0)
+n_cases, n_differ = 300, 0
+for _ in range(n_cases):
+    ec_track, ds_halo = synthetic_underpass(rng)
+    time_full, dist_full = ecfuncs.find_ec_under_time(
+        ec_track, ds_halo, coarse_step=1, return_distance=True
+    )
+    time_coarse, dist_coarse = ecfuncs.find_ec_under_time(
+        ec_track, ds_halo, return_distance=True
+    )
+    n_differ += (time_full != time_coarse) or not np.isclose(dist_full, dist_coarse)
+print(f"synthetic: coarse-to-fine differs from full search in {n_differ}/{n_cases}")
+assert n_differ == 0
+
+# %%
@@ -0,0 +1,39 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import shutil
+import time
+from src import readwrite_functions as rwfuncs
+
+# %% path to full-campaign planet track file
+path_planet = sys.argv[1]
+cachename = rwfuncs.get_planet_cachename(path_planet)
+if cachename.exists():
+    shutil.rmtree(cachename)
+
+
+def timeit(func, *args, **kwargs):
+    starttime = time.perf_counter()
+    ds = func(*args, **kwargs)
+    return ds, time.perf_counter() - starttime
+
+
+# %% compare cold csv and warm cache load
+ds_csv, t_csv = timeit(rwfuncs.read_planet, path_planet, use_cache=False)
+_, t_write = timeit(rwfuncs.read_planet, path_planet)
+ds_cache, t_cache = timeit(rwfuncs.read_planet, path_planet)
+timeframe = slice(
+    ds_cache.time[0].values, ds_cache.time[ds_cache.time.size // 10].values
+)
+_, t_window = timeit(rwfuncs.read_planet, path_planet, timeframe=timeframe)
+
+print(f"{ds_csv.time.size} rows in {path_planet}")
+print(f"cold csv load = {t_csv:.3f}s")
+print(f"first load incl. writing cache = {t_write:.3f}s")
+print(f"warm cache load = {t_cache:.3f}s (speedup {t_csv / t_cache:.1f}x)")
+print(f"warm cache load of 10% timeframe = {t_window:.3f}s")
+
+# %%
@@ -0,0 +1,51 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import xarray as xr
+from src import readwrite_functions as rwfuncs
+from src import dropsonde_wind_analyses as dropfuncs
+
+# %% load Level-3 dropsondes of campaign
+cfg = rwfuncs.extract_config_params("config_ipns.yaml")
+ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
+ds_dropsonde = ds_dropsonde[["u", "v", "lat"]].load()
+path_benchmark = "Data/dropsondes/render_benchmark"
+os.makedirs(path_benchmark, exist_ok=True)
+
+
+# %% compare rendering and saving of scatter and raster plots
+def time_render(render, savefig_format):
+    starttime = time.perf_counter()
+    fig, axes = dropfuncs.plot_dropsonde_wind_vertical_profiles(
+        ds_dropsonde,
+        "lat",
+        figsize=(21, 12),
+        cmap="plasma",
+        cbarlab="latitude /$\u00b0$",
+        render=render,
+    )
+    savename = f"{path_benchmark}/vertical_wind_profiles_{render}.{savefig_format}"
+    fig.savefig(savename, dpi=64, format=savefig_format)
+    plt.close(fig)
+    return time.perf_counter() - starttime, os.path.getsize(savename)
+
+
+print(f"{ds_dropsonde.u.size} points of {ds_dropsonde.sonde_id.size} dropsondes")
+for savefig_format in ["png", "pdf"]:
+    t_scatter, size_scatter = time_render("scatter", savefig_format)
+    t_raster, size_raster = time_render("raster", savefig_format)
+    print(
+        f"{savefig_format}: scatter = {t_scatter:.2f}s ({size_scatter / 1e6:.1f}MB), "
+        f"raster = {t_raster:.2f}s ({size_raster / 1e6:.2f}MB), "
+        f"speedup {t_scatter / t_raster:.1f}x"
+    )
+
+# %%
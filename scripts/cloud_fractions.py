@@ -12,55 +12,22 @@ import matplotlib.dates as mdates
 
 
 # %%
+def open_radar(date, flightletter):
+    return xr.open_dataset(
+        f"Data/Hamp_Processed/radar/HALO-{date}{flightletter}_radar.zarr", engine="zarr"
+    )
 
 
-def segmet_track(ec_track, ds_radar):
-    # Calculate the time differences between consecutive time points
-    time_diffs = ec_track.time.diff(dim="time")
-
-    # Find the indices where the time difference is greater than 20 minutes
-    gap_indices = time_diffs > pd.Timedelta("20min")
-
-    # Extract the times where the gaps occur
-    ec_sections = []
-    gap_times = ec_track.time[:-1][gap_indices.values]
-    ec_full = ec_track.copy()
-    for gap_time in gap_times:
-        ec_sections.append(ec_full.sel(time=slice(ec_full.time.min(), gap_time)))
-        idx_gap = int((ec_full.time == gap_time).argmax())
-        ec_full = ec_full.isel(time=slice(idx_gap + 1, None))
-
-    # check overlap with radar data
-    ec_inflight = []
-    for ec_section in ec_sections:
-        if (
-            (ec_section.time[0].values > ds_radar.time[0].values)
-            and (ec_section.time[0].values < ds_radar.time[-1].values)
-        ) or (
-            (ec_section.time[-1].values > ds_radar.time[0].values)
-            and (ec_section.time[-1].values < ds_radar.time[-1].values)
-        ):
-            ec_inflight.append(ec_section)
-
-    return ec_inflight
+def load_radar_positions(date, flightletter):
+    return open_radar(date, flightletter)[["lat", "lon"]].load()
 
 
-def read_radar(date, flightletter):
-    ds_radar = xr.open_dataset(
-        f"Data/Hamp_Processed/radar/HALO-{date}{flightletter}_radar.zarr", engine="zarr"
-    )
+def read_radar(date, flightletter, ec_under_times):
+    ds_radar = open_radar(date, flightletter)
     plot_duration = pd.Timedelta("20m")
-    ec_track = ecfuncs.get_earthcare_track(date)
-    if pd.Timestamp(date) > pd.Timestamp("2024-11-01"):
-        ec_segments = segmet_track(ec_track, ds_radar)
-    else:
-        ec_segments = [ec_track]
 
-    ec_under_times = []
     radar_segments = []
-    for segment in ec_segments:
-        ec_under_time = ecfuncs.find_ec_under_time(segment, ds_radar)
-        ec_under_times.append(ec_under_time)
+    for ec_under_time in ec_under_times:
         ec_starttime, ec_endtime = (
             ec_under_time - plot_duration / 2,
             ec_under_time + plot_duration / 2,
@@ -72,7 +39,7 @@ def read_radar(date, flightletter):
         else:
             radar_segments.append(None)
 
-    return radar_segments, ec_under_times
+    return radar_segments
 
 
 def plot_cloudfraction(ax, ds_radar, ec_under_time):
@@ -149,18 +116,24 @@ flightletters = ["a"] * len(dates)
 flightletters[25] = "b"
 flightletters[26] = "b"
 
+df_underpasses = ecfuncs.build_underpass_catalog(
+    list(zip(dates, flightletters)), load_radar_positions
+)
+df_underpasses = df_underpasses.dropna(subset=["time"])
+
 underpasses = []
 radar_data = []
-for date, flightletter in zip(dates, flightletters):
-    (
-        radar_segments,
-        ec_under_times,
-    ) = read_radar(date, flightletter)
+for (date, flightletter), df_flight in df_underpasses.groupby(
+    ["date", "flightletter"], sort=False
+):
+    radar_segments = read_radar(date, flightletter, df_flight["time"])
     radar_data += radar_segments
-    underpasses += ec_under_times
+    underpasses += list(df_flight["time"])
 
+underpasses = [
+    underpass for underpass, entry in zip(underpasses, radar_data) if entry is not None
+]
 radar_data = [entry for entry in radar_data if entry is not None]
-underpasses = [entry for entry in underpasses if entry is not None]
 
 
 # %% call plotfunction
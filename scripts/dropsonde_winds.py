@@ -33,12 +33,12 @@ def mean_wind_quivers_plot(
     )
 
     axes = axes.flatten()
+    ds_layers = dropfuncs.get_layer_mean_winds(ds_dropsonde, heights)
     for n in range(1, len(heights)):
-        dropfuncs.plot_mean_wind_quiver_on_projection(
+        dropfuncs.plot_layer_mean_wind_quiver_on_projection(
             axes[n - 1],
-            ds_dropsonde,
-            heights[n - 1],
-            heights[n],
+            ds_layers,
+            n - 1,
             lonmin=lonmin,
             lonmax=lonmax,
             latmin=latmin,
@@ -111,7 +111,9 @@ cfg = rwfuncs.extract_config_params(configfile)
 path_saveplts = cfg["path_saveplts"]
 flightname = cfg["flightname"]
 ### ------------------------------------------------------------- ###
-ds_full = loadfuncs.load_dropsonde_data(cfg["path_dropsonde_level3"])
+# path to (optionally per-flight partitioned) dropsonde store, dropsondes of each
+# date are read in 'load_dropsonde_data_for_date'
+ds_full = cfg["path_dropsonde_level3"]
 dates = ["20240811", "20240813", "20240816", "20240818", "20240821", "20240822"]
 # ds = loadfuncs.load_dropsonde_data_for_date(cfg["path_dropsonde_level3"], cfg["date"])
 # # hampdata = loadfuncs.do_post_processing(
@@ -184,11 +186,41 @@ dates = ["20240811", "20240813", "20240816", "20240818", "20240821", "20240822"]
 # plt.show()
 
 
+# %% binned wind statistics of all flights, only flights missing in the store are
+# computed (delete the store after changing the bins)
+path_windstats = "Data/dropsondes/wind_statistics.zarr"
+lat_bins = np.arange(0, 20.5, 0.5)  # [degrees]
+alt_bins = np.arange(0, 15250, 250)  # [m]
+
+
+def update_wind_statistics(ds_full, dates, path, lat_bins, alt_bins):
+    if os.path.exists(path):
+        flights = rwfuncs.read_wind_statistics(path).flight.values
+    else:
+        flights = []
+    for date in dates:
+        if date in flights:
+            continue
+        ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(
+            ds_full, date, path_partitioned=cfg["path_dropsondes_partitioned"]
+        )
+        ds_stats = dropfuncs.get_wind_statistics_cube(
+            ds_dropsonde, lat_bins, alt_bins, date
+        )
+        rwfuncs.write_wind_statistics(ds_stats, path)
+
+    return rwfuncs.read_wind_statistics(path).sel(flight=dates)
+
+
+os.makedirs(os.path.dirname(path_windstats), exist_ok=True)
+ds_stats = update_wind_statistics(ds_full, dates, path_windstats, lat_bins, alt_bins)
+
+
 # %% Define more functions for plotting all flights
 def plot_allflights_wind_vertical_profile(
-    ds_full,
+    ds_stats,
     dates,
-    calc_verticaldata,
+    variable,
     latmax,
     cmap,
     vmin,
@@ -207,14 +239,14 @@ def plot_allflights_wind_vertical_profile(
     xticks = np.linspace(xlims[0], xlims[1], 5)
     yticks = np.linspace(0, 15, 5)
     for d, date in enumerate(dates):
-        ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(ds_full, date)
-        ds_dropsonde = ds_dropsonde.where(ds_dropsonde.lat < latmax, drop=True)
-        height = np.tile(ds_dropsonde.alt / 1000, ds_dropsonde.sonde_id.size)  # [km]
-        colorby = ds_dropsonde["lat"].values.flatten()
+        ds_flight = ds_stats.sel(flight=date)
+        ds_flight = ds_flight.isel(lat_bin=ds_flight.lat_max <= latmax)
+        height = np.tile(ds_flight.alt_bin / 1000, ds_flight.lat_bin.size)  # [km]
+        colorby = np.repeat(ds_flight.lat_bin.values, ds_flight.alt_bin.size)
 
         ax, norm1, cmap1 = dropfuncs.plot_coloured_dropsonde_vertical_profile(
             axes[d],
-            calc_verticaldata(ds_dropsonde),
+            ds_flight[variable].values.flatten(),
             height,
             vmin,
             vmax,
@@ -251,9 +283,9 @@ def plot_allflights_wind_vertical_profile(
 
 # %% height-latitude plots
 def plot_allflights_vertical_vs_latitude_wind(
-    ds_full,
+    ds_stats,
     dates,
-    colorby_data,
+    variable,
     latmin,
     latmax,
     hmin,
@@ -264,12 +296,11 @@ def plot_allflights_vertical_vs_latitude_wind(
     figtitle,
     figsize=(16, 9),
 ):
-    def plot_wind_component_scatter(ax, ds_dropsonde, colorby_data, norm, cmap):
-        height = np.tile(ds_dropsonde.alt / 1000, ds_dropsonde.sonde_id.size)  # [km]
-        latitude = ds_dropsonde.lat.values.flatten()
-        color = cmap(norm(colorby_data(ds_dropsonde)))
+    def plot_wind_component_mesh(ax, ds_flight, variable, norm, cmap):
+        latitude = np.append(ds_flight.lat_min, ds_flight.lat_max[-1])
+        height = np.append(ds_flight.alt_min, ds_flight.alt_max[-1]) / 1000  # [km]
 
-        ax.scatter(latitude, height, marker=",", color=color)
+        ax.pcolormesh(latitude, height, ds_flight[variable].T, norm=norm, cmap=cmap)
         ax.set_xlabel("Latitude /$\u00b0$")
         ax.set_ylabel("Height /km")
 
@@ -288,8 +319,8 @@ def plot_allflights_vertical_vs_latitude_wind(
     xticks = np.linspace(latmin, latmax, 5)
     yticks = np.linspace(0, 15, 5)
     for d, date in enumerate(dates):
-        ds_dropsonde = loadfuncs.load_dropsonde_data_for_date(ds_full, date)
-        plot_wind_component_scatter(axes[d], ds_dropsonde, colorby_data, norm, cmap)
+        ds_flight = ds_stats.sel(flight=date)
+        plot_wind_component_mesh(axes[d], ds_flight, variable, norm, cmap)
 
         axes[d].set_xlabel("")
         axes[d].set_ylabel("")
@@ -331,33 +362,13 @@ hmin, hmax = -0.5, 15
 cmap = "plasma"
 
 
-def calc_eastwarddata(ds_dropsonde):
-    return ds_dropsonde.u.values.flatten()
-
-
-def calc_northwarddata(ds_dropsonde):
-    return ds_dropsonde.v.values.flatten()
-
-
-def calc_directiondata(ds_dropsonde):
-    eastward = ds_dropsonde.u.values.flatten()
-    northward = ds_dropsonde.v.values.flatten()
-    return dropfuncs.horizontal_wind_direction(northward, eastward)
-
-
-def calc_magnitudedata(ds_dropsonde):
-    eastward = ds_dropsonde.u.values.flatten()
-    northward = ds_dropsonde.v.values.flatten()
-    return dropfuncs.horizontal_wind_speed(northward, eastward)
-
-
 figtitle = "Eastward Wind Component"
 xlabel = "u /m s$^{-1}$"
 xlims = [-20, 20]
 fig, axes = plot_allflights_wind_vertical_profile(
-    ds_full,
+    ds_stats,
     dates,
-    calc_eastwarddata,
+    "u_mean",
     latmax,
     cmap,
     vmin,
@@ -377,9 +388,9 @@ figtitle = "Northward Wind Component"
 xlabel = "v /m s$^{-1}$"
 xlims = [-10, 10]
 fig, axes = plot_allflights_wind_vertical_profile(
-    ds_full,
+    ds_stats,
     dates,
-    calc_northwarddata,
+    "v_mean",
     latmax,
     cmap,
     vmin,
@@ -399,9 +410,9 @@ figtitle = "Direction Relative to Westerlies (->)"
 xlabel = "$\u03c6$ /degrees"
 xlims = [-180, 180]
 fig, axes = plot_allflights_wind_vertical_profile(
-    ds_full,
+    ds_stats,
     dates,
-    calc_directiondata,
+    "direction_mean",
     latmax,
     cmap,
     vmin,
@@ -421,9 +432,9 @@ figtitle = "Horizontal Wind Speed"
 xlabel = "|V$_{xy}$| /m s$^{-1}$"
 xlims = [0, 30]
 fig, axes = plot_allflights_wind_vertical_profile(
-    ds_full,
+    ds_stats,
     dates,
-    calc_magnitudedata,
+    "speed_mean",
     latmax,
     cmap,
     vmin,
@@ -439,7 +450,7 @@ savename = path_saveplts / "allflights_vertical_magnitude_profile_colorlatitutde
 dpi = 64
 save_figure(fig, savefigparams=[savefig_format, savename, dpi])
 
-# %% Vertical vs Latitude Scatter Plots
+# %% Vertical vs Latitude Plots
 latmin, latmax = 0, 20
 hmin, hmax = -0.5, 15
 cmap = "coolwarm"
@@ -448,9 +459,9 @@ cbarlabel = "Northward, v /m s$^{-1}$"
 levels = [-25, -5, -2.5, 2.5, 5, 25]
 extend = "both"
 fig, axes = plot_allflights_vertical_vs_latitude_wind(
-    ds_full,
+    ds_stats,
     dates,
-    calc_northwarddata,
+    "v_mean",
     latmin,
     latmax,
     hmin,
@@ -474,9 +485,9 @@ cbarlabel = "Eastward, v /m s$^{-1}$"
 levels = [-25, -5, -2.5, 2.5, 5, 25]
 extend = "both"
 fig, axes = plot_allflights_vertical_vs_latitude_wind(
-    ds_full,
+    ds_stats,
     dates,
-    calc_eastwarddata,
+    "u_mean",
     latmin,
     latmax,
     hmin,
@@ -499,9 +510,9 @@ cbarlabel = "$\u03c6$ /degrees"
 levels = [-180, -90, -60, -30, 30, 60, 90, 180]
 extend = None
 fig, axes = plot_allflights_vertical_vs_latitude_wind(
-    ds_full,
+    ds_stats,
     dates,
-    calc_directiondata,
+    "direction_mean",
     latmin,
     latmax,
     hmin,
@@ -9,6 +9,7 @@ from src import plot_quicklooks as plotql
 from src import load_data_functions as loadfuncs
 from src import readwrite_functions as rwfuncs
 from src import earthcare_functions as ecfuncs
+from src.post_processed_hamp_data import PostProcessedHAMPData
 
 # %%
 ### -------- USER PARAMETERS YOU MUST SET IN CONFIG.YAML -------- ###
@@ -23,9 +24,10 @@ hampdata = loadfuncs.load_hamp_data(
     cfg["path_radar"], cfg["path_radiometers"], cfg["path_iwv"]
 )
 
-# %% find time when earthcare crosses halo
-ec_track = ecfuncs.get_earthcare_track(cfg["date"])
-ec_under_time = ecfuncs.find_ec_under_time(ec_track, hampdata.radar)
+# %% look up time when earthcare crosses halo in underpass catalog
+ec_under_time = ecfuncs.get_ec_under_time(
+    cfg["date"], cfg["flightletter"], lambda date, flightletter: hampdata.radar
+)
 
 plot_duration = pd.Timedelta("30m")
 ec_starttime, ec_endtime = (
@@ -33,6 +35,18 @@ ec_starttime, ec_endtime = (
     ec_under_time + plot_duration / 2,
 )
 
+# %% slice all instruments around underpass in memory in one pass, so that
+# both underpass quicklooks read the data only once
+hampdata_ec_under = PostProcessedHAMPData(
+    *rwfuncs.extract_level1data_timeslices(
+        hampdata,
+        [
+            (var, slice(ec_starttime, ec_endtime))
+            for var in ["radar", "radiometers", "column_water_vapour"]
+        ],
+    )
+)
+
 # %% produce HAMP single quicklook between startime and endtime
 flight_starttime, flight_endtime = (
     hampdata.radiometers.time[0].values,
@@ -57,7 +71,7 @@ savename = path_saveplts + f"/hamp_ec_under_{flightname}.png"
 dpi = 72
 timeframe = slice(ec_starttime, ec_endtime)
 plotql.hamp_timeslice_quicklook(
-    hampdata,
+    hampdata_ec_under,
     timeframe,
     flightname,
     ec_under_time=ec_under_time,
@@ -71,7 +85,7 @@ savename = path_saveplts + f"/hamp_radar_ec_under_{flightname}.png"
 dpi = 72
 timeframe = slice(ec_starttime, ec_endtime)
 plotql.radar_quicklook(
-    hampdata,
+    hampdata_ec_under,
     timeframe,
     flightname,
     ec_under_time=ec_under_time,
@@ -160,9 +160,7 @@ flightname = cfg["flightname"]
 #     do_kv=True,
 #     do_cwv=True,
 # )
-hampdata = rwfuncs.load_timeslice_all_level1hampdata(
-    cfg["path_hampdata"], cfg["is_planet"]
-)
+hampdata = rwfuncs.load_timeslice_all_level1hampdata(cfg["path_hampdata"])
 
 
 # %% Plot CWV and radar with ITCZ mask
@@ -0,0 +1,32 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+import xarray as xr
+from src import readwrite_functions as rwfuncs
+from src.dropsonde_processing import get_moist_layer_catalog
+
+# %% load Level-3 dropsondes of campaign
+cfg = rwfuncs.extract_config_params("config_ipns.yaml")
+ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
+
+# %% find all moist and cloudy layers
+start = time.perf_counter()
+ds_layers = get_moist_layer_catalog(ds_dropsonde)
+print(
+    f"{ds_layers.sizes['layer']} layers in {ds_dropsonde.sizes['sonde_id']} "
+    f"dropsondes found in {time.perf_counter() - start:.1f}s"
+)
+
+# %% save catalog
+os.makedirs("Data/dropsondes", exist_ok=True)
+ds_layers.to_netcdf("Data/dropsondes/moist_layer_catalog.nc")
+
+# %% e.g. low cloud layers thicker than 100 m
+df_layers = ds_layers.to_dataframe()
+print(df_layers[(df_layers["layer_class"] == 1) & (df_layers["thickness"] > 100)])
+
+# %%
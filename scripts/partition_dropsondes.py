@@ -0,0 +1,20 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import xarray as xr
+from src import readwrite_functions as rwfuncs
+
+# %% read config
+configfile = "config_ipns.yaml"
+cfg = rwfuncs.extract_config_params(configfile)
+
+# %% repartition Level 3 dropsondes into one group per flight
+ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")
+rwfuncs.write_dropsonde_flight_partitions(
+    ds_dropsonde, cfg["path_dropsondes_partitioned"]
+)
+
+# %%
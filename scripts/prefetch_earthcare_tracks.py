@@ -0,0 +1,53 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import earthcare_functions as ecfuncs
+
+# %% flights of campaign
+dates = [
+    "20240811",
+    "20240813",
+    "20240816",
+    "20240818",
+    "20240821",
+    "20240822",
+    "20240825",
+    "20240827",
+    "20240829",
+    "20240831",
+    "20240903",
+    "20240906",
+    "20240907",
+    "20240909",
+    "20240912",
+    "20240914",
+    "20240916",
+    "20240919",
+    "20240921",
+    "20240923",
+    "20240924",
+    "20240926",
+    "20240928",
+    "20241105",
+    "20241107",
+    "20241110",
+    "20241112",
+    "20241114",
+    "20241116",
+    "20241119",
+]
+
+# %% load EarthCARE tracks of all flights into local cache
+# python prefetch_earthcare_tracks.py [cache_dir]
+# later runs read the tracks offline via
+# ecfuncs.get_earthcare_track(date, cache_dir=cache_dir, offline=True)
+cache_dir = sys.argv[1] if len(sys.argv) > 1 else ecfuncs.EC_TRACK_CACHE_DIR
+failed = ecfuncs.prefetch_earthcare_tracks(dates, cache_dir=cache_dir)
+print(f"Cached EarthCARE tracks of {len(dates) - len(failed)} flights in {cache_dir}")
+if failed:
+    print(f"No EarthCARE track found for {failed}")
+
+# %%
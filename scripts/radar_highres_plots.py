@@ -9,22 +9,15 @@ from src import plot_quicklooks as plotql
 from src import load_data_functions as loadfuncs
 from src import readwrite_functions as rwfuncs
 from src import earthcare_functions as ecfuncs
-import yaml
+from src.post_processed_hamp_data import PostProcessedHAMPData
 
 # %%
+config_template = rwfuncs.read_config_yaml("config.yaml")
 
 
-def plot_radar(date):
-    # change the date in config.yaml to date
-    configfile = "config.yaml"
-    with open(configfile, "r") as file:
-        config_yaml = yaml.safe_load(file)
-    config_yaml["date"] = date
-    with open(configfile, "w") as file:
-        yaml.dump(config_yaml, file)
-
-    # read config
-    cfg = rwfuncs.extract_config_params(configfile)
+def plot_radar(date, flightletter="a"):
+    # config of flight on date
+    cfg = rwfuncs.FlightConfig(config_template, date, flightletter=flightletter)
     path_saveplts = cfg["path_saveplots"]
     flightname = cfg["flightname"]
 
@@ -33,9 +26,10 @@ def plot_radar(date):
         cfg["path_radar"], cfg["path_radiometers"], cfg["path_iwv"]
     )
 
-    # find time when earthcare crosses halo
-    ec_track = ecfuncs.get_earthcare_track(cfg["date"])
-    ec_under_time = ecfuncs.find_ec_under_time(ec_track, hampdata.radar)
+    # look up time when earthcare crosses halo in underpass catalog
+    ec_under_time = ecfuncs.get_ec_under_time(
+        date, flightletter, lambda date, flightletter: hampdata.radar
+    )
 
     plot_duration = pd.Timedelta("30m")
     ec_starttime, ec_endtime = (
@@ -43,12 +37,17 @@ def plot_radar(date):
         ec_under_time + plot_duration / 2,
     )
 
+    # slice radar data around underpass
+    timeframe = slice(ec_starttime, ec_endtime)
+    (ds_radar,) = rwfuncs.extract_level1data_timeslices(
+        hampdata, [("radar", timeframe)]
+    )
+
     savefig_format = "png"
     savename = path_saveplts + f"/hamp_radar_ec_under_{flightname}_highres.png"
     dpi = 256
-    timeframe = slice(ec_starttime, ec_endtime)
     plotql.radar_quicklook(
-        hampdata,
+        PostProcessedHAMPData(ds_radar, None, None),
         timeframe,
         flightname,
         ec_under_time=ec_under_time,
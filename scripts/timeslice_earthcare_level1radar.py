@@ -33,38 +33,45 @@ hampdata = loadfuncs.do_post_processing(
     do_cwv=False,
 )
 
-# %% get earthcare track forecasts
-ec_track = ecfuncs.get_earthcare_track(cfg["date"])
-
-# %% find time when earthcare crosses halo
-ec_under_time = ecfuncs.find_ec_under_time(ec_track, hampdata.flightdata)
-window = "60min"
-plot_duration = pd.Timedelta(window)
-starttime, endtime = (
-    ec_under_time - plot_duration / 2,
-    ec_under_time + plot_duration / 2,
+# %% look up time when earthcare crosses halo in underpass catalog
+ec_under_time = ecfuncs.get_ec_under_time(
+    cfg["date"], cfg["flightletter"], lambda date, flightletter: hampdata.flightdata
 )
+windows = ["30min", "60min"]
+timeframes = {}
+for window in windows:
+    plot_duration = pd.Timedelta(window)
+    timeframes[window] = slice(
+        ec_under_time - plot_duration / 2,
+        ec_under_time + plot_duration / 2,
+    )
 
-# %% Write timeslice of Level 1 post-processed radar data to .nc file
-ncfilename = cfg["path_writedata"] / f"earthcare_level1_{window}_{flightname}.nc"
-rwfuncs.write_level1data_timeslice(
-    hampdata, "radar", slice(starttime, endtime), ncfilename
+# %% Write timeslices of Level 1 post-processed radar data to .nc files, the
+# overlapping windows are read from the radar data only once
+ncfilenames = {
+    window: cfg["path_writedata"] / f"earthcare_level1_{window}_{flightname}.nc"
+    for window in windows
+}
+rwfuncs.write_level1data_timeslices(
+    hampdata,
+    [("radar", timeframes[window], ncfilenames[window]) for window in windows],
 )
 
-# %% produce radar-only single quicklook from sliced radardata .nc file
-ds_radar = xr.open_mfdataset(ncfilename)
-starttime, endtime = ds_radar.time[0].values, ds_radar.time[-1].values
-savefig_format = "png"
-savename = cfg["path_writedata"] / f"earthcare_level1_{window}_{flightname}.png"
-dpi = 64
-timeframe = slice(starttime, endtime)
-plotql.radar_quicklook(
-    None,
-    timeframe,
-    flightname,
-    ec_under_time=ec_under_time,
-    figsize=(12, 6),
-    savefigparams=[savefig_format, savename, dpi],
-    ds_radar=ds_radar,
-    is_latllonaxes=False,
-)
+# %% produce radar-only single quicklooks from sliced radardata .nc files
+for window in windows:
+    ds_radar = xr.open_mfdataset(ncfilenames[window])
+    starttime, endtime = ds_radar.time[0].values, ds_radar.time[-1].values
+    savefig_format = "png"
+    savename = cfg["path_writedata"] / f"earthcare_level1_{window}_{flightname}.png"
+    dpi = 64
+    timeframe = slice(starttime, endtime)
+    plotql.radar_quicklook(
+        None,
+        timeframe,
+        flightname,
+        ec_under_time=ec_under_time,
+        figsize=(12, 6),
+        savefigparams=[savefig_format, savename, dpi],
+        ds_radar=ds_radar,
+        is_latllonaxes=False,
+    )
@@ -38,7 +38,20 @@ rwfuncs.timeslice_all_level1hampdata(
 
 # %% load HAMP post-processed data slice
 path_slicedata = cfg["path_writedata"]
-hampdata_slice = rwfuncs.load_timeslice_all_level1hampdata(
-    path_slicedata, cfg["is_planet"]
-)
+hampdata_slice = rwfuncs.load_timeslice_all_level1hampdata(path_slicedata)
 print(hampdata_slice)
+
+# %% write hourly slices of HAMP post-processed data, reading the data once
+timeframes = [
+    slice(starttime + pd.Timedelta(hours=h), starttime + pd.Timedelta(hours=h + 1))
+    for h in range(4)
+]
+rwfuncs.timeslice_all_level1hampdata(hampdata, timeframes, cfg["path_writedata"])
+
+# %% load hourly HAMP post-processed data slices
+hampdata_hourly = [
+    rwfuncs.load_timeslice_all_level1hampdata(path_slicedata, n)
+    for n in range(len(timeframes))
+]
+for hampdata_hour in hampdata_hourly:
+    print(hampdata_hour)
@@ -0,0 +1,35 @@
+# %%
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+import numpy as np
+import xarray as xr
+from src import readwrite_functions as rwfuncs
+from src.dropsonde_processing import (
+    get_all_clouds_flags_dropsondes,
+    get_all_clouds_flags_dropsondes_loop,
+)
+
+# %% load Level-3 dropsondes of campaign
+cfg = rwfuncs.extract_config_params("config_ipns.yaml")
+ds_dropsonde = xr.open_dataset(cfg["path_dropsondes"], engine="zarr")[["rh"]]
+
+# %% cloud flags with loop over sondes and vectorised over chunks of sondes
+start = time.perf_counter()
+flags_loop = get_all_clouds_flags_dropsondes_loop(ds_dropsonde.load().copy())
+time_loop = time.perf_counter() - start
+
+start = time.perf_counter()
+flags = get_all_clouds_flags_dropsondes(ds_dropsonde.chunk(sonde_id=256).copy())
+time_vectorised = time.perf_counter() - start
+
+# %% compare
+n_differ = int((flags["cloud_flag"] != flags_loop["cloud_flag"]).sum())
+print(f"{n_differ} of {ds_dropsonde.sizes['sonde_id']} cloud flags differ")
+print(f"Loop: {time_loop:.1f}s, vectorised: {time_vectorised:.2f}s")
+assert np.array_equal(flags["cloud_flag"].values, flags_loop["cloud_flag"].values)
+
+# %%
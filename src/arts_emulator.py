@@ -0,0 +1,307 @@
+import numpy as np
+from .arts_functions import average_double_bands, run_arts_parallel
+
+EMULATOR_PRESSURE_LEVELS = np.array(
+    [1000, 950, 900, 850, 800, 700, 600, 500, 400, 300, 250, 200]
+)  # [hPa]
+EMULATOR_LAYER_PRESSURES = np.array([850, 500])  # [hPa]
+GRAVITY = 9.81  # [m s-2]
+EPSILON = 0.622  # ratio of molar masses of water vapour and dry air
+
+
+def get_emulator_features(profile):
+    """Reduce the inputs of run_arts for one profile to emulator features.
+
+    The features are temperature and logarithmic water vapour at fixed
+    pressure levels, integrated water vapour in total, its square root and
+    square and within three layers, surface temperature and windspeed, the
+    logarithmic pressure at the sensor and the cosine of the zenith angle.
+
+    Parameters:
+        profile (dict): Keyword arguments of run_arts (without ws).
+
+    Returns:
+        ndarray: Features of profile.
+    """
+    p = np.asarray(profile["pressure_profile"], dtype=float)
+    ta = np.asarray(profile["temperature_profile"], dtype=float)
+    h2o = np.asarray(profile["h2o_profile"], dtype=float)
+    order = np.argsort(p)
+    log_p = np.log(p[order])
+
+    log_p_levels = np.log(EMULATOR_PRESSURE_LEVELS * 1e2)
+    ta_levels = np.interp(log_p_levels, log_p, ta[order])
+    h2o_levels = np.log(np.interp(log_p_levels, log_p, np.maximum(h2o[order], 1e-9)))
+
+    # integrated water vapour from top of profile downwards
+    q = EPSILON * h2o[order] / (1 + EPSILON * h2o[order])
+    iwv_from_top = (
+        np.concatenate([[0], np.cumsum(0.5 * (q[1:] + q[:-1]) * np.diff(p[order]))])
+        / GRAVITY
+    )
+    iwv_layers = np.interp(
+        np.log(EMULATOR_LAYER_PRESSURES[::-1] * 1e2), log_p, iwv_from_top
+    )
+    iwv = iwv_from_top[-1]
+    iwv_layers = np.diff(np.concatenate([[0], iwv_layers, [iwv]]))
+
+    return np.concatenate(
+        [
+            ta_levels,
+            h2o_levels,
+            [iwv, np.sqrt(iwv), iwv**2],
+            iwv_layers,
+            [
+                float(profile["surface_temp"]),
+                float(profile["surface_ws"]),
+                log_p[0],
+                np.cos(np.deg2rad(float(profile.get("zenith_angle", 180)))),
+            ],
+        ]
+    )
+
+
+class ArtsEmulator:
+    """Ridge regression of ARTS brightness temperatures on profile features.
+
+    The emulator is trained on results of run_arts, e.g. from an
+    ArtsResultCache, and predicts the brightness temperatures on the
+    frequency grid of the training simulations. Inputs with features outside
+    of the range of the training inputs are flagged as out of distribution.
+
+    Parameters:
+        alpha (float): Regularisation of the ridge regression.
+        ood_tolerance (float): Margin around the range of the standardised
+          training features in standard deviations, inputs outside of it are
+          out of distribution.
+    """
+
+    def __init__(self, alpha=1e-3, ood_tolerance=0.5):
+        self.alpha = alpha
+        self.ood_tolerance = ood_tolerance
+        self.f_grid = None
+        self.stats = None
+
+    def standardise(self, features):
+        return (features - self.mean) / self.std
+
+    def fit(self, profiles, results):
+        """Fit emulator to results of run_arts for profiles.
+
+        Parameters:
+            profiles (list[dict]): Keyword arguments of run_arts for each
+                profile.
+            results (list[tuple]): Result of run_arts for each profile, all on
+                the same frequency grid.
+
+        Returns:
+            ArtsEmulator: Fitted emulator.
+        """
+        features = np.array([get_emulator_features(profile) for profile in profiles])
+        y = np.array([result[1] for result in results])
+        self.f_grid = np.asarray(results[0][0])
+
+        self.mean = features.mean(axis=0)
+        self.std = features.std(axis=0)
+        self.std[self.std == 0] = 1
+        x = self.standardise(features)
+        self.x_min, self.x_max = x.min(axis=0), x.max(axis=0)
+
+        self.intercept = y.mean(axis=0)
+        n_samples, n_features = x.shape
+        self.coefficients = np.linalg.solve(
+            x.T @ x + self.alpha * n_samples * np.eye(n_features),
+            x.T @ (y - self.intercept),
+        )
+        return self
+
+    def predict(self, profiles, freqs_hamp=None):
+        """Predict brightness temperatures of profiles.
+
+        Parameters:
+            profiles (list[dict]): Keyword arguments of run_arts for each
+                profile.
+            freqs_hamp (ndarray): Frequencies of HAMP channels in GHz. If
+                given, double bands are averaged to the HAMP channels.
+
+        Returns:
+            ndarray: Brightness temperatures of shape (profile, f_grid) or
+              (profile, freqs_hamp).
+        """
+        features = np.array([get_emulator_features(profile) for profile in profiles])
+        y = self.standardise(features) @ self.coefficients + self.intercept
+        if freqs_hamp is not None:
+            y = average_double_bands(y, freqs_hamp, f_grid=self.f_grid / 1e9)
+        return y
+
+    def is_out_of_distribution(self, profiles):
+        """Return for each profile if its features lie outside of the range
+        of the training features."""
+        features = np.array([get_emulator_features(profile) for profile in profiles])
+        x = self.standardise(features)
+        return (
+            (x < self.x_min - self.ood_tolerance)
+            | (x > self.x_max + self.ood_tolerance)
+        ).any(axis=1)
+
+    def run(self, profiles, freqs_hamp=None, **arts_kwargs):
+        """Predict brightness temperatures of profiles, profiles out of
+        distribution are simulated with ARTS instead.
+
+        Parameters:
+            profiles (list[dict]): Keyword arguments of run_arts for each
+                profile.
+            freqs_hamp (ndarray): Frequencies of HAMP channels in GHz. If
+                given, double bands are averaged to the HAMP channels.
+            **arts_kwargs: Keyword arguments of run_arts_parallel.
+
+        Returns:
+            tuple: Brightness temperatures of shape (profile, f_grid) or
+              (profile, freqs_hamp), nan where ARTS failed, and whether each
+              profile was emulated.
+        """
+        y = self.predict(profiles)
+        emulated = ~self.is_out_of_distribution(profiles)
+        fallback = np.where(~emulated)[0]
+        results = run_arts_parallel([profiles[i] for i in fallback], **arts_kwargs)
+        for i, (result, error) in zip(fallback, results):
+            y[i] = np.nan if error is not None else result[1]
+        if freqs_hamp is not None:
+            y = average_double_bands(y, freqs_hamp, f_grid=self.f_grid / 1e9)
+        return y, emulated
+
+    def evaluate(self, profiles, results, freqs_hamp=None):
+        """Error statistics of emulator against results of run_arts.
+
+        Parameters:
+            profiles (list[dict]): Keyword arguments of run_arts for each
+                profile.
+            results (list[tuple]): Result of run_arts for each profile.
+            freqs_hamp (ndarray): Frequencies of HAMP channels in GHz. If
+                given, statistics are calculated for the HAMP channels.
+
+        Returns:
+            dict: Frequencies and bias, rmse and maximum absolute error of
+              emulated brightness temperatures for each frequency.
+        """
+        y_arts = np.array([result[1] for result in results])
+        y_emulated = self.predict(profiles)
+        frequencies = self.f_grid / 1e9
+        if freqs_hamp is not None:
+            y_arts = average_double_bands(y_arts, freqs_hamp, f_grid=frequencies)
+            y_emulated = average_double_bands(
+                y_emulated, freqs_hamp, f_grid=frequencies
+            )
+            frequencies = np.asarray(freqs_hamp)
+        error = y_emulated - y_arts
+        return {
+            "frequency": frequencies,
+            "bias": error.mean(axis=0),
+            "rmse": np.sqrt((error**2).mean(axis=0)),
+            "max_abs_error": np.abs(error).max(axis=0),
+        }
+
+    def save(self, filename):
+        """Save fitted emulator to npz file."""
+        np.savez(
+            filename,
+            alpha=self.alpha,
+            ood_tolerance=self.ood_tolerance,
+            f_grid=self.f_grid,
+            mean=self.mean,
+            std=self.std,
+            x_min=self.x_min,
+            x_max=self.x_max,
+            intercept=self.intercept,
+            coefficients=self.coefficients,
+            **{f"stats_{name}": value for name, value in (self.stats or {}).items()},
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """Load emulator saved with save."""
+        with np.load(filename) as data:
+            emulator = cls(float(data["alpha"]), float(data["ood_tolerance"]))
+            for name in [
+                "f_grid",
+                "mean",
+                "std",
+                "x_min",
+                "x_max",
+                "intercept",
+                "coefficients",
+            ]:
+                setattr(emulator, name, data[name])
+            emulator.stats = {
+                name[len("stats_") :]: data[name]
+                for name in data.files
+                if name.startswith("stats_")
+            }
+        return emulator
+
+
+def train_emulator(
+    cache, test_fraction=0.2, seed=0, freqs_hamp=None, exclude=None, **kwargs
+):
+    """Train emulator on all entries of an ArtsResultCache.
+
+    A random fraction of the entries is held out to calculate the error
+    statistics of the emulator, which are stored in its stats attribute.
+    Only entries on the most common frequency grid are used.
+
+    Parameters:
+        cache (ArtsResultCache): Cache of ARTS results.
+        test_fraction (float): Fraction of entries held out for testing.
+        seed (int): Seed of random split into training and test entries.
+        freqs_hamp (ndarray): Frequencies of HAMP channels in GHz to calculate
+            the statistics for, defaults to frequency grid of simulations.
+        exclude (set[str]): Profile keys (see ArtsResultCache.profile_key) of
+            entries used neither for training nor testing, e.g. to evaluate
+            the emulator on a held-out flight.
+        **kwargs: Keyword arguments of ArtsEmulator.
+
+    Returns:
+        ArtsEmulator: Fitted emulator. Its stats hold n_train and n_test and,
+          if any entries were held out, their error statistics.
+
+    Raises:
+        ValueError: If there are no entries (after exclude) or none are left
+          for training.
+    """
+    entries = list(cache.entries())
+    if exclude:
+        entries = [
+            (profile, result)
+            for profile, result in entries
+            if cache.profile_key(profile) not in exclude
+        ]
+    if len(entries) == 0:
+        raise ValueError(f"No ARTS runs to train the emulator on in {cache.cache_dir}")
+    f_grids, counts = np.unique(
+        np.array([result[0] for _, result in entries if result[0].ndim == 1]),
+        axis=0,
+        return_counts=True,
+    )
+    f_grid = f_grids[np.argmax(counts)]
+    entries = [
+        (profile, result)
+        for profile, result in entries
+        if np.array_equal(result[0], f_grid)
+    ]
+
+    is_test = np.random.default_rng(seed).random(len(entries)) < test_fraction
+    train = [entry for entry, test in zip(entries, is_test) if not test]
+    test = [entry for entry, test in zip(entries, is_test) if test]
+
+    if len(train) == 0:
+        raise ValueError(
+            f"No ARTS runs left for training of {len(entries)} cache entries"
+        )
+
+    emulator = ArtsEmulator(**kwargs).fit(*zip(*train))
+    emulator.stats = {}
+    if len(test) > 0:
+        emulator.stats = emulator.evaluate(*zip(*test), freqs_hamp=freqs_hamp)
+    emulator.stats["n_train"] = len(train)
+    emulator.stats["n_test"] = len(test)
+    return emulator
@@ -1,3 +1,12 @@
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
 import numpy as np
 import pyarts
 from scipy.optimize import curve_fit
@@ -6,9 +15,85 @@ import pandas as pd
 from pyarts.workspace import arts_agenda
 
 
-def setup_workspace(verbosity=0):
+ABS_SPECIES = [
+    "H2O-PWR2022",
+    "O2-PWR2022",
+    "N2, N2-CIAfunCKDMT252, N2-CIArotCKDMT252",
+    "O3",
+]
+LINE_CUTOFF = 750e9  # [Hz]
+DOUBLE_SIDEBAND_CENTERS = [118.75, 183.31]  # [GHz]
+DOUBLE_SIDEBAND_MAX_OFFSET = 10  # [GHz]
+SIDEBAND_ATOL = 0.005  # [GHz]
+WORKSPACE_CACHE_FILES = {
+    "abs_lines_per_species": "abs_lines_per_species.xml",
+    "predefined_model_data": "predefined_model_data.xml",
+    "xsec_fit_data": "xsec_fit_data.xml",
+}
+# keyword arguments of run_arts which differ between the profiles of a batch
+BATCH_PROFILE_KEYS = [
+    "pressure_profile",
+    "temperature_profile",
+    "h2o_profile",
+    "surface_ws",
+    "surface_temp",
+    "height",
+]
+
+
+def get_workspace_cache_manifest(frequencies=None):
+    """Get manifest describing the absorption setup of setup_workspace."""
+    if frequencies is not None:
+        frequencies = hashlib.sha256(
+            np.asarray(frequencies, dtype=np.float64).tobytes()
+        ).hexdigest()
+    return {
+        "pyarts_version": pyarts.__version__,
+        "abs_species": ABS_SPECIES,
+        "line_cutoff": LINE_CUTOFF,
+        "frequencies": frequencies,
+    }
+
+
+def is_valid_workspace_cache(cache_dir, frequencies=None):
+    """Check if cache_dir holds the absorption setup of setup_workspace for
+    the current ARTS version, species, cutoff and frequencies."""
+    filename = os.path.join(cache_dir, "manifest.json")
+    if not os.path.exists(filename):
+        return False
+    with open(filename, "r") as file:
+        manifest = json.load(file)
+    return manifest == get_workspace_cache_manifest(frequencies)
+
+
+def replace_files(tmp_dir, target_dir, last):
+    """Move all files of tmp_dir into target_dir and remove tmp_dir.
+
+    Each file replaces its old version atomically, so concurrent readers never
+    see half written files. The file named last is moved last, so files
+    marking the others as complete (e.g. a manifest) appear only once all
+    other files are in place.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    filenames = sorted(os.listdir(tmp_dir), key=lambda filename: filename == last)
+    for filename in filenames:
+        os.replace(os.path.join(tmp_dir, filename), os.path.join(target_dir, filename))
+    shutil.rmtree(tmp_dir)
+
+
+def setup_workspace(verbosity=0, cache_dir=None, frequencies=None):
     """Set up ARTS workspace.
 
+    Parameters:
+        verbosity (int): ARTS verbosity.
+        cache_dir (str): Directory of the prepared absorption setup (line
+          catalog with cutoffs, model data, cross sections). It is read from
+          there if valid, otherwise it is read from the ARTS catalog and written
+          there for the next call. Files are written to a temporary directory
+          and then replaced atomically, so concurrent jobs can share it.
+        frequencies (ndarray): Frequency grid [Hz]. If given, only lines
+          relevant for this frequency grid are kept.
+
     Returns:
         Workspace: ARTS workspace.
     """
@@ -34,19 +119,21 @@ def setup_workspace(verbosity=0):
     ws.cloudboxOff()
 
     # Absorption species
-    ws.abs_speciesSet(
-        species=[
-            "H2O-PWR2022",
-            "O2-PWR2022",
-            "N2, N2-CIAfunCKDMT252, N2-CIArotCKDMT252",
-            "O3",
-        ]
-    )
+    ws.abs_speciesSet(species=ABS_SPECIES)
+
+    # Read prepared absorption setup from cache
+    if cache_dir is not None and is_valid_workspace_cache(cache_dir, frequencies):
+        for name, filename in WORKSPACE_CACHE_FILES.items():
+            ws.ReadXML(getattr(ws, name), os.path.join(cache_dir, filename))
+        return ws
 
     # Read a line file and a matching small frequency grid
     ws.abs_lines_per_speciesReadSpeciesSplitCatalog(basename="lines/")
-    ws.abs_lines_per_speciesCutoff(option="ByLine", value=750e9)
+    ws.abs_lines_per_speciesCutoff(option="ByLine", value=LINE_CUTOFF)
     ws.abs_lines_per_speciesTurnOffLineMixing()
+    if frequencies is not None:
+        ws.f_grid = np.array(frequencies)
+        ws.abs_lines_per_speciesCompact()
 
     # Load CKDMT400 model data
     ws.ReadXML(ws.predefined_model_data, "model/mt_ckd_4.0/H2O.xml")
@@ -54,9 +141,52 @@ def setup_workspace(verbosity=0):
     # Read cross section data
     ws.ReadXsecData(basename="lines/")
 
+    # Write prepared absorption setup to cache, manifest last marks it valid
+    if cache_dir is not None:
+        parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".workspace_cache.")
+        for name, filename in WORKSPACE_CACHE_FILES.items():
+            ws.WriteXML("binary", getattr(ws, name), os.path.join(tmp_dir, filename))
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as file:
+            json.dump(get_workspace_cache_manifest(frequencies), file)
+        # invalidate old cache before its files are replaced
+        try:
+            os.remove(os.path.join(cache_dir, "manifest.json"))
+        except FileNotFoundError:
+            pass
+        replace_files(tmp_dir, cache_dir, last="manifest.json")
+
     return ws
 
 
+def set_surface_rtprop_agenda(ws):
+    """Set up FASTEM ocean surface emission with the surface temperature and
+    wind speed taken from the workspace variables surface_temperature and wspeed.
+    """
+    ws.IndexCreate("nf")
+    ws.VectorCreate("trans")
+    ws.NumericCreate("wspeed")
+    ws.NumericCreate("surface_temperature")
+
+    # agenda for surface properties
+    @arts_agenda
+    def surface_rtprop_agenda_tessem(ws):
+        ws.Copy(ws.surface_skin_t, ws.surface_temperature)
+        ws.specular_losCalc()
+
+        ws.nelemGet(ws.nf, ws.f_grid)
+        ws.VectorSetConstant(ws.trans, ws.nf, 1.0)
+
+        ws.surfaceFastem(
+            salinity=0.034, wind_speed=ws.wspeed, transmittance=ws.transmittance
+        )
+
+    ws.VectorCreate("transmittance")
+    ws.transmittance = np.ones(ws.f_grid.value.shape)
+    ws.surface_rtprop_agenda = surface_rtprop_agenda_tessem(ws)
+
+
 def run_arts(
     pressure_profile,
     temperature_profile,
@@ -71,6 +201,7 @@ def run_arts(
     height=None,
     surface_altitude=0.0,
     frequencies=None,
+    use_abs_lookup=False,
 ):
     """Perform a radiative transfer simulation.
 
@@ -81,6 +212,8 @@ def run_arts(
         fmin (float): Minimum frequency [Hz].
         fmax (float): Maximum frequency [Hz].
         fnum (int): Number of frequency grid points.
+        use_abs_lookup (bool): Interpolate absorption from the lookup table
+          of ws (see setup_abs_lookup) instead of calculating it line-by-line.
 
     Returns:
         ndarray, ndarray, ndarray:
@@ -91,7 +224,8 @@ def run_arts(
     ws.f_grid = np.array(frequencies)
 
     # Throw away lines outside f_grid
-    ws.abs_lines_per_speciesCompact()
+    if not use_abs_lookup:
+        ws.abs_lines_per_speciesCompact()
 
     # No sensor properties
     ws.sensorOff()
@@ -131,35 +265,17 @@ def run_arts(
     ws.MatrixSet(ws.sensor_los, np.array([[zenith_angle]]))
 
     # configure surface emissions
-    ws.IndexCreate("nf")
-    ws.VectorCreate("trans")
-    ws.NumericCreate("wspeed")
-    ws.NumericCreate("surface_temperature")
+    set_surface_rtprop_agenda(ws)
 
     # Set surface temperature equal to the lowest atmosphere level
     ws.wspeed = surface_ws
     ws.surface_skin_t = surface_temp
     ws.surface_temperature = surface_temp
 
-    # agenda for surface properties
-    @arts_agenda
-    def surface_rtprop_agenda_tessem(ws):
-        ws.Copy(ws.surface_skin_t, ws.surface_temperature)
-        ws.specular_losCalc()
-
-        ws.nelemGet(ws.nf, ws.f_grid)
-        ws.VectorSetConstant(ws.trans, ws.nf, 1.0)
-
-        ws.surfaceFastem(
-            salinity=0.034, wind_speed=ws.wspeed, transmittance=ws.transmittance
-        )
-
-    ws.VectorCreate("transmittance")
-    ws.transmittance = np.ones(ws.f_grid.value.shape)
-    ws.surface_rtprop_agenda = surface_rtprop_agenda_tessem(ws)
-
     # Perform RT calculations
-    ws.propmat_clearsky_agendaAuto()  # Calculate the absorption coefficient matrix automatically
+    ws.propmat_clearsky_agendaAuto(
+        use_abs_lookup=int(use_abs_lookup)
+    )  # Calculate the absorption coefficient matrix automatically
     ws.lbl_checkedCalc()  # checks if line-by-line parameters are ok
     ws.atmfields_checkedCalc()
     ws.atmgeom_checkedCalc()
@@ -174,6 +290,697 @@ def run_arts(
     )
 
 
+def get_abs_lookup_filename(cache_dir, frequencies, **abs_lookup_range):
+    """Get filename of absorption lookup table in cache_dir.
+
+    The filename contains a hash of the frequency grid, the range of the
+    table and the ARTS version, so that tables are recalculated if any of
+    them change.
+
+    Returns:
+        str: Filename of absorption lookup table.
+    """
+    key = hashlib.sha256(np.asarray(frequencies, dtype=np.float64).tobytes())
+    key.update(repr(sorted(abs_lookup_range.items())).encode())
+    key.update(pyarts.__version__.encode())
+    return os.path.join(cache_dir, f"abs_lookup_{key.hexdigest()[:16]}.xml")
+
+
+def get_abs_lookup_id(abs_lookup):
+    """Get identity of an absorption lookup table.
+
+    Parameters:
+        abs_lookup (dict): Keyword arguments of setup_abs_lookup (without ws),
+          the table file has to exist.
+
+    Returns:
+        str: Hash of the settings of the table and size and modification time
+          of its file, which change whenever the table is rebuilt.
+    """
+    stat = os.stat(abs_lookup["filename"])
+    key = hashlib.sha256(
+        np.asarray(abs_lookup["frequencies"], dtype=np.float64).tobytes()
+    )
+    settings = {
+        name: value for name, value in abs_lookup.items() if name != "frequencies"
+    }
+    key.update(repr(sorted(settings.items())).encode())
+    key.update(f"{stat.st_size}_{stat.st_mtime_ns}".encode())
+    return key.hexdigest()
+
+
+def setup_abs_lookup(
+    ws,
+    frequencies,
+    filename,
+    p_min=5e3,
+    p_max=1.1e5,
+    t_min=180.0,
+    t_max=320.0,
+    h2o_min=0.0,
+    h2o_max=0.05,
+):
+    """Set up absorption lookup table for the frequency grid.
+
+    The table is read from filename if it exists. Otherwise it is calculated
+    line-by-line over the given pressure, temperature and H2O range (default
+    range covers the tropical dropsondes below the aircraft) and written
+    to filename.
+
+    Parameters:
+        ws (Workspace): ARTS workspace from setup_workspace.
+        frequencies (ndarray): Frequency grid [Hz].
+        filename (str): Filename of absorption lookup table.
+        p_min, p_max (float): Pressure range [Pa].
+        t_min, t_max (float): Temperature range [K].
+        h2o_min, h2o_max (float): H2O VMR range [1].
+    """
+    ws.f_grid = np.array(frequencies)
+    ws.abs_lines_per_speciesCompact()
+
+    if os.path.exists(filename):
+        ws.ReadXML(ws.abs_lookup, filename)
+    else:
+        print(f"Calculate absorption lookup table {filename}")
+        ws.AtmosphereSet1D()
+        ws.abs_lookupSetupWide(
+            p_min=p_min,
+            p_max=p_max,
+            t_min=t_min,
+            t_max=t_max,
+            h2o_min=h2o_min,
+            h2o_max=h2o_max,
+        )
+        ws.propmat_clearsky_agendaAuto()
+        ws.lbl_checkedCalc()
+        ws.abs_lookupCalc()
+        # table (with its .bin file) appears atomically, see replace_files
+        lookup_dir = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(lookup_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=lookup_dir, prefix=".abs_lookup.")
+        basename = os.path.basename(filename)
+        ws.WriteXML("binary", ws.abs_lookup, os.path.join(tmp_dir, basename))
+        replace_files(tmp_dir, lookup_dir, last=basename)
+
+    ws.abs_lookupAdapt()
+
+
+def compare_abs_lookup(profiles, abs_lookup, verbosity=0):
+    """Compare radiative transfer with absorption lookup table to line-by-line.
+
+    Parameters:
+        profiles (list[dict]): Keyword arguments of run_arts (without ws) for
+            each profile.
+        abs_lookup (dict): Keyword arguments of setup_abs_lookup (without ws).
+
+    Returns:
+        xr.Dataset: Brightness temperatures of both modes, their difference and
+          the run time per profile of both modes.
+    """
+    ws_lbl = setup_workspace(verbosity=verbosity)
+    ws_lookup = setup_workspace(verbosity=verbosity)
+    setup_abs_lookup(ws_lookup, **abs_lookup)
+
+    TB_lbl, TB_lookup, time_lbl, time_lookup = [], [], [], []
+    for profile in profiles:
+        start = time.perf_counter()
+        f_grid, y, _ = run_arts(ws=ws_lbl, **profile)
+        time_lbl.append(time.perf_counter() - start)
+        TB_lbl.append(y)
+
+        start = time.perf_counter()
+        _, y, _ = run_arts(ws=ws_lookup, use_abs_lookup=True, **profile)
+        time_lookup.append(time.perf_counter() - start)
+        TB_lookup.append(y)
+
+    ds = xr.Dataset(
+        {
+            "TB_lbl": (("profile", "frequency"), np.array(TB_lbl)),
+            "TB_lookup": (("profile", "frequency"), np.array(TB_lookup)),
+            "time_lbl": (("profile"), np.array(time_lbl)),
+            "time_lookup": (("profile"), np.array(time_lookup)),
+        },
+        coords={"frequency": f_grid / 1e9},
+    )
+    ds["TB_error"] = ds["TB_lookup"] - ds["TB_lbl"]
+
+    print(
+        pd.DataFrame(
+            {
+                "bias / K": ds["TB_error"].mean("profile").values,
+                "rmse / K": np.sqrt((ds["TB_error"] ** 2).mean("profile")).values,
+                "max abs error / K": np.abs(ds["TB_error"]).max("profile").values,
+            },
+            index=ds.frequency.values,
+        )
+    )
+    print(
+        f"Mean time per profile: line-by-line {ds['time_lbl'].mean().values:.2f}s, "
+        f"lookup table {ds['time_lookup'].mean().values:.2f}s, "
+        f"speedup {(ds['time_lbl'] / ds['time_lookup']).mean().values:.1f}x"
+    )
+
+    return ds
+
+
+class ArtsResultCache:
+    """Content-addressed on-disk cache of run_arts results.
+
+    Results are keyed by a hash of all inputs of run_arts (profiles, surface
+    parameters, sensor height and zenith angle, frequency grid, ...), the
+    ARTS and catalog version and, for profiles with use_abs_lookup, the
+    identity of the absorption lookup table (see get_abs_lookup_id). Each entry
+    stores the inputs as well as the frequency grid, brightness temperatures
+    and optical depth.
+
+    Parameters:
+        cache_dir (str): Directory of the cache.
+        catalog_version (str): Version of the ARTS catalog, defaults to the
+          pyarts version (version retrieved by pyarts.cat.download.retrieve).
+    """
+
+    def __init__(self, cache_dir, catalog_version=None):
+        self.cache_dir = cache_dir
+        if catalog_version is None:
+            catalog_version = pyarts.__version__
+        self.version = f"pyarts-{pyarts.__version__}_catalog-{catalog_version}"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, profile, abs_lookup_id=None):
+        key = hashlib.sha256(self.version.encode())
+        for name in sorted(profile):
+            key.update(name.encode())
+            key.update(np.asarray(profile[name], dtype=np.float64).tobytes())
+        if profile.get("use_abs_lookup", False):
+            key.update(f"abs_lookup_{abs_lookup_id}".encode())
+        return key.hexdigest()
+
+    def profile_key(self, profile):
+        """Hash of the atmospheric and sensor inputs of run_arts only, the same
+        for all entries of a profile (any ARTS version or absorption lookup)."""
+        key = hashlib.sha256()
+        for name in sorted(profile):
+            if name == "use_abs_lookup":
+                continue
+            key.update(name.encode())
+            key.update(np.asarray(profile[name], dtype=np.float64).tobytes())
+        return key.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, profile, abs_lookup_id=None):
+        """Return cached result of run_arts for profile (using the absorption
+        lookup table abs_lookup_id, see get_abs_lookup_id) or None."""
+        filename = self.filename(self.key(profile, abs_lookup_id))
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with np.load(filename) as entry:
+            return entry["f_grid"], entry["y"], entry["y_aux"]
+
+    def put(self, profile, result, abs_lookup_id=None):
+        """Store result of run_arts for profile (see get)."""
+        filename = self.filename(self.key(profile, abs_lookup_id))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        f_grid, y, y_aux = result
+        inputs = {f"input_{name}": value for name, value in profile.items()}
+        tmpname = f"{filename}.{os.getpid()}.tmp.npz"
+        np.savez(tmpname, f_grid=f_grid, y=y, y_aux=y_aux, **inputs)
+        os.replace(tmpname, filename)  # atomic, entries are never half written
+
+    def entries(self):
+        """Yield inputs and result of run_arts of all cache entries."""
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in sorted(filenames):
+                if not filename.endswith(".npz") or filename.endswith(".tmp.npz"):
+                    continue
+                with np.load(os.path.join(dirpath, filename)) as entry:
+                    profile = {
+                        name[len("input_") :]: entry[name]
+                        for name in entry.files
+                        if name.startswith("input_")
+                    }
+                    yield profile, (entry["f_grid"], entry["y"], entry["y_aux"])
+
+    def stats(self):
+        """Return number of hits, misses and entries of the cache."""
+        n_requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_requests if n_requests else np.nan,
+            "entries": sum(
+                filename.endswith(".npz") and not filename.endswith(".tmp.npz")
+                for _, _, filenames in os.walk(self.cache_dir)
+                for filename in filenames
+            ),
+        }
+
+
+_worker_ws = None
+
+
+def _init_arts_worker(verbosity, abs_lookup, workspace_cache):
+    """Set up the ARTS workspace of a worker process once."""
+    global _worker_ws
+    _worker_ws = setup_workspace(verbosity=verbosity, **(workspace_cache or {}))
+    if abs_lookup is not None:
+        setup_abs_lookup(_worker_ws, **abs_lookup)
+
+
+def _run_arts_worker(profile):
+    """Run ARTS for one profile on the workspace of the worker process.
+
+    Returns:
+        tuple: Result of run_arts (or None) and error message (or None).
+    """
+    try:
+        return run_arts(ws=_worker_ws, **profile), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _run_arts_batch_worker(profiles):
+    """Run ARTS for a batch of profiles in one ybatchCalc (see run_arts_batch)
+    on the workspace of the worker process.
+
+    Returns:
+        list[tuple]: Result of run_arts (or None) and error message (or None)
+          for each profile.
+    """
+    settings = {
+        name: value
+        for name, value in profiles[0].items()
+        if name not in BATCH_PROFILE_KEYS
+    }
+    try:
+        ds_batch = run_arts_batch(
+            stack_arts_profiles(profiles, np.arange(len(profiles))),
+            ws=_worker_ws,
+            **settings,
+        )
+    except Exception as e:
+        return [(None, f"{type(e).__name__}: {e}")] * len(profiles)
+
+    f_grid = np.array(settings["frequencies"], dtype=float)
+    results = []
+    for y, y_aux in zip(ds_batch["TB"].values, ds_batch["optical_depth"].values):
+        if np.isnan(y).all():
+            results.append((None, "ybatchCalc failed for profile"))
+        else:
+            results.append(((f_grid, y, y_aux), None))
+    return results
+
+
+def get_batch_settings(profile):
+    """Keyword arguments of run_arts which have to be the same for all
+    profiles of a batch, hashable to compare profiles."""
+    return tuple(
+        (name, np.asarray(value, dtype=np.float64).tobytes())
+        for name, value in sorted(profile.items())
+        if name not in BATCH_PROFILE_KEYS
+    )
+
+
+def split_arts_batches(profiles, batch_size):
+    """Split profiles into consecutive batches of at most batch_size profiles
+    with the same settings (see get_batch_settings)."""
+    batches = []
+    for _, group in itertools.groupby(profiles, key=get_batch_settings):
+        group = list(group)
+        batches += [
+            group[start : start + batch_size]
+            for start in range(0, len(group), batch_size)
+        ]
+    return batches
+
+
+def iter_arts_parallel(
+    profiles,
+    n_workers=None,
+    verbosity=0,
+    abs_lookup=None,
+    cache=None,
+    workspace_cache=None,
+    batch_size=None,
+):
+    """Perform radiative transfer simulations for many profiles in parallel.
+
+    Each worker process sets up its own ARTS workspace once. Profiles are
+    handed out to the workers one at a time as they become idle and the
+    results are yielded in the order of the profiles. With batch_size,
+    batches of profiles are handed out instead and simulated in one ARTS
+    call each (see run_arts_batch).
+
+    Parameters:
+        profiles (list[dict]): Keyword arguments of run_arts (without ws) for
+            each profile.
+        n_workers (int): Number of worker processes, defaults to number of CPUs.
+        verbosity (int): ARTS verbosity of the workspaces.
+        abs_lookup (dict): Keyword arguments of setup_abs_lookup (without ws)
+            to set up the absorption lookup table of each workspace. Profiles
+            need use_abs_lookup=True to use it.
+        cache (ArtsResultCache): Cache of results. Only profiles which are not
+            in the cache are simulated, their results are added to the cache.
+        workspace_cache (dict): Keyword arguments cache_dir and frequencies of
+            setup_workspace to load the prepared absorption setup of each
+            workspace from disk.
+        batch_size (int): Number of profiles per ARTS call, None runs each
+            profile separately with run_arts. Check batched against separate
+            results with check_arts_batch first.
+
+    Yields:
+        tuple: Result of run_arts (or None) and error message (or None).
+    """
+    # results of lookup table runs are cached per table, so build it first
+    abs_lookup_id = None
+    if cache is not None and abs_lookup is not None:
+        if not os.path.exists(abs_lookup["filename"]):
+            setup_abs_lookup(
+                setup_workspace(verbosity=verbosity, **(workspace_cache or {})),
+                **abs_lookup,
+            )
+        abs_lookup_id = get_abs_lookup_id(abs_lookup)
+
+    cached = [None] * len(profiles)
+    if cache is not None:
+        cached = [cache.get(profile, abs_lookup_id) for profile in profiles]
+    missing = [profile for profile, result in zip(profiles, cached) if result is None]
+    if len(missing) == 0:
+        for result in cached:
+            yield result, None
+        return
+
+    if batch_size is not None:
+        tasks = split_arts_batches(missing, batch_size)
+        run_task = _run_arts_batch_worker
+    else:
+        tasks = missing
+        run_task = _run_arts_worker
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    # prepare absorption setup once instead of in every worker at the same time
+    if workspace_cache is not None and not is_valid_workspace_cache(**workspace_cache):
+        setup_workspace(verbosity=verbosity, **workspace_cache)
+
+    with multiprocessing.Pool(
+        n_workers,
+        initializer=_init_arts_worker,
+        initargs=(verbosity, abs_lookup, workspace_cache),
+    ) as pool:
+        simulated = pool.imap(run_task, tasks, chunksize=1)
+        if batch_size is not None:
+            simulated = itertools.chain.from_iterable(simulated)
+        for profile, result in zip(profiles, cached):
+            if result is not None:
+                yield result, None
+                continue
+            result, error = next(simulated)
+            if cache is not None and error is None:
+                cache.put(profile, result, abs_lookup_id)
+            yield result, error
+
+
+def run_arts_parallel(
+    profiles,
+    n_workers=None,
+    verbosity=0,
+    abs_lookup=None,
+    cache=None,
+    workspace_cache=None,
+    on_result=None,
+    batch_size=None,
+):
+    """Perform radiative transfer simulations for many profiles in parallel.
+
+    See iter_arts_parallel for parameters.
+
+    Parameters:
+        on_result (callable): Called with the index of the profile, the result
+            and the error message as soon as the profile is done, e.g. to hand
+            the result on to a plotting queue.
+
+    Returns:
+        list[tuple]: Result of run_arts (or None) and error message (or None)
+          for each profile.
+    """
+    if len(profiles) == 0:
+        return []
+
+    start = time.perf_counter()
+    results = []
+    for result, error in iter_arts_parallel(
+        profiles, n_workers, verbosity, abs_lookup, cache, workspace_cache, batch_size
+    ):
+        if on_result is not None:
+            on_result(len(results), result, error)
+        results.append((result, error))
+    minutes = (time.perf_counter() - start) / 60
+    n_failed = sum(error is not None for _, error in results)
+    print(
+        f"ARTS: {len(profiles)} profiles ({n_failed} failed) in {minutes:.2f}min, "
+        f"{len(profiles) / minutes:.1f} profiles per minute"
+    )
+    if cache is not None:
+        print(f"ARTS result cache: {cache.stats()}")
+
+    return results
+
+
+def check_arts_batch(profiles, batch_size, atol=0.01, **kwargs):
+    """Check that batched ARTS calls (see run_arts_batch) reproduce the
+    results of separate calls of run_arts for the first batch of profiles.
+
+    Parameters:
+        profiles (list[dict]): Keyword arguments of run_arts for each profile.
+        batch_size (int): Number of profiles per ARTS call.
+        atol (float): Maximum difference of brightness temperatures [K].
+        **kwargs: Keyword arguments of iter_arts_parallel, without cache.
+
+    Returns:
+        float: Maximum difference of brightness temperatures [K].
+
+    Raises:
+        ValueError: If the results differ by more than atol or failed in
+          only one of both runs.
+    """
+    profiles = profiles[:batch_size]
+    separate = list(iter_arts_parallel(profiles, **kwargs))
+    batched = list(iter_arts_parallel(profiles, batch_size=batch_size, **kwargs))
+
+    max_diff = 0.0
+    for (result, error), (result_batch, error_batch) in zip(separate, batched):
+        if (error is None) != (error_batch is None):
+            raise ValueError(
+                f"ARTS failed in one run only: separate {error}, batched {error_batch}"
+            )
+        if error is None:
+            max_diff = max(max_diff, np.max(np.abs(result[1] - result_batch[1])))
+    if max_diff > atol:
+        raise ValueError(
+            f"Batched ARTS differs from separate runs by {max_diff:.4f}K > {atol}K"
+        )
+    print(f"Batched ARTS matches separate runs within {max_diff:.4f}K")
+    return max_diff
+
+
+def stack_arts_profiles(profiles, sonde_ids):
+    """Stack profiles into a dataset for run_arts_batch.
+
+    Parameters:
+        profiles (list[dict]): Keyword arguments of run_arts for each profile.
+        sonde_ids (list): Sonde id of each profile.
+
+    Returns:
+        xr.Dataset: Profiles with dimensions (sonde_id, alt), padded with nan.
+    """
+    n_levels = max(len(profile["pressure_profile"]) for profile in profiles)
+
+    def pad(values):
+        return np.pad(
+            np.asarray(values, dtype=float),
+            (0, n_levels - len(values)),
+            constant_values=np.nan,
+        )
+
+    return xr.Dataset(
+        {
+            "p": (
+                ("sonde_id", "alt"),
+                np.array([pad(profile["pressure_profile"]) for profile in profiles]),
+            ),
+            "ta": (
+                ("sonde_id", "alt"),
+                np.array([pad(profile["temperature_profile"]) for profile in profiles]),
+            ),
+            "h2o": (
+                ("sonde_id", "alt"),
+                np.array([pad(profile["h2o_profile"]) for profile in profiles]),
+            ),
+            "surface_temp": (
+                ("sonde_id"),
+                np.array([profile["surface_temp"] for profile in profiles]),
+            ),
+            "surface_ws": (
+                ("sonde_id"),
+                np.array([profile["surface_ws"] for profile in profiles]),
+            ),
+            "height": (
+                ("sonde_id"),
+                np.array([profile["height"] for profile in profiles]),
+            ),
+        },
+        coords={"sonde_id": sonde_ids},
+    )
+
+
+def run_arts_batch(
+    ds_profiles,
+    ws: pyarts.workspace.Workspace,
+    frequencies,
+    N2=0.78,
+    O2=0.21,
+    O3=1e-6,
+    zenith_angle=180,
+    surface_altitude=0.0,
+    use_abs_lookup=False,
+):
+    """Perform radiative transfer simulations for a batch of profiles in one
+    ARTS call (ybatchCalc). Everything that does not depend on the profile is
+    set up once, only atmosphere, surface and sensor height change per profile.
+
+    Parameters:
+        ds_profiles (xr.Dataset): Profiles with variables p [Pa], ta [K] and
+          h2o [VMR] with dimensions (sonde_id, alt) and surface_temp [K],
+          surface_ws [m/s] and height (sensor height) [m] with dimension
+          sonde_id. Levels with nan values are ignored.
+        ws (Workspace): ARTS workspace from setup_workspace.
+        frequencies (ndarray): Frequency grid [Hz].
+        zenith_angle (float): Viewing angle [deg].
+        use_abs_lookup (bool): Interpolate absorption from the lookup table
+          of ws (see setup_abs_lookup) instead of calculating it line-by-line.
+
+    Returns:
+        xr.Dataset: Brightness temperature [K] and optical depth [1] with
+          dimensions (sonde_id, frequency), nan for failed profiles.
+    """
+
+    # Invariant setup, see run_arts
+    ws.f_grid = np.array(frequencies)
+    if not use_abs_lookup:
+        ws.abs_lines_per_speciesCompact()
+    ws.sensorOff()
+    ws.StringSet(ws.iy_unit, "PlanckBT")
+    ws.ArrayOfStringSet(ws.iy_aux_vars, ["Optical depth"])
+
+    ws.Touch(ws.lat_grid)
+    ws.Touch(ws.lon_grid)
+    ws.lat_true = np.array([0.0])
+    ws.lon_true = np.array([0.0])
+    ws.AtmosphereSet1D()
+    ws.z_surface = np.array([[surface_altitude]])
+    ws.p_hse = 100000
+    ws.z_hse_accuracy = 100.0
+    ws.MatrixSet(ws.sensor_los, np.array([[zenith_angle]]))
+
+    set_surface_rtprop_agenda(ws)
+    ws.propmat_clearsky_agendaAuto(use_abs_lookup=int(use_abs_lookup))
+    ws.lbl_checkedCalc()
+
+    # Atmosphere, surface and sensor of each profile
+    p_grids, t_fields, z_fields, vmr_fields, sensor_pos = [], [], [], [], []
+    for sonde_id in ds_profiles.sonde_id.values:
+        ds_loc = ds_profiles.sel(sonde_id=sonde_id)
+        valid = (
+            ~np.isnan(ds_loc["p"].values)
+            & ~np.isnan(ds_loc["ta"].values)
+            & ~np.isnan(ds_loc["h2o"].values)
+        )
+        pressure = ds_loc["p"].values[valid]
+        vmr_field = np.zeros((4, pressure.size, 1, 1))
+        vmr_field[0, :, 0, 0] = ds_loc["h2o"].values[valid]
+        vmr_field[1, :, 0, 0] = O2
+        vmr_field[2, :, 0, 0] = N2
+        vmr_field[3, :, 0, 0] = O3
+
+        p_grids.append(pressure)
+        t_fields.append(ds_loc["ta"].values[valid][:, np.newaxis, np.newaxis])
+        z_fields.append(16e3 * (5 - np.log10(pressure[:, np.newaxis, np.newaxis])))
+        vmr_fields.append(vmr_field)
+        sensor_pos.append(np.array([[float(ds_loc["height"])]]))
+
+    # workspaces of worker processes run many batches, create variables once
+    for create, name in [
+        ("ArrayOfVectorCreate", "batch_p_grid"),
+        ("ArrayOfTensor3Create", "batch_t_field"),
+        ("ArrayOfTensor3Create", "batch_z_field"),
+        ("ArrayOfTensor4Create", "batch_vmr_field"),
+        ("ArrayOfMatrixCreate", "batch_sensor_pos"),
+        ("VectorCreate", "batch_surface_temperature"),
+        ("VectorCreate", "batch_wspeed"),
+    ]:
+        if not hasattr(ws, name):
+            getattr(ws, create)(name)
+    ws.batch_p_grid = p_grids
+    ws.batch_t_field = t_fields
+    ws.batch_z_field = z_fields
+    ws.batch_vmr_field = vmr_fields
+    ws.batch_sensor_pos = sensor_pos
+    ws.batch_surface_temperature = ds_profiles["surface_temp"].values.astype(float)
+    ws.batch_wspeed = ds_profiles["surface_ws"].values.astype(float)
+
+    @arts_agenda
+    def ybatch_calc_agenda(ws):
+        ws.Extract(ws.p_grid, ws.batch_p_grid, ws.ybatch_index)
+        ws.Extract(ws.t_field, ws.batch_t_field, ws.ybatch_index)
+        ws.Extract(ws.z_field, ws.batch_z_field, ws.ybatch_index)
+        ws.Extract(ws.vmr_field, ws.batch_vmr_field, ws.ybatch_index)
+        ws.Extract(ws.sensor_pos, ws.batch_sensor_pos, ws.ybatch_index)
+        ws.Extract(
+            ws.surface_temperature, ws.batch_surface_temperature, ws.ybatch_index
+        )
+        ws.Extract(ws.wspeed, ws.batch_wspeed, ws.ybatch_index)
+        ws.Copy(ws.surface_skin_t, ws.surface_temperature)
+        ws.atmfields_checkedCalc()
+        ws.z_fieldFromHSE()
+        ws.atmfields_checkedCalc()
+        ws.atmgeom_checkedCalc()
+        ws.cloudbox_checkedCalc()
+        ws.sensor_checkedCalc()
+        ws.yCalc()
+
+    ws.ybatch_calc_agenda = ybatch_calc_agenda(ws)
+    ws.IndexSet(ws.ybatch_start, 0)
+    ws.IndexSet(ws.ybatch_n, ds_profiles.sonde_id.size)
+    ws.ybatchCalc(robust=1)  # failed profiles do not stop the batch
+
+    # Failed profiles have empty results
+    nf = ws.f_grid.value.shape[0]
+    TB = np.full((ds_profiles.sonde_id.size, nf), np.nan)
+    optical_depth = np.full((ds_profiles.sonde_id.size, nf), np.nan)
+    for i, (y, y_aux) in enumerate(zip(ws.ybatch.value, ws.ybatch_aux.value)):
+        if len(y) == nf:
+            TB[i] = np.array(y)
+            optical_depth[i] = np.array(y_aux[0])
+
+    return xr.Dataset(
+        {
+            "TB": (("sonde_id", "frequency"), TB),
+            "optical_depth": (("sonde_id", "frequency"), optical_depth),
+        },
+        coords={
+            "sonde_id": ds_profiles.sonde_id.values,
+            "frequency": ws.f_grid.value[:].copy() / 1e9,
+        },
+    )
+
+
 def exponential(x, a, b):
     return a * np.exp(b * x)
 
@@ -258,85 +1065,219 @@ def extrapolate_dropsonde(ds_dropsonde, height, ds_bahamas):
     )
 
 
-def average_double_bands(TB, freqs_hamp):
-    """Average double bands of ARTS simulations.
+def _interpolate_na_rows(x, y):
+    """Linearly interpolate interior nans along the rows of y."""
+    size = y.shape[1]
+    levels = np.arange(size)
+    valid = ~np.isnan(y)
+    prev = np.maximum.accumulate(np.where(valid, levels, -1), axis=1)
+    next = np.minimum.accumulate(np.where(valid, levels, size)[:, ::-1], axis=1)[
+        :, ::-1
+    ]
+    interior = ~valid & (prev >= 0) & (next < size)
+    prev = np.clip(prev, 0, size - 1)
+    next = np.clip(next, 0, size - 1)
+    x0, x1 = np.take_along_axis(x, prev, 1), np.take_along_axis(x, next, 1)
+    y0, y1 = np.take_along_axis(y, prev, 1), np.take_along_axis(y, next, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        filled = y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return np.where(interior, filled, y)
+
+
+def _get_extrapolation_mask(y, inside):
+    """Levels to extrapolate as in fit_exponential and fit_linear: nans
+    plus the level below each nan (overlap of one), the first nan of a
+    profile marks its last level."""
+    nanmask = np.isnan(y) & inside
+    mask = nanmask.copy()
+    mask[:, :-1] |= nanmask[:, 1:]
+    n_levels = inside.sum(axis=1)
+    wrap = nanmask[:, 0] & (n_levels > 0)
+    mask[np.where(wrap)[0], n_levels[wrap] - 1] = True
+    return nanmask, mask
+
+
+def _fit_exponential_rows(x, y, inside):
+    """Closed-form log-linear version of fit_exponential along rows."""
+    nanmask, mask = _get_extrapolation_mask(y, inside)
+    valid = ~nanmask & inside
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_valid = valid.sum(axis=1, keepdims=True)
+        log_y = np.log(np.where(valid, y, 1))
+        x_mean = np.where(valid, x, 0).sum(axis=1, keepdims=True) / n_valid
+        log_y_mean = np.where(valid, log_y, 0).sum(axis=1, keepdims=True) / n_valid
+        dx = np.where(valid, x - x_mean, 0)
+        b = (dx * (log_y - log_y_mean)).sum(axis=1, keepdims=True) / (dx**2).sum(
+            axis=1, keepdims=True
+        )
+        a = np.exp(log_y_mean - b * x_mean)
+
+    levels = np.arange(y.shape[1])
+    last = np.where(valid, levels, -1).max(axis=1, keepdims=True)
+    offset = np.take_along_axis(y, np.clip(last, 0, None), 1)
+    first = np.argmax(mask, axis=1)[:, None]
+    new_vals = exponential(x, a, b)
+    new_first = exponential(np.take_along_axis(x, first, 1), a, b)
+    filled = np.where(mask, new_vals - new_first + offset, y)
+    filled[last[:, 0] < 0] = np.nan
+    return filled
+
+
+def _fit_linear_rows(x, y, upper_val, height, inside):
+    """fit_linear along rows."""
+    nanmask, mask = _get_extrapolation_mask(y, inside)
+    levels = np.arange(y.shape[1])
+    last = np.where(~nanmask & inside, levels, -1).max(axis=1, keepdims=True)
+    last_val = np.take_along_axis(y, np.clip(last, 0, None), 1)
+    last_height = np.take_along_axis(x, np.clip(last, 0, None), 1)
+    slope = (upper_val[:, None] - last_val) / (height[:, None] - last_height)
+    filled = np.where(mask, slope * (x - last_height) + last_val, y)
+    filled[last[:, 0] < 0] = np.nan
+    return filled
+
+
+def extrapolate_dropsondes(ds_dropsonde, heights, ds_bahamas):
+    """Extrapolate the dropsonde profiles of a flight to flight altitude.
+
+    Batched version of extrapolate_dropsonde which treats all sondes at once.
+    Pressure is extrapolated with a log-linear least squares fit instead of
+    curve_fit, temperature and humidity linearly to the BAHAMAS values at the
+    launch times.
 
     Parameters:
-        TB (ndarray): Brightness temperatures.
+        ds_dropsonde (xr.Dataset): Dropsondes with p, ta, q on (sonde_id, alt)
+            and launch_time.
+        heights (array-like): Flight altitude at each sonde in m.
+        ds_bahamas (xr.Dataset): BAHAMAS data with TS and MIXRATIO.
 
     Returns:
-        ndarray: Averaged brightness temperatures.
+        xr.Dataset: p, ta and q on (sonde_id, alt). Levels above flight
+          altitude, dropped levels and sondes which cannot be extrapolated
+          are nan.
     """
-
-    TB_averaged = pd.DataFrame(index=freqs_hamp, columns=["TB"])
-    single_freqs = np.float32(
-        np.array(
-            [
-                22.24,
-                23.04,
-                23.84,
-                25.44,
-                26.24,
-                27.84,
-                31.4,
-                50.3,
-                51.76,
-                52.8,
-                53.75,
-                54.94,
-                56.66,
-                58.0,
-                90,
-            ]
-        )
+    ds_dropsonde = ds_dropsonde.transpose("sonde_id", "alt", ...)
+    alt = ds_dropsonde["alt"].values.astype(float)
+    heights = np.asarray(heights, dtype=float)
+    p = ds_dropsonde["p"].values.astype(float)
+
+    # move levels below aircraft to front of each row, except nan pressures
+    # at lower levels
+    levels_kept = (alt < heights[:, None]) & ~(np.isnan(p) & (alt < 100))
+    order = np.argsort(~levels_kept, axis=1, kind="stable")
+    inside = np.arange(alt.size) < levels_kept.sum(axis=1, keepdims=True)
+
+    def compact(values):
+        values = np.take_along_axis(np.broadcast_to(values, p.shape), order, 1)
+        return np.where(inside, values, np.nan)
+
+    def expand(values):
+        expanded = np.full(values.shape, np.nan)
+        np.put_along_axis(expanded, order, values, 1)
+        return expanded
+
+    x = compact(alt)
+    upper = ds_bahamas[["TS", "MIXRATIO"]].sel(
+        time=xr.DataArray(ds_dropsonde["launch_time"].values, dims="sonde_id"),
+        method="nearest",
     )
-    double_freqs = np.float32(
-        np.array(
-            [
-                120.15,
-                121.05,
-                122.95,
-                127.25,
-                183.91,
-                184.81,
-                185.81,
-                186.81,
-                188.31,
-                190.81,
-            ]
-        )
+
+    p_extrap = _fit_exponential_rows(x, _interpolate_na_rows(x, compact(p)), inside)
+    ta_extrap = _fit_linear_rows(
+        x,
+        _interpolate_na_rows(x, compact(ds_dropsonde["ta"].values)),
+        upper["TS"].values,
+        heights,
+        inside,
     )
-    mirror_freqs = np.float32(
-        np.array(
-            [
-                117.35,
-                116.45,
-                114.55,
-                110.25,
-                182.71,
-                181.81,
-                179.81,
-                178.31,
-                180.81,
-                175.81,
-            ]
-        )
+    q_extrap = _fit_linear_rows(
+        x,
+        _interpolate_na_rows(x, compact(ds_dropsonde["q"].values)),
+        upper["MIXRATIO"].values / 1e3,
+        heights,
+        inside,
     )
-    counterparts = pd.DataFrame(
-        data=mirror_freqs, index=double_freqs, columns=["mirror_freq"]
+
+    failed = np.isnan(p_extrap) | np.isnan(ta_extrap) | np.isnan(q_extrap)
+    failed = (failed & inside).any(axis=1)
+    extrapolated = {}
+    for name, values in [("p", p_extrap), ("ta", ta_extrap), ("q", q_extrap)]:
+        values = np.where(inside, values, np.nan)
+        values[failed] = np.nan
+        extrapolated[name] = (("sonde_id", "alt"), expand(values))
+
+    return xr.Dataset(
+        extrapolated,
+        coords={"sonde_id": ds_dropsonde["sonde_id"].values, "alt": alt},
     )
-    for freq in freqs_hamp:
-        if freq in single_freqs:
-            TB_averaged.loc[freq] = TB.loc[freq].values[0]
+
+
+@functools.lru_cache(maxsize=16)
+def _get_sideband_matrix(f_grid, freqs_hamp):
+    f_grid = np.array(f_grid)
+    matrix = np.zeros((len(freqs_hamp), f_grid.size))
+
+    def index(freq):
+        idx = np.argmin(np.abs(f_grid - freq))
+        if not np.isclose(f_grid[idx], freq, atol=SIDEBAND_ATOL):
+            raise KeyError(f"Frequency {freq} GHz is not simulated")
+        return idx
+
+    for i, freq in enumerate(freqs_hamp):
+        center = DOUBLE_SIDEBAND_CENTERS[
+            np.argmin(np.abs(np.array(DOUBLE_SIDEBAND_CENTERS) - freq))
+        ]
+        if np.abs(freq - center) > DOUBLE_SIDEBAND_MAX_OFFSET:
+            matrix[i, index(freq)] = 1
         else:
-            TB_averaged.loc[freq] = np.mean(
-                [
-                    float(TB.loc[freq].values),
-                    float(TB.loc[counterparts.loc[freq].values].values),
-                ]
-            )
+            matrix[i, index(freq)] += 0.5
+            matrix[i, index(2 * center - freq)] += 0.5
+    matrix.flags.writeable = False
+    return matrix
+
+
+def get_sideband_matrix(f_grid, freqs_hamp):
+    """Matrix averaging the simulated sidebands of each HAMP channel.
+
+    Single sideband channels take the simulated value at their frequency,
+    double sideband channels the mean of the simulated values at their
+    frequency and its mirror frequency about the center frequency. The
+    matrix is derived once per frequency grid and then reused.
+
+    Parameters:
+        f_grid (ndarray): Simulated frequencies in GHz.
+        freqs_hamp (ndarray): Frequencies of HAMP channels in GHz.
+
+    Returns:
+        ndarray: Matrix of shape (freqs_hamp, f_grid).
+    """
+    return _get_sideband_matrix(
+        tuple(np.round(np.asarray(f_grid, dtype=float), 4)),
+        tuple(np.round(np.asarray(freqs_hamp, dtype=float), 4)),
+    )
+
+
+def average_double_bands(TB, freqs_hamp, f_grid=None):
+    """Average double bands of ARTS simulations.
+
+    Parameters:
+        TB (DataFrame or ndarray): Brightness temperatures indexed by the
+            simulated frequencies in GHz, or array of shape (..., f_grid),
+            e.g. (sonde, f_grid) for many simulations at once.
+        freqs_hamp (ndarray): Frequencies of HAMP channels in GHz.
+        f_grid (ndarray): Simulated frequencies in GHz, only needed if TB is
+            an array.
+
+    Returns:
+        DataFrame or ndarray: Averaged brightness temperatures indexed by
+          freqs_hamp, or array of shape (..., freqs_hamp).
+    """
+    if isinstance(TB, pd.DataFrame):
+        matrix = get_sideband_matrix(TB.index.values, freqs_hamp)
+        return pd.DataFrame(
+            data=matrix @ TB.values[:, 0], index=freqs_hamp, columns=["TB"]
+        )
 
-    return TB_averaged
+    return np.asarray(TB) @ get_sideband_matrix(f_grid, freqs_hamp).T
 
 
 def get_surface_temperature(dropsonde):
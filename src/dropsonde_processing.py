@@ -1,9 +1,249 @@
 import numpy as np
+import xarray as xr
+
+MIN_RH_LOW = 0.92
+MAX_RH_LOW = 0.95
+MAX_RH_MIDDLE = 0.93
+MIN_MOISTLAYER_THICKNESS = 400
+MIN_MOISTLAYER_BASE = 120
+MIN_CLOUDLAYER_BASE = 280
+MIN_CLOUD_THICKNESS_LOW = 30
+MIN_CLOUD_THICKNESS_MIDDLE = 60
+MIDDLE_CLOUD_BASE = 1300
+
+
+def _get_moist_layer(rh, alt):
+    """
+    base, top and number of cloudy levels of the moist layer along the last
+    axis of rh
+    """
+    moist = rh > MIN_RH_LOW
+    has_moist = moist.any(axis=-1)
+    idx_base = np.argmax(moist, axis=-1)
+    idx_top = rh.shape[-1] - 1 - np.argmax(moist[..., ::-1], axis=-1)
+    base = np.where(has_moist, alt[idx_base], np.nan)
+    top = np.where(has_moist, alt[idx_top], np.nan)
+    return (
+        base,
+        top,
+        (rh > MAX_RH_LOW).sum(axis=-1),
+        (rh > MAX_RH_MIDDLE).sum(axis=-1),
+    )
+
+
+def get_moist_layers_dropsondes(ds, rh_name="rh"):
+    """
+    derives the moist layer (relative humidity above MIN_RH_LOW) of all
+    dropsondes at once with array reductions over the (sonde, alt) matrix.
+    For dask-backed datasets the reductions are computed chunk by chunk in
+    parallel.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset containing the dropsonde data with dimension "alt"
+    rh_name : str, optional
+        Name of the relative humidity variable in the dataset, by default "rh"
+
+    Returns
+    -------
+    xarray.Dataset
+        base, top and thickness of moist layer (nan without moist layer) and
+        number of levels above the cloud thresholds for low and middle clouds
+    """
+    base, top, cloudy_levels_low, cloudy_levels_middle = xr.apply_ufunc(
+        _get_moist_layer,
+        ds[rh_name],
+        kwargs={"alt": ds["alt"].values},
+        input_core_dims=[["alt"]],
+        output_core_dims=[[], [], [], []],
+        output_dtypes=[float, float, int, int],
+        dask="parallelized",
+        dask_gufunc_kwargs={"allow_rechunk": True},
+    )
+    return xr.Dataset(
+        {
+            "moist_layer_base": base,
+            "moist_layer_top": top,
+            "moist_layer_thickness": top - base,
+            "cloudy_levels_low": cloudy_levels_low,
+            "cloudy_levels_middle": cloudy_levels_middle,
+        }
+    )
+
+
+def get_moist_layer_catalog(ds, coord="sonde_id", rh_name="rh"):
+    """
+    finds every contiguous moist layer (relative humidity above MIN_RH_LOW)
+    of all dropsondes by run-length encoding of the (sonde, alt) matrix and
+    classifies it as moist or cloudy layer.
+
+    A layer is cloudy if it has more levels above the cloud threshold than
+    the minimum cloud thickness allows, its base is above MIN_MOISTLAYER_BASE
+    and its top above MIN_CLOUDLAYER_BASE. Thresholds for low clouds apply to
+    layers with bases below MIDDLE_CLOUD_BASE, those for middle clouds to all
+    others.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset containing the dropsonde data with dimensions (coord, "alt")
+    coord : str, optional
+        Coordinate name for the dropsonde index, by default "sonde_id"
+    rh_name : str, optional
+        Name of the relative humidity variable in the dataset, by default "rh"
+
+    Returns
+    -------
+    xarray.Dataset
+        one entry per layer along dimension "layer" with its dropsonde (and
+        all other coordinates along coord), base, top, thickness, number of
+        levels, max RH, number of cloudy levels and layer class (0: moist,
+        1: low cloud, 2: middle cloud)
+    """
+    rh = ds[rh_name].transpose(coord, "alt").values
+    alt = ds["alt"].values
+    n_sondes, n_alt = rh.shape
+
+    # run-length encoding of moist levels, padded to close layers at the edges
+    moist = np.zeros((n_sondes, n_alt + 2), dtype=np.int8)
+    moist[:, 1:-1] = rh > MIN_RH_LOW
+    edges = np.diff(moist, axis=1)
+    sonde_idx, idx_start = np.nonzero(edges == 1)
+    _, idx_end = np.nonzero(edges == -1)
+
+    base = alt[idx_start]
+    top = alt[idx_end - 1]
+    flat_start = sonde_idx * n_alt + idx_start
+    flat_end = sonde_idx * n_alt + idx_end
+
+    # max RH and number of cloudy levels per layer from flattened matrix
+    rh_flat = np.append(np.where(np.isnan(rh), -np.inf, rh).ravel(), -np.inf)
+    max_rh = np.maximum.reduceat(
+        rh_flat, np.column_stack([flat_start, flat_end]).ravel()
+    )[::2]
+
+    def count_levels_above(threshold):
+        cumsum = np.concatenate([[0], np.cumsum(rh_flat > threshold)])
+        return cumsum[flat_end] - cumsum[flat_start]
+
+    is_low = base < MIDDLE_CLOUD_BASE
+    cloudy_levels = np.where(
+        is_low, count_levels_above(MAX_RH_LOW), count_levels_above(MAX_RH_MIDDLE)
+    )
+
+    min_cloudy_levels = (
+        np.where(is_low, MIN_CLOUD_THICKNESS_LOW, MIN_CLOUD_THICKNESS_MIDDLE) / 10
+    )
+    is_cloud = (
+        (cloudy_levels > min_cloudy_levels)
+        & (base > MIN_MOISTLAYER_BASE)
+        & (top > MIN_CLOUDLAYER_BASE)
+    )
+    layer_class = np.where(is_cloud, np.where(is_low, 1, 2), 0).astype(np.int8)
+
+    coords = {
+        name: ("layer", ds[name].values[sonde_idx])
+        for name, var in ds.coords.items()
+        if var.dims == (coord,)
+    }
+    return xr.Dataset(
+        {
+            "base": ("layer", base),
+            "top": ("layer", top),
+            "thickness": ("layer", top - base),
+            "n_levels": ("layer", idx_end - idx_start),
+            "max_rh": ("layer", max_rh),
+            "cloudy_levels": ("layer", cloudy_levels),
+            "layer_class": (
+                "layer",
+                layer_class,
+                {
+                    "flag_meanings": ["moist", "low_cloud", "middle_cloud"],
+                    "flag_values": [0, 1, 2],
+                },
+            ),
+        },
+        coords=coords,
+    )
 
 
 def get_all_clouds_flags_dropsondes(ds, coord="sonde_id", rh_name="rh"):
     """
     Function to derive cloud flags for dropsondes based on relative humidity.
+    Developed by Nina Robbins. Vectorised over all dropsondes, see
+    'get_moist_layers_dropsondes'.
+
+    As in the original loop over the dropsondes, a moist layer with its base
+    at exactly MIDDLE_CLOUD_BASE keeps the thresholds of the previous
+    dropsonde with a moist layer that was checked for clouds.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset containing the dropsonde data
+    coord : str, optional
+        Coordinate name for the dropsonde index, by default "sonde_id"
+    rh_name : str, optional
+        Name of the relative humidity variable in the dataset, by default "rh"
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with cloud flags added as a new variable "cloud_flag"
+    """
+    layers = get_moist_layers_dropsondes(ds, rh_name=rh_name)
+    layers = layers.transpose(coord).compute()
+    base = layers["moist_layer_base"].values
+    top = layers["moist_layer_top"].values
+
+    checked = (layers["moist_layer_thickness"].values > MIN_MOISTLAYER_THICKNESS) & (
+        base > MIN_MOISTLAYER_BASE
+    )
+
+    # low (1) or middle (2) cloud thresholds, forward filled over checked sondes
+    regime = np.select(
+        [base < MIDDLE_CLOUD_BASE, base > MIDDLE_CLOUD_BASE], [1, 2], np.nan
+    )[checked]
+    idx_regime = np.maximum.accumulate(
+        np.where(np.isnan(regime), -1, np.arange(regime.size))
+    )
+    if (idx_regime < 0).any():
+        raise ValueError(
+            f"moist layer base at {MIDDLE_CLOUD_BASE} m without previous moist "
+            "layer to take cloud thresholds from"
+        )
+    flag = np.zeros(base.size)
+    flag[checked] = regime[idx_regime]
+
+    cloudy_levels = np.where(
+        flag == 1,
+        layers["cloudy_levels_low"].values,
+        layers["cloudy_levels_middle"].values,
+    )
+    min_cloudy_levels = (
+        np.where(flag == 1, MIN_CLOUD_THICKNESS_LOW, MIN_CLOUD_THICKNESS_MIDDLE) / 10
+    )
+    cloud_flag_vec = np.where(
+        checked & (cloudy_levels > min_cloudy_levels) & (top > MIN_CLOUDLAYER_BASE),
+        flag,
+        0.0,
+    )
+
+    # Add cloud flags to dataset
+    ds["cloud_flag"] = ((coord), cloud_flag_vec)
+    ds["cloud_flag"] = ds.cloud_flag.assign_attrs(
+        standard_name="cloud_flag",
+        flag_meanings=["no_cloud", "low_cloud", "high_cloud"],
+        flag_values=[0, 1, 2],
+    )
+    return ds
+
+
+def get_all_clouds_flags_dropsondes_loop(ds, coord="sonde_id", rh_name="rh"):
+    """
+    Reference implementation of 'get_all_clouds_flags_dropsondes' looping over
+    the dropsondes, kept to validate the vectorised version.
     Developed by Nina Robbins
 
     Parameters
@@ -1,4 +1,5 @@
 import numpy as np
+import xarray as xr
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from matplotlib.cm import ScalarMappable
@@ -18,6 +19,68 @@ def get_dropsondes_within_heights(ds, height_min, height_max):
     return ht_min, ht_max, ds_heightslice
 
 
+def get_layer_mean_winds(ds, heights, variables=("u", "v", "lat", "lon")):
+    """
+    Aggregate variables of dropsondes within height layers in one reduction.
+
+    Consecutive heights define the layers ht_min <= alt < ht_max, with the
+    heights snapped to the nearest alt as in get_dropsondes_within_heights.
+    Each alt level is assigned to its layer once and the sums over alt of all
+    layers are calculated together, which also works for dask arrays. The
+    standard deviation is calculated from the deviations of the layer means
+    in a second reduction.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dropsonde dataset with dimensions (sonde_id, alt).
+    heights : array-like
+        Increasing heights of the layer boundaries in the units of alt.
+    variables : sequence of str, optional
+        Variables to aggregate.
+
+    Returns
+    -------
+    xarray.Dataset
+        Mean, standard deviation and number of valid levels of each variable
+        (named e.g. "u_mean", "u_std", "u_count") with dimensions
+        (sonde_id, layer) and coordinates layer_min and layer_max.
+    """
+    edges = ds.alt.sel(alt=np.asarray(heights), method="nearest").values
+    layer = np.searchsorted(edges, ds.alt.values, side="right") - 1
+    membership = xr.DataArray(
+        (layer[:, np.newaxis] == np.arange(len(edges) - 1)).astype(float),
+        dims=("alt", "layer"),
+        coords={"alt": ds.alt},
+    )
+
+    ds_layers = xr.Dataset(
+        coords={
+            "layer": np.arange(len(edges) - 1),
+            "layer_min": ("layer", edges[:-1]),
+            "layer_max": ("layer", edges[1:]),
+        }
+    )
+    for var in variables:
+        values = ds[var].astype(np.float64)
+        count = xr.dot(
+            values.notnull().astype(float), membership, dim="alt", optimize=True
+        )
+        mean = xr.dot(values.fillna(0), membership, dim="alt", optimize=True) / count
+        # std from deviations of the mean of their layer (second pass), which
+        # does not suffer from cancellation like E[x^2] - E[x]^2
+        mean_at_alt = xr.dot(mean.fillna(0), membership, dim="layer", optimize=True)
+        deviation = (values - mean_at_alt).fillna(0)
+        variance = (
+            xr.dot(deviation * deviation, membership, dim="alt", optimize=True) / count
+        )
+        ds_layers[f"{var}_mean"] = mean
+        ds_layers[f"{var}_std"] = np.sqrt(variance)
+        ds_layers[f"{var}_count"] = count.astype(int)
+
+    return ds_layers.drop_vars("alt", errors="ignore")
+
+
 def horizontal_wind_speed(northward, eastward):
     return np.sqrt(eastward * eastward + northward * northward)
 
@@ -39,14 +102,148 @@ def horizontal_wind_direction(northward, eastward, bearing=False):
     return direction
 
 
+def get_wind_statistics_cube(ds, lat_bins, alt_bins, flight):
+    """
+    Bin winds of the dropsondes of one flight by latitude and height.
+
+    All levels of all dropsondes with valid u, v and lat are assigned to their
+    (latitude, height) bin once, and the sums of all statistics are then
+    accumulated in one pass over the points. Bins include their lower edge.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dropsonde dataset of one flight with u, v and lat on (sonde_id, alt).
+    lat_bins : array-like
+        Edges of latitude bins in degrees.
+    alt_bins : array-like
+        Edges of height bins in the units of alt.
+    flight : str
+        Name of the flight, e.g. its date.
+
+    Returns
+    -------
+    xarray.Dataset
+        Number of points (count), mean and variance of u, v and horizontal
+        wind speed, and circular mean and circular variance of the direction
+        relative to westerlies (see horizontal_wind_direction) with
+        dimensions (flight, lat_bin, alt_bin). Bins without points are nan.
+    """
+    lat_bins, alt_bins = np.asarray(lat_bins), np.asarray(alt_bins)
+    lat, alt, eastward, northward = (
+        da.values.ravel() for da in xr.broadcast(ds.lat, ds.alt, ds.u, ds.v)
+    )
+    ilat = np.searchsorted(lat_bins, lat, side="right") - 1
+    ialt = np.searchsorted(alt_bins, alt, side="right") - 1
+    valid = (
+        np.isfinite(eastward)
+        & np.isfinite(northward)
+        & (ilat >= 0)
+        & (ilat < lat_bins.size - 1)
+        & (ialt >= 0)
+        & (ialt < alt_bins.size - 1)
+    )
+    shape = (lat_bins.size - 1, alt_bins.size - 1)
+    index = np.ravel_multi_index((ilat[valid], ialt[valid]), shape)
+    eastward, northward = eastward[valid], northward[valid]
+    speed = horizontal_wind_speed(northward, eastward)
+    direction = np.deg2rad(horizontal_wind_direction(northward, eastward))
+
+    def binned_sum(weights=None):
+        return np.bincount(index, weights=weights, minlength=np.prod(shape)).reshape(
+            shape
+        )
+
+    count = binned_sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats = {"count": count}
+        for var, values in [("u", eastward), ("v", northward), ("speed", speed)]:
+            mean = binned_sum(values) / count
+            stats[f"{var}_mean"] = mean
+            stats[f"{var}_var"] = np.maximum(binned_sum(values**2) / count - mean**2, 0)
+        mean_cos = binned_sum(np.cos(direction)) / count
+        mean_sin = binned_sum(np.sin(direction)) / count
+    stats["direction_mean"] = np.rad2deg(np.arctan2(mean_sin, mean_cos))
+    stats["direction_var"] = 1 - np.sqrt(mean_cos**2 + mean_sin**2)
+
+    ds_stats = xr.Dataset(
+        {
+            name: (("flight", "lat_bin", "alt_bin"), values[np.newaxis])
+            for name, values in stats.items()
+        },
+        coords={
+            "flight": [str(flight)],
+            "lat_bin": 0.5 * (lat_bins[:-1] + lat_bins[1:]),
+            "lat_min": ("lat_bin", lat_bins[:-1]),
+            "lat_max": ("lat_bin", lat_bins[1:]),
+            "alt_bin": 0.5 * (alt_bins[:-1] + alt_bins[1:]),
+            "alt_min": ("alt_bin", alt_bins[:-1]),
+            "alt_max": ("alt_bin", alt_bins[1:]),
+        },
+    )
+    ds_stats["count"] = ds_stats["count"].astype(int)
+    ds_stats["direction_mean"].attrs["units"] = "degrees"
+    ds_stats["direction_var"].attrs["long_name"] = "circular variance"
+    return ds_stats
+
+
+def get_pixel_mean(x, y, values, xlims, ylims, nx, ny):
+    """returns mean of values of all points (x, y) within each pixel of a
+    (ny, nx) grid spanning xlims and ylims, nan for pixels without points"""
+    x, y, values = np.ravel(x), np.ravel(y), np.ravel(values)
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(values)
+    x, y, values = x[valid], y[valid], values[valid]
+
+    xspan, yspan = (xlims[1] - xlims[0]) or 1, (ylims[1] - ylims[0]) or 1
+    ix = np.clip(np.floor((x - xlims[0]) / xspan * nx).astype(int), 0, nx - 1)
+    iy = np.clip(np.floor((y - ylims[0]) / yspan * ny).astype(int), 0, ny - 1)
+    index = iy * nx + ix
+
+    count = np.bincount(index, minlength=nx * ny)
+    total = np.bincount(index, weights=values, minlength=nx * ny)
+    with np.errstate(invalid="ignore"):
+        return (total / count).reshape(ny, nx)
+
+
 def plot_coloured_dropsonde_vertical_profile(
-    ax, verticaldata, height, vmin, vmax, colorby, cmap, axtitle=None, xlabel=None
+    ax,
+    verticaldata,
+    height,
+    vmin,
+    vmax,
+    colorby,
+    cmap,
+    axtitle=None,
+    xlabel=None,
+    render="scatter",
 ):
+    """plots verticaldata against height coloured by colorby. If render is
+    "raster", points are binned into the pixels of ax instead of drawn as
+    markers and each pixel is coloured by the mean of colorby of its points."""
     norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
     cmap = plt.get_cmap(cmap)
-    color = cmap(norm(colorby))
 
-    ax.scatter(verticaldata, height, marker=".", s=1, color=color)
+    if render == "scatter":
+        color = cmap(norm(colorby))
+        ax.scatter(verticaldata, height, marker=".", s=1, color=color)
+    elif render == "raster":
+        verticaldata, height = np.ravel(verticaldata), np.ravel(height)
+        xlims = np.nanmin(verticaldata), np.nanmax(verticaldata)
+        ylims = np.nanmin(height), np.nanmax(height)
+        bbox = ax.get_window_extent()
+        nx, ny = max(int(bbox.width), 1), max(int(bbox.height), 1)
+        pixel_mean = get_pixel_mean(verticaldata, height, colorby, xlims, ylims, nx, ny)
+        ax.imshow(
+            pixel_mean,
+            origin="lower",
+            extent=[*xlims, *ylims],
+            aspect="auto",
+            interpolation="nearest",
+            cmap=cmap,
+            norm=norm,
+        )
+    else:
+        raise ValueError(f"unknown render {render}, use 'scatter' or 'raster'")
 
     ax.set_title(axtitle)
     ax.set_ylabel("height / km")
@@ -56,7 +253,12 @@ def plot_coloured_dropsonde_vertical_profile(
 
 
 def plot_dropsonde_wind_vertical_profiles(
-    ds_dropsonde, colorby, figsize=(16, 9), cmap="Blues", cbarlab=None
+    ds_dropsonde,
+    colorby,
+    figsize=(16, 9),
+    cmap="Blues",
+    cbarlab=None,
+    render="scatter",
 ):
     fig, axes = plt.subplots(
         nrows=1, ncols=5, figsize=figsize, width_ratios=[1, 1, 1, 1, 1 / 27]
@@ -75,6 +277,7 @@ def plot_dropsonde_wind_vertical_profiles(
         vmax,
         colorby,
         cmap,
+        render=render,
         axtitle="Eastward",
         xlabel="u /m s$^{-1}$",
     )
@@ -88,6 +291,7 @@ def plot_dropsonde_wind_vertical_profiles(
         vmax,
         colorby,
         cmap,
+        render=render,
         axtitle="Northward",
         xlabel="v /m s$^{-1}$",
     )
@@ -101,6 +305,7 @@ def plot_dropsonde_wind_vertical_profiles(
         vmax,
         colorby,
         cmap,
+        render=render,
         axtitle="Direction from Westerlies",
         xlabel="$\u03c6$ /degrees",
     )
@@ -114,6 +319,7 @@ def plot_dropsonde_wind_vertical_profiles(
         vmax,
         colorby,
         cmap,
+        render=render,
         axtitle="Horizontal Wind Speed",
         xlabel="|V$_{xy}$| /m s$^{-1}$",
     )
@@ -171,26 +377,24 @@ def plot_wind_quiver_on_projection(
     return ax
 
 
-def plot_mean_wind_quiver_on_projection(
+def plot_layer_mean_wind_quiver_on_projection(
     ax,
-    ds_dropsonde,
-    height_min,
-    height_max,
+    ds_layers,
+    layer,
     lonmin=-35,
     lonmax=-15,
     latmin=0,
     latmax=20,
 ):
-    """plot wind quivers on projection but for mean wind between height_min and height_max"""
-    ht_min, ht_max, ds2mean = get_dropsondes_within_heights(
-        ds_dropsonde, height_min, height_max
-    )
-    mean_lon = ds2mean.lon.mean(dim="alt")
-    mean_lat = ds2mean.lat.mean(dim="alt")
-    mean_eastward = ds2mean.u.mean(dim="alt")
-    mean_northward = ds2mean.v.mean(dim="alt")
-
-    axtitle = f"{ht_min/1000}km <= GPS Altitude < {ht_max/1000}km"
+    """plot wind quivers on projection for one layer of get_layer_mean_winds"""
+    ds_layer = ds_layers.isel(layer=layer)
+    ht_min, ht_max = ds_layer.layer_min.values, ds_layer.layer_max.values
+    mean_lon = ds_layer.lon_mean
+    mean_lat = ds_layer.lat_mean
+    mean_eastward = ds_layer.u_mean
+    mean_northward = ds_layer.v_mean
+
+    axtitle = f"{ht_min / 1000}km <= GPS Altitude < {ht_max / 1000}km"
     plot_wind_quiver_on_projection(
         ax,
         mean_lon,
@@ -205,3 +409,26 @@ def plot_mean_wind_quiver_on_projection(
     )
 
     return ax, mean_lon, mean_lat, mean_eastward, mean_northward
+
+
+def plot_mean_wind_quiver_on_projection(
+    ax,
+    ds_dropsonde,
+    height_min,
+    height_max,
+    lonmin=-35,
+    lonmax=-15,
+    latmin=0,
+    latmax=20,
+):
+    """plot wind quivers on projection but for mean wind between height_min and height_max"""
+    ds_layers = get_layer_mean_winds(ds_dropsonde, [height_min, height_max])
+    return plot_layer_mean_wind_quiver_on_projection(
+        ax,
+        ds_layers,
+        0,
+        lonmin=lonmin,
+        lonmax=lonmax,
+        latmin=latmin,
+        latmax=latmax,
+    )
@@ -1,45 +1,148 @@
+import os
+import numpy as np
 import pandas as pd
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from orcestra import sat
 import pyproj
 import warnings
 
+EC_TRACK_CACHE_DIR = "Data/earthcare/tracks"
+EC_UNDERPASS_CATALOG = "Data/earthcare/underpasses.csv"
+EC_UNDERPASS_MAX_DISTANCE = 5e4  # [m]
+# upper limit of ground speed of EarthCARE (~7km/s) plus HALO (~0.25km/s)
+EC_HALO_MAX_RELATIVE_SPEED = 8e3  # [m/s]
+UNDERPASS_CATALOG_COLUMNS = ["date", "flightletter", "segment", "time", "distance"]
 
-def get_earthcare_track(date):
-    day = pd.Timestamp(date)
+
+def get_earthcare_roi(day):
+    """returns region of interest of EarthCARE track forecasts on 'day'"""
     if day < pd.Timestamp("2024-09-06"):
-        roi = "CAPE_VERDE"
+        return "CAPE_VERDE"
     elif day < pd.Timestamp("2024-11-04"):
-        roi = "BARBADOS"
+        return "BARBADOS"
     else:
-        roi = "EUR"
-    try:
-        track = sat.SattrackLoader(
-            "EARTHCARE",
-            day.strftime(format="%Y-%m-%d"),
-            kind="PRE",
-            roi=roi,
-        ).get_track_for_day(day.strftime(format="%Y-%m-%d"))
-    except Exception:
-        warnings.warn(f"No EarthCARE track found for {day}, falling back to day before")
-        track = sat.SattrackLoader(
-            "EARTHCARE",
-            (day - pd.Timedelta("1d")).strftime(format="%Y-%m-%d"),
-            kind="PRE",
-            roi=roi,
-        ).get_track_for_day((day).strftime(format="%Y-%m-%d"))
+        return "EUR"
+
+
+def get_track_cachename(cache_dir, satellite, issue_date, kind, roi, day):
+    """returns path of cached track for 'day' of the forecast issued on
+    'issue_date' for 'satellite', 'kind' and 'roi'"""
+    return Path(cache_dir) / satellite / kind / roi / issue_date / f"{day}.nc"
+
+
+def load_track(
+    satellite,
+    issue_date,
+    kind,
+    roi,
+    day,
+    cache_dir=EC_TRACK_CACHE_DIR,
+    offline=False,
+):
+    """
+    Returns track of 'satellite' for 'day' (both dates as str "YYYY-MM-DD") of
+    the forecast issued on 'issue_date'. The track is read from 'cache_dir' if
+    it has been loaded before, otherwise it is loaded with
+    orcestra.sat.SattrackLoader and written to 'cache_dir'. If 'offline' is
+    True, only the cache is read and a FileNotFoundError is raised for tracks
+    that are not cached. No cache is used if 'cache_dir' is None.
+    """
+    if cache_dir is None:
+        return sat.SattrackLoader(
+            satellite, issue_date, kind=kind, roi=roi
+        ).get_track_for_day(day)
+
+    cachename = get_track_cachename(cache_dir, satellite, issue_date, kind, roi, day)
+    if cachename.exists():
+        with xr.open_dataset(cachename) as track:
+            return track.load()
+    if offline:
+        raise FileNotFoundError(f"No cached track in {cachename}")
+
+    track = sat.SattrackLoader(
+        satellite, issue_date, kind=kind, roi=roi
+    ).get_track_for_day(day)
+    cachename.parent.mkdir(parents=True, exist_ok=True)
+    tmpname = cachename.with_suffix(f".{os.getpid()}.tmp")
+    track.to_netcdf(tmpname)
+    os.replace(tmpname, cachename)
+    return track
+
+
+def get_earthcare_track(date, cache_dir=EC_TRACK_CACHE_DIR, offline=False):
+    """
+    Returns EarthCARE track from 8 UTC on 'date' onwards from the forecast
+    issued on 'date' or, if there is none, on the day before. Cached tracks
+    of both forecasts are used before any track is loaded over the network,
+    see 'load_track'.
+    """
+    day = pd.Timestamp(date)
+    roi = get_earthcare_roi(day)
+    issue_dates = [
+        day.strftime(format="%Y-%m-%d"),
+        (day - pd.Timedelta("1d")).strftime(format="%Y-%m-%d"),
+    ]
+
+    attempts = []
+    if cache_dir is not None:
+        attempts += [(issue_date, True) for issue_date in issue_dates]
+    if not offline:
+        attempts += [(issue_date, False) for issue_date in issue_dates]
+
+    for issue_date, from_cache in attempts:
+        try:
+            track = load_track(
+                "EARTHCARE",
+                issue_date,
+                "PRE",
+                roi,
+                day.strftime(format="%Y-%m-%d"),
+                cache_dir=cache_dir,
+                offline=from_cache,
+            )
+            break
+        except Exception:
+            if not from_cache and issue_date == issue_dates[0]:
+                warnings.warn(
+                    f"No EarthCARE track found for {day}, falling back to day before"
+                )
+    else:
+        raise FileNotFoundError(f"No EarthCARE track found for {day}")
 
     track = track.sel(time=slice(day + pd.Timedelta("8h"), None))
     return track
 
 
-def find_ec_under_time(ec_track, ds):
+def prefetch_earthcare_tracks(dates, cache_dir=EC_TRACK_CACHE_DIR, max_workers=8):
     """
-    Returns time at closet overpass of HALO (from ds_bahamas) and EarthCARE track.
-    Assumes HALO ds_bahamas has higher rate of temporal data.
+    Loads the EarthCARE tracks of all 'dates' in parallel into 'cache_dir', so
+    that later runs can read them offline. Returns the dates for which no
+    track was found.
     """
-    geod = pyproj.Geod(ellps="WGS84")
 
-    ds = ds.sel(time=slice(ec_track.time.min(), ec_track.time.max()))
+    def prefetch(date):
+        try:
+            get_earthcare_track(date, cache_dir=cache_dir)
+            return None
+        except Exception as e:
+            warnings.warn(f"Prefetching EarthCARE track for {date} failed: {e}")
+            return date
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        failed = list(executor.map(prefetch, dates))
+
+    return [date for date in failed if date is not None]
+
+
+def get_ec_halo_distance(ec_track, ds):
+    """
+    Returns geodesic distance between HALO (from ds) and EarthCARE track
+    interpolated onto the times of ds. Missing HALO positions are set far
+    away from the track.
+    """
+    geod = pyproj.Geod(ellps="WGS84")
     ec_track = ec_track.interp(time=ds.time)
 
     lat_halo = ds["lat"].fillna(-90)
@@ -47,11 +150,177 @@ def find_ec_under_time(ec_track, ds):
     lat_ec = ec_track["lat"]
     lon_ec = ec_track["lon"]
 
-    dist = geod.inv(lon_ec, lat_ec, lon_halo, lat_halo)[2]
-    if dist.min() < 5e4:
-        return ds.time[dist.argmin()].values
+    return geod.inv(lon_ec, lat_ec, lon_halo, lat_halo)[2]
+
+
+def find_ec_under_time(ec_track, ds, coarse_step=60, return_distance=False):
+    """
+    Returns time at closet overpass of HALO (from ds_bahamas) and EarthCARE track.
+    Assumes HALO ds_bahamas has higher rate of temporal data.
+
+    The overpass is first searched on every coarse_step-th HALO time and then
+    refined at full temporal resolution between all neighbouring coarse times
+    where HALO may have been within EC_UNDERPASS_MAX_DISTANCE of the track.
+    Between coarse times the distance can decrease by at most
+    EC_HALO_MAX_RELATIVE_SPEED times half their time difference, so no
+    underpass is missed. coarse_step=1 searches all HALO times at once. If
+    return_distance is True, the minimum distance in metres is returned, too
+    (without underpass it can be the coarse minimum).
+    """
+    ds = ds.sel(time=slice(ec_track.time.min(), ec_track.time.max()))
+    if ds.time.size == 0:
+        return (None, np.nan) if return_distance else None
+
+    idx_coarse = np.unique(
+        np.append(np.arange(0, ds.time.size, coarse_step), ds.time.size - 1)
+    )
+    dist_coarse = get_ec_halo_distance(ec_track, ds.isel(time=idx_coarse))
+    dt_coarse = np.diff(ds.time.values[idx_coarse]) / np.timedelta64(1, "s")
+    max_coarse_error = EC_HALO_MAX_RELATIVE_SPEED * dt_coarse / 2
+    candidates = np.flatnonzero(
+        np.minimum(dist_coarse[:-1], dist_coarse[1:])
+        < EC_UNDERPASS_MAX_DISTANCE + max_coarse_error
+    )
+    idx_fine = np.unique(
+        np.concatenate(
+            [idx_coarse]
+            + [np.arange(idx_coarse[i], idx_coarse[i + 1] + 1) for i in candidates]
+        )
+    )
+    ds = ds.isel(time=idx_fine)
+    dist = get_ec_halo_distance(ec_track, ds)
+
+    ec_under_time = (
+        ds.time[dist.argmin()].values
+        if dist.min() < EC_UNDERPASS_MAX_DISTANCE
+        else None
+    )
+    if return_distance:
+        return ec_under_time, dist.min()
+    return ec_under_time
+
+
+def segment_track(ec_track, max_gap="20min"):
+    """
+    Splits EarthCARE track into segments at gaps in time longer than
+    'max_gap'. Returns list of all segments including the last one.
+    """
+    split_indices = (
+        np.flatnonzero(np.diff(ec_track.time.values) > pd.Timedelta(max_gap)) + 1
+    )
+    bounds = np.concatenate([[0], split_indices, [ec_track.time.size]])
+    return [
+        ec_track.isel(time=slice(start, end))
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def find_ec_underpasses(ec_track, ds, segmented=True, max_gap="20min"):
+    """
+    Returns underpasses of HALO (from ds) below EarthCARE track as DataFrame
+    with columns segment, time and distance (in metres). If segmented is True,
+    the underpass is searched in every segment of the track (see
+    'segment_track') that starts or ends during the flight, otherwise in the
+    whole track. Time is NaT if HALO was not within 50km of a segment.
+    """
+    if segmented:
+        starttime, endtime = ds.time[0].values, ds.time[-1].values
+        segments = [
+            (n, segment)
+            for n, segment in enumerate(segment_track(ec_track, max_gap=max_gap))
+            if (starttime < segment.time[0].values < endtime)
+            or (starttime < segment.time[-1].values < endtime)
+        ]
     else:
+        segments = [(0, ec_track)]
+
+    underpasses = []
+    for n, segment in segments:
+        ec_under_time, distance = find_ec_under_time(segment, ds, return_distance=True)
+        underpasses.append(
+            dict(segment=n, time=pd.Timestamp(ec_under_time), distance=distance)
+        )
+    return pd.DataFrame(underpasses, columns=["segment", "time", "distance"])
+
+
+def find_flight_underpasses(date, flightletter, ds):
+    """
+    Returns underpasses of HALO (from ds) on the flight on 'date' with
+    'flightletter' as rows of the underpass catalog. Tracks of flights after
+    2024-11-01 are segmented, see 'find_ec_underpasses'. Flights without any
+    track segment during the flight get one row with segment, time and
+    distance missing.
+    """
+    ec_track = get_earthcare_track(date)
+    segmented = pd.Timestamp(date) > pd.Timestamp("2024-11-01")
+    df_underpasses = find_ec_underpasses(ec_track, ds, segmented)
+    if df_underpasses.empty:
+        df_underpasses = pd.DataFrame(
+            dict(segment=[pd.NA], time=[pd.NaT], distance=[np.nan])
+        )
+    df_underpasses.insert(0, "date", date)
+    df_underpasses.insert(1, "flightletter", flightletter)
+    return df_underpasses
+
+
+def read_underpass_catalog(path=EC_UNDERPASS_CATALOG):
+    """returns underpass catalog at 'path', empty if there is none"""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=UNDERPASS_CATALOG_COLUMNS)
+    return pd.read_csv(
+        path,
+        parse_dates=["time"],
+        dtype={"date": str, "flightletter": str, "segment": "Int64"},
+    )
+
+
+def build_underpass_catalog(
+    flights, load_positions, path=EC_UNDERPASS_CATALOG, max_workers=8
+):
+    """
+    Returns underpasses (date, flightletter, segment, time, distance) of all
+    'flights', a list of (date, flightletter). Flights missing in the catalog
+    at 'path' are computed in parallel and added to it, 'load_positions'
+    returns the dataset with HALO lat and lon of a flight given its date and
+    flightletter. Flights without underpass have time NaT.
+    """
+    df_catalog = read_underpass_catalog(path)
+    cataloged = set(zip(df_catalog["date"], df_catalog["flightletter"]))
+    missing = [flight for flight in flights if tuple(flight) not in cataloged]
+
+    def find_underpasses(flight):
+        date, flightletter = flight
+        return find_flight_underpasses(
+            date, flightletter, load_positions(date, flightletter)
+        )
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            df_new = list(executor.map(find_underpasses, missing))
+        if not df_catalog.empty:
+            df_new = [df_catalog, *df_new]
+        df_catalog = pd.concat(df_new, ignore_index=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df_catalog.to_csv(path, index=False)
+        df_catalog = read_underpass_catalog(path)
+
+    df_flights = pd.DataFrame(list(flights), columns=["date", "flightletter"])
+    return df_catalog.merge(df_flights, on=["date", "flightletter"])
+
+
+def get_ec_under_time(date, flightletter, load_positions, path=EC_UNDERPASS_CATALOG):
+    """
+    Returns time of closest underpass of the flight on 'date' with
+    'flightletter' from the underpass catalog at 'path' (computed and added to
+    it if missing, see 'build_underpass_catalog'), None if HALO was not within
+    50km of the EarthCARE track.
+    """
+    df_underpasses = build_underpass_catalog(
+        [(date, flightletter)], load_positions, path=path
+    ).dropna(subset=["time"])
+    if df_underpasses.empty:
         return None
+    return df_underpasses.loc[df_underpasses["distance"].idxmin(), "time"]
 
 
 def add_earthcare_underpass(ax, ec_under_time, annotate=False):
@@ -1,8 +1,12 @@
+import weakref
+import numpy as np
 import pandas as pd
 import xarray as xr
 from pathlib import Path
 from .post_processed_hamp_data import PostProcessedHAMPData
 
+_dropsonde_index_cache = {}
+
 
 def load_hamp_data(path_radar, path_radiometer, path_iwv):
     hampdata = PostProcessedHAMPData(
@@ -19,23 +23,92 @@ def load_dropsonde_data(path_dropsonde):
     return ds_dropsonde
 
 
-def load_dropsonde_data_for_date(dropsondes, date):
+def get_dropsonde_index(ds, time_name="launch_time_(UTC)", path=None):
+    """returns launch times of dropsondes in 'ds' sorted in time and the 'sonde_id'
+    positions which sort them. The index is built once and cached per dataset or,
+    if 'ds' was opened from 'path', per store path and launch times, so that it is
+    reused for datasets opened from the same store again."""
+    if path is None:
+        key = (id(ds), time_name)
+        if key in _dropsonde_index_cache:
+            ds_ref, index = _dropsonde_index_cache[key]
+            if ds_ref() is ds:
+                return index
+    else:
+        launch_time_raw = np.asarray(ds[time_name].values)
+        key = (str(path), time_name)
+        if key in _dropsonde_index_cache:
+            cached_launch_time, index = _dropsonde_index_cache[key]
+            if np.array_equal(cached_launch_time, launch_time_raw):
+                return index
+
+    if path is None:
+        launch_time_raw = ds[time_name].values
+    launch_time = pd.to_datetime(launch_time_raw).values.astype("datetime64[ns]")
+    order = np.argsort(launch_time, kind="stable")
+    index = (launch_time[order], order)
+    for stale in [
+        k
+        for k, v in _dropsonde_index_cache.items()
+        if isinstance(v[0], weakref.ref) and v[0]() is None
+    ]:
+        del _dropsonde_index_cache[stale]
+    if path is None:
+        _dropsonde_index_cache[key] = (weakref.ref(ds), index)
+    else:
+        _dropsonde_index_cache[key] = (launch_time_raw, index)
+
+    return index
+
+
+def select_dropsondes_in_timeframe(
+    ds, starttime, endtime, time_name="launch_time_(UTC)", path=None
+):
+    """returns dropsondes from 'ds' with starttime <= launch time < endtime
+    using binary search over the (cached) sorted launch times. 'path' is the
+    store 'ds' was opened from, if any (see 'get_dropsonde_index')."""
+    launch_time, order = get_dropsonde_index(ds, time_name=time_name, path=path)
+    idx_start, idx_end = np.searchsorted(
+        launch_time,
+        np.array([starttime, endtime], dtype="datetime64[ns]"),
+        side="left",
+    )
+    return ds.isel(sonde_id=np.sort(order[idx_start:idx_end]))
+
+
+def load_dropsonde_data_for_date(
+    dropsondes, date, time_name="launch_time_(UTC)", path_partitioned=None
+):
     """extract dropsondes from a particular fligth date. "dropsondes" is assumed to be
-    complete (Level 3) dataset of all dropsondes, or a path to load a dropsonde dataset
+    complete (Level 3) dataset of all dropsondes, or a path to load a dropsonde dataset.
+    If the path is a store written by 'write_dropsonde_flight_partitions', only the
+    group of the flight date is read. If "path_partitioned" is the path of such a
+    store (e.g. config parameter "path_dropsondes_partitioned") and it exists, it is
+    read instead of "dropsondes".
     """
 
     date_start = pd.to_datetime(date)
     date_end = pd.to_datetime(date) + pd.Timedelta("24h")
 
-    if isinstance(dropsondes, Path):
+    if path_partitioned is not None and Path(path_partitioned).exists():
+        dropsondes = path_partitioned
+
+    path = None
+    if isinstance(dropsondes, (str, Path)):
+        path = dropsondes
         ds = load_dropsonde_data(dropsondes)
+        if ds.attrs.get("partitioned_by") == "flight_date":
+            group = date_start.strftime("%Y%m%d")
+            if group not in ds.attrs["flight_dates"]:
+                raise KeyError(f"no dropsondes for {group} in {dropsondes}")
+            print(f"Reading dropsondes of {group} from per-flight partition")
+            return xr.open_dataset(dropsondes, engine="zarr", group=group)
     else:
         ds = dropsondes
 
     print(
         f"Extracting dropsondes with launchtime between {date_start} and {date_end} from dataset"
     )
-    ds = ds.where(
-        ds["launch_time_(UTC)"].astype("datetime64") >= date_start, drop=True
-    ).where(ds["launch_time_(UTC)"].astype("datetime64") < date_end, drop=True)
-    return ds
+    return select_dropsondes_in_timeframe(
+        ds, date_start, date_end, time_name=time_name, path=path
+    )
@@ -378,3 +378,11 @@ def plot_arts_flux(TB_hamp, TB_arts, dropsonde_id, time, ds_bahamas):
     fig.tight_layout()
 
     return fig, axes
+
+
+def save_arts_flux_plot(filename, TB_hamp, TB_arts, dropsonde_id, time, ds_bahamas):
+    """Plot ARTS against HAMP TBs of one dropsonde to file and close the figure."""
+    fig, _ = plot_arts_flux(TB_hamp, TB_arts, dropsonde_id, time, ds_bahamas)
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
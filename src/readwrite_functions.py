@@ -1,41 +1,98 @@
+import os
+import numpy as np
 import xarray as xr
 import pandas as pd
 import yaml
+import zarr
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from .post_processed_hamp_data import PostProcessedHAMPData
+from . import load_data_functions as loadfuncs
 
+HAMPDATA_STORE_GROUPS = ["radar", "radiometers", "column_water_vapour"]
 
-def extract_config_params(config_file):
-    """Load configuration from YAML file,
-    return dict with correctly formated configuration parameters"""
 
-    config = {}
+def read_config_yaml(config_file):
+    """Load configuration from YAML file, return dict of unformatted parameters"""
     with open(config_file, "r") as file:
         print(f"Reading config YAML: '{config_file}'")
         config_yaml = yaml.safe_load(file)
+    return config_yaml
+
+
+def format_config_params(config_yaml, date, flightletter):
+    """return dict with correctly formated configuration parameters for the flight
+    on 'date' with 'flightletter' from (unformatted) configuration parameters"""
 
+    config = {}
     config["path_radar"] = config_yaml["radar"].format(
-        date=config_yaml["date"], flightletter=config_yaml["flightletter"]
+        date=date, flightletter=flightletter
     )
     config["path_radiometers"] = config_yaml["radiometer"].format(
-        date=config_yaml["date"], flightletter=config_yaml["flightletter"]
-    )
-    config["path_iwv"] = config_yaml["iwv"].format(
-        date=config_yaml["date"], flightletter=config_yaml["flightletter"]
+        date=date, flightletter=flightletter
     )
+    config["path_iwv"] = config_yaml["iwv"].format(date=date, flightletter=flightletter)
     config["path_saveplots"] = config_yaml["path_saveplots"].format(
-        date=config_yaml["date"], flightletter=config_yaml["flightletter"]
+        date=date, flightletter=flightletter
     )
     config["flightname"] = config_yaml["flightname"].format(
-        date=config_yaml["date"], flightletter=config_yaml["flightletter"]
+        date=date, flightletter=flightletter
     )
-    config["date"] = config_yaml["date"]
+    config["date"] = date
+    config["flightletter"] = flightletter
     config["path_dropsondes"] = config_yaml["path_dropsondes"]
+    config["path_dropsondes_partitioned"] = config_yaml.get(
+        "path_dropsondes_partitioned"
+    )
 
     return config
 
 
+def extract_config_params(config_file):
+    """Load configuration from YAML file,
+    return dict with correctly formated configuration parameters"""
+
+    config_yaml = read_config_yaml(config_file)
+    return format_config_params(
+        config_yaml, config_yaml["date"], config_yaml["flightletter"]
+    )
+
+
+class FlightConfig:
+    """In-memory configuration of a single flight.
+
+    Paths are resolved from the (unformatted) parameters of a config template
+    and the flight's date and flightletter, so neither the template nor any
+    file on disk is changed. Configurations of different flights can therefore
+    be used at the same time, e.g. when processing flights in parallel.
+
+    Parameters
+    ----------
+    config_yaml : dict
+        unformatted configuration parameters, e.g. from 'read_config_yaml'
+    date : str
+        date of flight, YYYYMMDD
+    flightletter : str, optional
+        letter of flight on date, by default "a"
+    """
+
+    def __init__(self, config_yaml, date, flightletter="a"):
+        self.date = date
+        self.flightletter = flightletter
+        self.params = format_config_params(config_yaml, date, flightletter)
+
+    @classmethod
+    def from_file(cls, config_file, date, flightletter="a"):
+        return cls(read_config_yaml(config_file), date, flightletter=flightletter)
+
+    def __getitem__(self, key: str):
+        return self.params[key]
+
+    def __repr__(self):
+        return f"FlightConfig({self.params['flightname']})"
+
+
 def formatted_data_path(config_yaml, pathname):
     """return formatted data path from reading a string which follows the
     HALO naming convention where flight date and flight letter are replaced with the
@@ -62,6 +119,7 @@ def get_config_params(config, config_yaml):
     dt, flght = config_yaml["date"], config_yaml["flightletter"]
     config["flightname"] = f"HALO-{dt}{flght}"
     config["date"] = config_yaml["date"]  # YYYYMMDD
+    config["flightletter"] = config_yaml["flightletter"]
     config["radiometer_date"] = config["date"][2:]  # YYMMDD
     config["is_planet"] = config_yaml["is_planet"]
 
@@ -78,7 +136,7 @@ def get_config_params(config, config_yaml):
     return config
 
 
-def read_planet(path):
+def read_planet_csv(path):
     """Read planet data from csv file.
 
     Parameters:
@@ -100,6 +158,106 @@ def read_planet(path):
     return ds
 
 
+PLANET_CACHE_VERSION = 2  # increase when format of cache changes
+
+
+def get_planet_cachename(path):
+    """returns path of zarr cache for planet csv file at 'path'"""
+    return Path(path).with_suffix(".cache.zarr")
+
+
+def is_valid_planet_cache(path, cachename):
+    """returns True if zarr cache at 'cachename' was written in the current
+    format from the current version (size and modification time) of the
+    planet csv file at 'path'"""
+    if not Path(cachename).exists():
+        return False
+    attrs = xr.open_dataset(cachename, engine="zarr").attrs
+    stat = os.stat(path)
+    return (
+        (attrs.get("cache_version") == PLANET_CACHE_VERSION)
+        and (attrs.get("source_size") == stat.st_size)
+        and (attrs.get("source_mtime_ns") == stat.st_mtime_ns)
+    )
+
+
+def encode_planet_strings(ds):
+    """returns planet dataset with string (object) columns as fixed width
+    strings, missing values are marked by the 'missing_string' attribute,
+    see 'decode_planet_strings'"""
+    ds = ds.copy()
+    for name, var in ds.data_vars.items():
+        if var.dtype == object:
+            missing = var.isnull()
+            ds[name] = var.where(~missing, "").astype(str)
+            ds[name].attrs["missing_string"] = ""
+    return ds
+
+
+def decode_planet_strings(ds):
+    """returns planet dataset with missing values (NaN) of string columns
+    restored which were encoded by 'encode_planet_strings'"""
+    for name, var in ds.data_vars.items():
+        if "missing_string" in var.attrs:
+            missing = var == var.attrs["missing_string"]
+            values = var.values.astype(object)
+            values[missing.values] = np.nan
+            ds[name] = var.copy(data=values)
+            del ds[name].attrs["missing_string"]
+    return ds
+
+
+def write_planet_cache(path, cachename):
+    """parses planet csv file at 'path' and writes it sorted in time to
+    (columnar) zarr cache at 'cachename'"""
+    stat = os.stat(path)
+    ds = encode_planet_strings(read_planet_csv(path).sortby("time"))
+    ds.attrs["cache_version"] = PLANET_CACHE_VERSION
+    ds.attrs["source_size"] = stat.st_size
+    ds.attrs["source_mtime_ns"] = stat.st_mtime_ns
+    ds.chunk(time=4**7).to_zarr(cachename, mode="w")
+    print(f"Planet data cached in: {cachename}")
+
+
+def read_planet(path, timeframe=None, use_cache=True):
+    """Read planet data from csv file.
+
+    The csv file is parsed only once and cached as a zarr store next to it,
+    the cache is rewritten whenever the csv file changes. Only the rows within
+    'timeframe' are read from the cache.
+
+    Parameters:
+    -----------
+    path : str
+        Path to csv file.
+    timeframe : slice, optional
+        Timeframe to read, by default all data is read.
+    use_cache : bool, optional
+        Read from (and write) zarr cache, by default True.
+
+    Returns:
+    --------
+    xr.Dataset
+        Planet data as xarray dataset.
+    """
+    if use_cache:
+        cachename = get_planet_cachename(path)
+        if not is_valid_planet_cache(path, cachename):
+            write_planet_cache(path, cachename)
+        ds = xr.open_dataset(cachename, engine="zarr")
+        ds.attrs = {}
+    else:
+        ds = read_planet_csv(path)
+
+    if timeframe is not None:
+        ds = ds.sel(time=timeframe)
+
+    ds = ds.load()
+    if use_cache:
+        ds = decode_planet_strings(ds)
+    return ds
+
+
 def write_level1data_timeslice(
     hampdata: PostProcessedHAMPData, var, timeframe, ncfilename
 ):
@@ -127,37 +285,401 @@ def write_level1data_timeslice(
     )
 
 
+def merge_timeframes(timeframes):
+    """
+    merges overlapping timeframes into disjoint windows
+
+    Parameters
+    ----------
+    timeframes : list of slice(starttime, endtime)
+        timeframes to merge, open ends (None) are allowed
+
+    Returns
+    -------
+    list of tuple(slice, list of int)
+        merged windows (sorted by starttime) and the indices of the
+        timeframes they contain
+    """
+
+    def bounds(timeframe):
+        start = pd.Timestamp.min if timeframe.start is None else timeframe.start
+        stop = pd.Timestamp.max if timeframe.stop is None else timeframe.stop
+        return pd.Timestamp(start), pd.Timestamp(stop)
+
+    order = sorted(range(len(timeframes)), key=lambda i: bounds(timeframes[i]))
+    merged = []
+    for i in order:
+        start, stop = bounds(timeframes[i])
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+            merged[-1][2].append(i)
+        else:
+            merged.append([start, stop, [i]])
+
+    windows = []
+    for start, stop, members in merged:
+        start = None if start == pd.Timestamp.min else start
+        stop = None if stop == pd.Timestamp.max else stop
+        windows.append((slice(start, stop), members))
+
+    return windows
+
+
+def extract_level1data_timeslices(
+    hampdata: PostProcessedHAMPData, slice_requests, max_workers=4
+):
+    """
+    returns many slices of hampdata variables in memory. Overlapping time windows
+    of the same variable are merged so that each needed part of the source data
+    is read only once and then shared between all slices within it.
+
+    Parameters
+    ----------
+    hampdata : PostProcessedHAMPData
+        Level 1 post-processed HAMP dataset
+    slice_requests : list of tuple(str, slice)
+        (var, timeframe) of each slice
+    max_workers : int, optional
+        number of threads reading merged windows in parallel
+
+    Returns
+    -------
+    list of xr.Dataset
+        loaded slice of each request
+    """
+
+    def extract_window(var, window, members):
+        data = hampdata[var].sel(time=window).load()
+        return [(i, data.sel(time=timeframe)) for i, timeframe in members]
+
+    tasks = []
+    for var in dict.fromkeys(request[0] for request in slice_requests):
+        indices = [i for i, request in enumerate(slice_requests) if request[0] == var]
+        timeframes = [slice_requests[i][1] for i in indices]
+        for window, members in merge_timeframes(timeframes):
+            tasks.append((var, window, [(indices[m], timeframes[m]) for m in members]))
+
+    slices = [None] * len(slice_requests)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for window_slices in executor.map(lambda task: extract_window(*task), tasks):
+            for i, sliced in window_slices:
+                slices[i] = sliced
+
+    return slices
+
+
+def write_level1data_timeslices(
+    hampdata: PostProcessedHAMPData, slice_requests, max_workers=4, complevel=4
+):
+    """
+    writes many slices of hampdata variables to compressed .nc files, the
+    source data of overlapping slices is read only once (see
+    'extract_level1data_timeslices').
+
+    Parameters
+    ----------
+    hampdata : PostProcessedHAMPData
+        Level 1 post-processed HAMP dataset
+    slice_requests : list of tuple(str, slice, str or Path)
+        (var, timeframe, ncfilename) of each slice to write
+    max_workers : int, optional
+        number of threads reading merged windows and writing slices in parallel
+    complevel : int, optional
+        zlib compression level of .nc files
+
+    Returns
+    -------
+    dict
+        total number of bytes of the slices (in memory) and written to .nc files
+    """
+    slices = extract_level1data_timeslices(
+        hampdata, [request[:2] for request in slice_requests], max_workers
+    )
+
+    def write_slice(sliced, request):
+        var, _, ncfilename = request
+        sliced = sliced.drop_encoding()
+        encoding = {
+            name: {"zlib": True, "complevel": complevel} for name in sliced.data_vars
+        }
+        sliced.to_netcdf(ncfilename, encoding=encoding)
+        print(f"Timeslice of {var} data saved to: {ncfilename}")
+        return os.path.getsize(ncfilename)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        bytes_written = list(executor.map(write_slice, slices, slice_requests))
+
+    nbytes = {
+        "sliced": sum(sliced.nbytes for sliced in slices),
+        "written": sum(bytes_written),
+    }
+    print(
+        f"Wrote {len(slice_requests)} timeslices\n"
+        f"Data sliced = {int(nbytes['sliced'] / 1024 / 1024)}MB\n"
+        f"Data written = {int(nbytes['written'] / 1024 / 1024)}MB"
+    )
+
+    return nbytes
+
+
+def write_hampdata_store(hampdata: PostProcessedHAMPData, path, timeframe=None):
+    """
+    writes (Level 1 post-processed) hampdata to a single zarr store with one group
+    per instrument, a shared time index in the root group and consolidated metadata
+
+    Parameters
+    ----------
+    hampdata : PostProcessedHAMPData
+        Level 1 post-processed HAMP dataset
+    path : str or Path
+        path of zarr store to write, existing store is overwritten
+    timeframe : slice, optional
+        only write data within timeframe, by default whole flight is written
+    """
+    if timeframe is not None:
+        hampdata = hampdata.sel(timeframe, method=None)
+
+    groups = [group for group in HAMPDATA_STORE_GROUPS if hampdata[group] is not None]
+    time = np.unique(np.concatenate([hampdata[group].time.values for group in groups]))
+    root = xr.Dataset(coords={"time": time}, attrs={"groups": groups})
+    root.to_zarr(path, mode="w", consolidated=False)
+
+    for group in groups:
+        ds = hampdata[group].drop_encoding()
+        ds.to_zarr(path, group=group, mode="a", consolidated=False)
+    zarr.consolidate_metadata(str(path))
+
+    print(f"HAMP data with groups {groups} saved to: {path}")
+
+
+def read_hampdata_store(path) -> PostProcessedHAMPData:
+    """
+    reads (Level 1 post-processed) hampdata from single zarr store
+    written by 'write_hampdata_store'
+
+    Parameters
+    ----------
+    path : str or Path
+        path of zarr store to read
+
+    Returns
+    -------
+    PostProcessedHAMPData
+        Level 1 post-processed HAMP dataset, instruments not in store are None
+    """
+    hampdata = PostProcessedHAMPData(None, None, None)
+    root = xr.open_dataset(path, engine="zarr", consolidated=True)
+    for group in root.attrs["groups"]:
+        hampdata[group] = xr.open_dataset(
+            path, engine="zarr", group=group, consolidated=True
+        )
+
+    return hampdata
+
+
+def write_arts_bts(ds_bts, path):
+    """
+    writes ARTS and HAMP brightness temperatures of one or more flights to a
+    single campaign zarr store. New flights are appended along sonde_id,
+    flights already in the store are replaced.
+
+    Parameters
+    ----------
+    ds_bts : xr.Dataset
+        TB_arts and TB_hamp on (sonde_id, frequency) with coordinates
+        launch_time, flight and radar_cloud_flag along sonde_id
+    path : str or Path
+        path of zarr store, created if it does not exist
+    """
+    ds_bts = ds_bts.assign_coords(
+        sonde_id=ds_bts["sonde_id"].values.astype(str).astype(object),
+        flight=("sonde_id", ds_bts["flight"].values.astype(str).astype(object)),
+    )
+    ds_bts = ds_bts.assign(
+        TB_arts=ds_bts["TB_arts"].astype("float32"),
+        TB_hamp=ds_bts["TB_hamp"].astype("float32"),
+    )
+
+    if os.path.exists(path):
+        ds_store = xr.open_dataset(path, engine="zarr", consolidated=True)
+        if not np.array_equal(ds_store["frequency"], ds_bts["frequency"]):
+            raise ValueError(f"frequencies do not match frequencies in {path}")
+        rerun = np.isin(ds_store["flight"].values, ds_bts["flight"].values)
+        if not rerun.any():
+            ds_bts.to_zarr(path, append_dim="sonde_id", consolidated=True)
+            return
+        ds_bts = xr.concat(
+            [ds_store.isel(sonde_id=~rerun).load(), ds_bts], dim="sonde_id"
+        )
+        ds_store.close()
+
+    ds_bts.drop_encoding().to_zarr(path, mode="w", consolidated=True)
+
+
+def read_arts_bts(path):
+    """
+    lazily opens campaign zarr store written by 'write_arts_bts'
+
+    Parameters
+    ----------
+    path : str or Path
+        path of zarr store
+
+    Returns
+    -------
+    xr.Dataset
+        TB_arts and TB_hamp on (sonde_id, frequency) with coordinates
+        launch_time, flight and radar_cloud_flag along sonde_id
+    """
+    return xr.open_dataset(path, engine="zarr", consolidated=True, chunks={})
+
+
+def write_wind_statistics(ds_stats, path):
+    """
+    writes binned wind statistics of one or more flights (see
+    'dropsonde_wind_analyses.get_wind_statistics_cube') to a single campaign
+    zarr store. New flights are appended along flight, flights already in the
+    store are replaced.
+
+    Parameters
+    ----------
+    ds_stats : xr.Dataset
+        wind statistics on (flight, lat_bin, alt_bin)
+    path : str or Path
+        path of zarr store, created if it does not exist
+    """
+    ds_stats = ds_stats.assign_coords(
+        flight=ds_stats["flight"].values.astype(str).astype(object)
+    )
+
+    if os.path.exists(path):
+        ds_store = xr.open_dataset(path, engine="zarr", consolidated=True)
+        for dim in ["lat_bin", "alt_bin"]:
+            if not np.array_equal(ds_store[dim], ds_stats[dim]):
+                raise ValueError(f"{dim} does not match {dim} in {path}")
+        rerun = np.isin(ds_store["flight"].values, ds_stats["flight"].values)
+        if not rerun.any():
+            ds_stats.to_zarr(path, append_dim="flight", consolidated=True)
+            return
+        ds_stats = xr.concat(
+            [ds_store.isel(flight=~rerun).load(), ds_stats],
+            dim="flight",
+            data_vars="minimal",
+            coords="minimal",
+        )
+        ds_store.close()
+
+    ds_stats.drop_encoding().to_zarr(path, mode="w", consolidated=True)
+
+
+def read_wind_statistics(path):
+    """
+    opens campaign zarr store written by 'write_wind_statistics'
+
+    Parameters
+    ----------
+    path : str or Path
+        path of zarr store
+
+    Returns
+    -------
+    xr.Dataset
+        wind statistics on (flight, lat_bin, alt_bin)
+    """
+    return xr.open_dataset(path, engine="zarr", consolidated=True).load()
+
+
 def timeslice_all_level1hampdata(
     hampdata: PostProcessedHAMPData, timeframe, path_writedata
 ):
     """
-    writes slice of (Level 1 post-processed) hampdata variable 'var' from starttime
-    to endtime to a .nc file 'ncfilename'
+    writes slice of (Level 1 post-processed) hampdata from starttime
+    to endtime to a single zarr store 'hampdata_slice.zarr' in 'path_writedata'.
+    If timeframe is a list of slices, slice n is written to
+    'hampdata_slice_{n}.zarr' instead and overlapping timeframes are merged,
+    so that each needed part of hampdata is read only once (see
+    'extract_level1data_timeslices').
 
     Parameters
     ----------
     hampdata : PostProcessedHAMPData
         Level 1 post-processed HAMP dataset
-    timeframe : slice
-        Timeframe to plot.
+    timeframe : slice or list of slice
+        Timeframe(s) to plot.
+    path_writedata : Path
+        directory to write sliced data to
     """
-    for var in ["flightdata", "radar", "183", "11990", "kv", "cwv"]:
-        ncfilename = path_writedata / f"{var}_slice.nc"
-        write_level1data_timeslice(hampdata, var, timeframe, ncfilename)
+    if isinstance(timeframe, slice):
+        timeframes = [timeframe]
+        storenames = [Path(path_writedata) / "hampdata_slice.zarr"]
+    else:
+        timeframes = timeframe
+        storenames = [
+            Path(path_writedata) / f"hampdata_slice_{n}.zarr"
+            for n in range(len(timeframes))
+        ]
 
+    for window, members in merge_timeframes(timeframes):
+        hampdata_window = hampdata.sel(window, method=None)
+        for group in HAMPDATA_STORE_GROUPS:
+            if hampdata_window[group] is not None:
+                hampdata_window[group] = hampdata_window[group].load()
+        for n in members:
+            write_hampdata_store(
+                hampdata_window, storenames[n], timeframe=timeframes[n]
+            )
 
-def load_timeslice_all_level1hampdata(
-    path_slicedata, is_planet
-) -> PostProcessedHAMPData:
-    level1data = PostProcessedHAMPData(
-        None, None, None, None, None, None, is_planet=is_planet
-    )
 
-    for var in ["flightdata", "radar", "183", "11990", "kv", "cwv"]:
-        ncfilename = Path(path_slicedata) / f"{var}_slice.nc"
-        level1data[var] = xr.open_mfdataset(ncfilename)
+def load_timeslice_all_level1hampdata(path_slicedata, n=None) -> PostProcessedHAMPData:
+    """loads slice written by 'timeslice_all_level1hampdata', slice 'n' of a list
+    of timeframes if n is given"""
+    if n is None:
+        storename = Path(path_slicedata) / "hampdata_slice.zarr"
+    else:
+        storename = Path(path_slicedata) / f"hampdata_slice_{n}.zarr"
+    return read_hampdata_store(storename)
+
+
+def write_dropsonde_flight_partitions(
+    ds_dropsonde, path, time_name="launch_time", alt_chunksize=-1
+):
+    """
+    repartitions (Level 3) dropsondes into a zarr store with one group per flight
+    date (YYYYMMDD) and consolidated metadata, so that the dropsondes of a single
+    flight can be read without reading the whole campaign.
+
+    Parameters
+    ----------
+    ds_dropsonde : xr.Dataset
+        dropsondes of the whole campaign with dimensions 'sonde_id' and 'alt'
+    path : str or Path
+        path of zarr store to write, existing store is overwritten
+    time_name : str, optional
+        name of launch time variable, by default "launch_time"
+    alt_chunksize : int, optional
+        chunksize along 'alt', by default all levels in one chunk. Each chunk
+        holds all dropsondes of a flight.
+    """
+    launch_date = pd.to_datetime(ds_dropsonde[time_name].values).normalize()
+    dates = launch_date.dropna().unique().sort_values()
+    flight_dates = [date.strftime("%Y%m%d") for date in dates]
+
+    attrs = dict(ds_dropsonde.attrs)
+    attrs["partitioned_by"] = "flight_date"
+    attrs["flight_dates"] = flight_dates
+    root = xr.Dataset(attrs=attrs)
+    root.to_zarr(path, mode="w", consolidated=False)
 
-    return level1data
+    for date, group in zip(dates, flight_dates):
+        ds_flight = loadfuncs.select_dropsondes_in_timeframe(
+            ds_dropsonde, date, date + pd.Timedelta("24h"), time_name=time_name
+        )
+        ds_flight = ds_flight.drop_encoding().chunk(
+            {"sonde_id": -1, "alt": alt_chunksize}
+        )
+        ds_flight.to_zarr(path, group=group, mode="a", consolidated=False)
+        print(f"{ds_flight.sonde_id.size} dropsondes of {group} saved to: {path}")
+    zarr.consolidate_metadata(str(path))
 
 
 def get_dates():